@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Throughput of binlog2sql on synthetic workloads, without a MySQL server.
+
+Each case runs in its own process and reports rows/s, MB/s and the peak RSS of that process. The report
+is written as json; given a --baseline report, cases slower than it by more than --max-regression (or the
+baseline's own per-case "thresholds") are listed as regressions and the exit status is 1.
+
+usage: python benchmark/bench_suite.py [--rows N] [--output report.json] [--baseline old.json]
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import resource
+import multiprocessing
+from timeit import default_timer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'binlog2sql'))
+from binlog_generator import SyntheticTable
+from binlog2sql import Binlog2sql
+from binlog2sql_util import generate_sql_pattern, fix_object, concat_sql_from_binlog_event, reversed_lines, \
+    OfflineConnection, sql_pattern_cache, SegmentedTempFile, reversed_segment_lines, reversed_blocks, PY3PLUS, \
+    SqlPatternCache, event_type, compare_items
+from change_events import read_columnar
+from compact_rows import compact_rows
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+CASES = ['generate_sql_pattern', 'fix_object', 'concat_sql', 'legacy_reversed_lines', 'reversed_lines',
+         'reversed_segments', 'reversed_gzip_segments', 'rows_dict', 'rows_compact', 'forward', 'flashback', 'json',
+         'columnar', 'scan_sql', 'scan_json', 'scan_columnar']
+OUTPUT_FILES = {'sql': 'out.sql', 'json': 'out.json', 'columnar': 'out.col'}
+POSITION_RE = re.compile(r' #start (\d+) end (\d+) time ')
+
+
+def table(config):
+    return SyntheticTable(columns=config['columns'], types=config['types'], blob_size=config['blob_size'],
+                          null_density=config['null_density'], seed=config['seed'])
+
+
+def mixed_events(config):
+    """a third of the rows each of INSERT, UPDATE and DELETE events"""
+    events = []
+    for kind in ('INSERT', 'UPDATE', 'DELETE'):
+        events += table(config).events(kind, config['rows'] // 3)
+    return events
+
+
+def bench_generate_sql_pattern(config, tmp_dir):
+    events = mixed_events(config)
+    start = default_timer()
+    rows = 0
+    for event in events:
+        for row in event.rows:
+            generate_sql_pattern(event, row=row, flashback=config['flashback'])
+            rows += 1
+    return rows, 0, default_timer() - start
+
+
+def bench_fix_object(config, tmp_dir):
+    values = []
+    for event in mixed_events(config):
+        for row in event.rows:
+            for image in row.values():
+                values.extend(image.values())
+    start = default_timer()
+    for value in values:
+        fix_object(value)
+    return len(values), 0, default_timer() - start
+
+
+def bench_concat_sql(config, tmp_dir):
+    events = mixed_events(config)
+    cursor = OfflineConnection()
+    start = default_timer()
+    rows, size = (0, 0)
+    for event in events:
+        for row in event.rows:
+            sql = concat_sql_from_binlog_event(cursor, event, row=row, e_start_pos=4, flashback=config['flashback'])
+            rows += 1
+            size += len(sql)
+    return rows, size, default_timer() - start
+
+
+def flashback_lines(config):
+    cursor = OfflineConnection()
+    for event in mixed_events(config):
+        for row in event.rows:
+            sql = concat_sql_from_binlog_event(cursor, event, row=row, e_start_pos=4, flashback=True)
+            yield (sql + '\n').encode('utf-8')
+
+
+def legacy_reversed_lines(fin):
+    """reversed_lines before the block based rewrite, char by char, kept as the baseline of it. The original
+    fails on a multibyte char across a 4KB block, such chars are replaced here to run it on the same lines"""
+    part = ''
+    for block in reversed_blocks(fin, block_size=4096):
+        if PY3PLUS:
+            block = block.decode("utf-8", "replace")
+        for c in reversed(block):
+            if c == '\n' and part:
+                yield part[::-1]
+                part = ''
+            part += c
+    if part:
+        yield part[::-1]
+
+
+def reversed_file_lines(config, tmp_dir, reverse):
+    """flashback sql written to one file, read back last line first by reverse"""
+    filename = os.path.join(tmp_dir, 'flashback.sql')
+    with open(filename, 'wb') as f:
+        for line in flashback_lines(config):
+            f.write(line)
+    start = default_timer()
+    rows = 0
+    with open(filename, 'rb') as f:
+        for _ in reverse(f):
+            rows += 1
+    return rows, os.path.getsize(filename), default_timer() - start
+
+
+def bench_legacy_reversed_lines(config, tmp_dir):
+    return reversed_file_lines(config, tmp_dir, legacy_reversed_lines)
+
+
+def bench_reversed_lines(config, tmp_dir):
+    return reversed_file_lines(config, tmp_dir, reversed_lines)
+
+
+def reversed_segments(config, tmp_dir, compress):
+    """flashback sql written to SegmentedTempFile segments, as dump_binlog does, read back last line first"""
+    f_tmp = SegmentedTempFile(os.path.join(tmp_dir, 'flashback'), segment_size=config['segment_size'],
+                              compress=compress)
+    size = 0
+    for line in flashback_lines(config):
+        f_tmp.write(line)
+        size += len(line)
+    f_tmp.close()
+    start = default_timer()
+    rows = 0
+    for _ in reversed_segment_lines(f_tmp.segments):
+        rows += 1
+    return rows, size, default_timer() - start
+
+
+def bench_reversed_segments(config, tmp_dir):
+    return reversed_segments(config, tmp_dir, compress=False)
+
+
+def bench_reversed_gzip_segments(config, tmp_dir):
+    return reversed_segments(config, tmp_dir, compress=True)
+
+
+legacy_pattern_cache = SqlPatternCache()
+
+
+def legacy_dict_pattern(binlog_event, row, flashback=False):
+    """generate_sql_pattern before rows became CompactRows, kept as the baseline of it: the template is cached on
+    the columns and NULL mask read off the row dicts and values are mapped out of them. no_pk and key_columns
+    are left out"""
+    kind = event_type(binlog_event)
+    if kind == 'UPDATE':
+        where_values = row['after_values'] if flashback else row['before_values']
+        columns = (tuple(row['before_values'].keys()), tuple(row['after_values'].keys()))
+    else:
+        where_values = row['values']
+        columns = tuple(row['values'].keys())
+    has_where = kind == 'UPDATE' or (kind == 'INSERT') == bool(flashback)
+    null_mask = tuple(v is None for v in where_values.values()) if has_where else None
+    key = (binlog_event.schema, binlog_event.table, kind, flashback, columns, null_mask)
+    compiled = legacy_pattern_cache.get(key)
+    if compiled is None:
+        compiled = compile_legacy_dict_pattern(binlog_event, row, kind, flashback)
+        legacy_pattern_cache.put(key, compiled)
+    template, render = compiled
+    return {'template': template, 'values': render(row)}
+
+
+def compile_legacy_dict_pattern(binlog_event, row, kind, flashback):
+    table_name = '`%s`.`%s`' % (binlog_event.schema, binlog_event.table)
+    if kind == 'UPDATE':
+        set_image, where_image = ('before_values', 'after_values') if flashback else ('after_values', 'before_values')
+        template = 'UPDATE %s SET %s WHERE %s LIMIT 1;' % (
+            table_name, ', '.join(['`%s`=%%s' % k for k in row[set_image].keys()]),
+            ' AND '.join(map(compare_items, row[where_image].items())))
+
+        def render(r):
+            return list(map(fix_object, list(r[set_image].values()) + list(r[where_image].values())))
+        return template, render
+    if (kind == 'INSERT') != bool(flashback):
+        template = 'INSERT INTO %s(%s) VALUES (%s);' % (
+            table_name, ', '.join(['`%s`' % k for k in row['values'].keys()]), ', '.join(['%s'] * len(row['values'])))
+    else:
+        template = 'DELETE FROM %s WHERE %s LIMIT 1;' % (
+            table_name, ' AND '.join(map(compare_items, row['values'].items())))
+
+    def render(r):
+        return list(map(fix_object, r['values'].values()))
+    return template, render
+
+
+def rendered_rows(config, compact, sample=1000):
+    """Render a third of the rows each of INSERT, UPDATE and DELETE: as the dicts pymysqlreplication decodes
+    with legacy_dict_pattern, or as CompactRows with generate_sql_pattern. The bytes and memory blocks a row
+    takes, values included, are traced on the first `sample` rows of each kind only, tracing slows generating
+    them down a lot"""
+    events = []
+    traced = {'bytes_per_row': 0, 'blocks_per_row': 0}
+    for kind in ('INSERT', 'UPDATE', 'DELETE'):
+        synthetic = table(config)
+        event = synthetic.events(kind, 1)[0]
+        count = config['rows'] // 3
+        if tracemalloc:
+            tracemalloc.start()
+            (start, blocks) = (tracemalloc.get_traced_memory()[0], sys.getallocatedblocks())
+        rows = synthetic.rows(kind, min(sample, count))
+        if compact:
+            rows = compact_rows(event, rows)
+        if tracemalloc:
+            traced['bytes_per_row'] += tracemalloc.get_traced_memory()[0] - start
+            traced['blocks_per_row'] += sys.getallocatedblocks() - blocks
+            tracemalloc.stop()
+        rest = synthetic.rows(kind, count - len(rows))
+        events.append((event, list(rows) + list(compact_rows(event, rest) if compact else rest)))
+    render = generate_sql_pattern if compact else legacy_dict_pattern
+    start = default_timer()
+    for (event, rows) in events:
+        for row in rows:
+            render(event, row=row, flashback=config['flashback'])
+    seconds = default_timer() - start
+    if not tracemalloc:
+        return 3 * count, 0, seconds, {}
+    sampled = max(1, 3 * min(sample, count))
+    return 3 * count, 0, seconds, dict((name, value // sampled) for (name, value) in traced.items())
+
+
+def bench_rows_dict(config, tmp_dir):
+    return rendered_rows(config, compact=False)
+
+
+def bench_rows_compact(config, tmp_dir):
+    return rendered_rows(config, compact=True)
+
+
+def run_binlog2sql(config, tmp_dir, flashback, output_format='sql'):
+    """parse a third of the rows each as INSERT, UPDATE and DELETE binlog files, offline"""
+    binlog_dir = os.path.join(tmp_dir, 'binlog')
+    os.mkdir(binlog_dir)
+    schema_file = os.path.join(tmp_dir, 'schema.json')
+    size = 0
+    for (i, kind) in enumerate(('INSERT', 'UPDATE', 'DELETE')):
+        synthetic = table(config)
+        size += synthetic.write_binlog(os.path.join(binlog_dir, 'mysql-bin.%06d' % (i + 1)), kind,
+                                       config['rows'] // 3)
+    synthetic.write_schema(schema_file)
+    start = default_timer()
+    binlog2sql = Binlog2sql(connection_settings={'host': 'localhost', 'port': 3306, 'charset': 'utf8'},
+                            start_file='mysql-bin.000001', end_file='mysql-bin.000003', binlog_dir=binlog_dir,
+                            schema_file=schema_file, flashback=flashback, back_interval=0,
+                            sql_type=['INSERT', 'UPDATE', 'DELETE'], output_format=output_format,
+                            output_file=os.path.join(tmp_dir, OUTPUT_FILES[output_format]))
+    # the temp file of flashback goes to the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_dir)
+    try:
+        binlog2sql.process_binlog()
+    finally:
+        os.chdir(cwd)
+    seconds = default_timer() - start
+    rows = config['rows'] // 3 * 3
+    assert count_rows(tmp_dir, output_format) == rows, 'binlog2sql did not render every row'
+    return rows, size, seconds
+
+
+def count_rows(tmp_dir, output_format):
+    filename = os.path.join(tmp_dir, OUTPUT_FILES[output_format])
+    if output_format == 'columnar':
+        return sum(batch.rows for batch in read_columnar(filename))
+    with open(filename, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def bench_forward(config, tmp_dir):
+    return run_binlog2sql(config, tmp_dir, flashback=False)
+
+
+def bench_flashback(config, tmp_dir):
+    return run_binlog2sql(config, tmp_dir, flashback=True)
+
+
+def bench_json(config, tmp_dir):
+    return run_binlog2sql(config, tmp_dir, flashback=False, output_format='json')
+
+
+def bench_columnar(config, tmp_dir):
+    return run_binlog2sql(config, tmp_dir, flashback=False, output_format='columnar')
+
+
+def scan(config, tmp_dir, output_format):
+    """time a downstream analysis of the output: rows per type and the last end position"""
+    run_binlog2sql(config, tmp_dir, flashback=False, output_format=output_format)
+    filename = os.path.join(tmp_dir, OUTPUT_FILES[output_format])
+    types, end_pos = ({}, 0)
+    start = default_timer()
+    if output_format == 'columnar':
+        for batch in read_columnar(filename):
+            types[batch.type] = types.get(batch.type, 0) + batch.rows
+            end_pos = max([end_pos] + batch.column('end_pos'))
+    else:
+        with open(filename) as f:
+            for line in f:
+                if output_format == 'json':
+                    change = json.loads(line)
+                    sql_type, pos = (change['type'], change['end_pos'])
+                else:
+                    sql_type, pos = (line.split(' ', 1)[0], int(POSITION_RE.search(line).group(2)))
+                types[sql_type] = types.get(sql_type, 0) + 1
+                end_pos = max(end_pos, pos)
+    seconds = default_timer() - start
+    return sum(types.values()), os.path.getsize(filename), seconds
+
+
+def bench_scan_sql(config, tmp_dir):
+    return scan(config, tmp_dir, 'sql')
+
+
+def bench_scan_json(config, tmp_dir):
+    return scan(config, tmp_dir, 'json')
+
+
+def bench_scan_columnar(config, tmp_dir):
+    return scan(config, tmp_dir, 'columnar')
+
+
+def run_case(name, config):
+    """run one case in this (child) process"""
+    tmp_dir = tempfile.mkdtemp()
+    sql_pattern_cache.invalidate()
+    try:
+        # (rows, bytes, seconds), and a dict of more figures of the case if it has any
+        result = globals()['bench_' + name](config, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+    rows, size, seconds = result[:3]
+    seconds = max(seconds, 1e-9)
+    # kilobytes on linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss //= 1024
+    report = {'rows': rows, 'bytes': size, 'seconds': round(seconds, 6), 'rows_per_sec': round(rows / seconds, 1),
+              'mb_per_sec': round(size / seconds / 1024 / 1024, 3), 'peak_rss_kb': peak_rss}
+    if len(result) > 3:
+        report.update(result[3])
+    return report
+
+
+def compare(results, baseline, max_regression):
+    """cases of results slower than baseline by more than their threshold"""
+    regressions = []
+    thresholds = baseline.get('thresholds', {})
+    for (name, result) in sorted(results.items()):
+        old = baseline.get('results', {}).get(name)
+        if not old or not old.get('rows_per_sec'):
+            continue
+        threshold = thresholds.get(name, max_regression)
+        ratio = result['rows_per_sec'] / old['rows_per_sec']
+        if ratio < 1 - threshold:
+            regressions.append({'case': name, 'rows_per_sec': result['rows_per_sec'],
+                                'baseline_rows_per_sec': old['rows_per_sec'], 'ratio': round(ratio, 3),
+                                'threshold': threshold})
+    return regressions
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='binlog2sql benchmark suite')
+    parser.add_argument('--rows', type=int, default=30000, help='rows per case')
+    parser.add_argument('--columns', type=int, default=8, help='columns besides the primary key')
+    parser.add_argument('--types', type=str, nargs='+',
+                        default=['int', 'varchar', 'double', 'datetime', 'bigint', 'blob'],
+                        help='column types, used in turn: int bigint double varchar datetime blob (text), '
+                             'binary (arbitrary bytes) longblob (text)')
+    parser.add_argument('--blob-size', type=int, default=256,
+                        help='max bytes of a blob value, up to 65535 but for longblob')
+    parser.add_argument('--null-density', type=float, default=0.1, help='share of NULL values')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--flashback', action='store_true', default=False,
+                        help='render flashback sql in generate_sql_pattern and concat_sql')
+    parser.add_argument('--segment-size', type=int, default=1024 * 1024,
+                        help='bytes of a temp file segment in the reversed_*segments cases')
+    parser.add_argument('--cases', type=str, nargs='+', default=CASES, choices=CASES)
+    parser.add_argument('--output', type=str, default='', help='write the json report here instead of stdout')
+    parser.add_argument('--baseline', type=str, default='', help='json report to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='max share a case may be slower than --baseline. default 0.2')
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    config = {'rows': args.rows, 'columns': args.columns, 'types': args.types, 'blob_size': args.blob_size,
+              'null_density': args.null_density, 'seed': args.seed, 'flashback': args.flashback,
+              'segment_size': args.segment_size}
+    results = {}
+    for name in args.cases:
+        # a fresh process per case, so that peak RSS is the case's own
+        pool = multiprocessing.Pool(1)
+        try:
+            results[name] = pool.apply(run_case, (name, config))
+        finally:
+            pool.close()
+            pool.join()
+        sys.stderr.write('%-22s %12.0f rows/s %8.2f MB/s %8d KB\n' % (
+            name, results[name]['rows_per_sec'], results[name]['mb_per_sec'], results[name]['peak_rss_kb']))
+    report = {'config': config, 'results': results,
+              'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                              'cpus': multiprocessing.cpu_count()}}
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(results, json.load(f), args.max_regression)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
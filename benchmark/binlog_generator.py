@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic binlog workloads for the benchmarks: a table of configurable width, column types, BLOB size and
+NULL density, its rows as decoded row events, and binlog files with a matching schema snapshot to parse
+offline. Everything is derived from a seed, so runs are reproducible.
+"""
+
+import os
+import sys
+import json
+import zlib
+import binascii
+import random
+import struct
+import datetime
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'binlog2sql'))
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+
+# type: (mysql field type, metadata, COLUMN_TYPE, charset)
+COLUMN_TYPES = {
+    'int': (3, b'', 'int(11)', None),
+    'bigint': (8, b'', 'bigint(20)', None),
+    'double': (5, b'\x08', 'double', None),
+    'varchar': (15, struct.pack('<H', 765), 'varchar(255)', 'utf8'),
+    'datetime': (18, b'\x00', 'datetime', None),
+    'blob': (252, b'\x02', 'blob', None),
+    # arbitrary bytes, not utf-8 text
+    'binary': (252, b'\x02', 'blob', None),
+    'longblob': (252, b'\x04', 'longblob', None),
+}
+EVENT_TYPES = {'INSERT': (23, WriteRowsEvent), 'UPDATE': (24, UpdateRowsEvent), 'DELETE': (25, DeleteRowsEvent)}
+TIMESTAMP = 1481299200
+# bytes to printable ascii
+PRINTABLE = bytes(bytearray(32 + i % 95 for i in range(256)))
+TABLE_ID = 70
+
+
+class SyntheticTable(object):
+    """test.bench: an int primary key `id` followed by `columns` columns cycling through `types`"""
+
+    def __init__(self, columns=8, types=('int', 'varchar', 'double', 'datetime', 'bigint', 'blob'),
+                 blob_size=256, null_density=0.1, seed=0):
+        self.names = ['id'] + ['c%d' % i for i in range(columns)]
+        self.types = ['int'] + [types[i % len(types)] for i in range(columns)]
+        self.blob_size = blob_size
+        self.null_density = null_density
+        self.random = random.Random(seed)
+
+    def schema(self):
+        """schema snapshot of the table, as saved by --dump-schema-file"""
+        columns = []
+        for (name, type_) in zip(self.names, self.types):
+            charset = COLUMN_TYPES[type_][3]
+            columns.append({'COLUMN_NAME': name, 'COLLATION_NAME': charset and 'utf8_general_ci',
+                            'CHARACTER_SET_NAME': charset, 'COLUMN_COMMENT': '',
+                            'COLUMN_TYPE': COLUMN_TYPES[type_][2], 'COLUMN_KEY': 'PRI' if name == 'id' else ''})
+        return {'test': {'bench': columns}}
+
+    def value(self, type_):
+        r = self.random
+        if type_ == 'int':
+            return r.randint(-2 ** 31, 2 ** 31 - 1)
+        if type_ == 'bigint':
+            return r.randint(-2 ** 63, 2 ** 63 - 1)
+        if type_ == 'double':
+            return r.random() * 1e6
+        if type_ == 'varchar':
+            # some quotes and backslashes to escape, and multibyte chars
+            return u''.join(r.choice(u"abcdefghij klmnop'\\\"中文") for _ in range(r.randint(0, 64)))
+        if type_ == 'datetime':
+            return datetime.datetime(2016, 12, 10, 0, 0, 0) + datetime.timedelta(seconds=r.randint(0, 86400 * 365))
+        size = r.randint(0, self.blob_size if type_ == 'longblob' else min(self.blob_size, 65535))
+        value = binascii.unhexlify('%0*x' % (size * 2, r.getrandbits(size * 8))) if size else b''
+        # blob and longblob hold printable text
+        return value if type_ == 'binary' else value.translate(PRINTABLE)
+
+    def row_values(self, row_id):
+        values = {'id': row_id}
+        for (name, type_) in zip(self.names[1:], self.types[1:]):
+            values[name] = None if self.random.random() < self.null_density else self.value(type_)
+        return values
+
+    def rows(self, kind, count):
+        """row dicts as pymysqlreplication decodes them"""
+        if kind == 'UPDATE':
+            return [{'before_values': self.row_values(i), 'after_values': self.row_values(i)}
+                    for i in range(1, count + 1)]
+        return [{'values': self.row_values(i)} for i in range(1, count + 1)]
+
+    def events(self, kind, count, rows_per_event=100):
+        """decoded row events holding count rows, without a binlog behind them"""
+        event_class = EVENT_TYPES[kind][1]
+        rows = self.rows(kind, count)
+        events = []
+        for i in range(0, count, rows_per_event):
+            event = event_class.__new__(event_class)
+            event.schema, event.table, event.primary_key = ('test', 'bench', 'id')
+            event.timestamp = TIMESTAMP
+            event.packet = SyntheticPacket(4 + i)
+            # RowsEvent.rows decodes lazily into the name mangled _RowsEvent__rows
+            event._RowsEvent__rows = rows[i:i + rows_per_event]
+            events.append(event)
+        return events
+
+    def encode_value(self, type_, value):
+        if type_ == 'int':
+            return struct.pack('<i', value)
+        if type_ == 'bigint':
+            return struct.pack('<q', value)
+        if type_ == 'double':
+            return struct.pack('<d', value)
+        if type_ == 'varchar':
+            value = value.encode('utf-8')
+            return struct.pack('<H', len(value)) + value
+        if type_ == 'datetime':
+            ym = value.year * 13 + value.month
+            packed = (1 << 39) | (ym << 22) | (value.day << 17) | (value.hour << 12) | (value.minute << 6) \
+                | value.second
+            return struct.pack('>Q', packed)[3:]
+        if type_ == 'longblob':
+            return struct.pack('<I', len(value)) + value
+        return struct.pack('<H', len(value)) + value
+
+    def encode_image(self, values):
+        null_bits = 0
+        data = b''
+        for (i, (name, type_)) in enumerate(zip(self.names, self.types)):
+            if values[name] is None:
+                null_bits |= 1 << i
+            else:
+                data += self.encode_value(type_, values[name])
+        return bitmap(null_bits, len(self.names)) + data
+
+    def table_map(self):
+        metadata = b''.join(COLUMN_TYPES[type_][1] for type_ in self.types)
+        nullable = sum(1 << i for i in range(1, len(self.names)))
+        return struct.pack('<Q', TABLE_ID)[:6] + struct.pack('<H', 1) + b'\x04test\0' + b'\x05bench\0' \
+            + packed_int(len(self.names)) + bytes(bytearray(COLUMN_TYPES[t][0] for t in self.types)) \
+            + packed_int(len(metadata)) + metadata + bitmap(nullable, len(self.names))
+
+    def rows_event(self, kind, rows):
+        all_columns = bitmap((1 << len(self.names)) - 1, len(self.names))
+        body = struct.pack('<Q', TABLE_ID)[:6] + struct.pack('<H', 1) + packed_int(len(self.names)) + all_columns
+        if kind == 'UPDATE':
+            body += all_columns
+            for row in rows:
+                body += self.encode_image(row['before_values']) + self.encode_image(row['after_values'])
+        else:
+            for row in rows:
+                body += self.encode_image(row['values'])
+        return body
+
+    def write_binlog(self, filename, kind, count, rows_per_event=100, rows_per_transaction=1000):
+        """a binlog file of count rows in transactions of rows_per_transaction. Returns its size"""
+        writer = BinlogWriter()
+        writer.format_description()
+        rows = self.rows(kind, count)
+        for i in range(0, count, rows_per_transaction):
+            writer.query(b'BEGIN')
+            transaction = rows[i:i + rows_per_transaction]
+            for j in range(0, len(transaction), rows_per_event):
+                writer.event(19, self.table_map())
+                writer.event(EVENT_TYPES[kind][0], self.rows_event(kind, transaction[j:j + rows_per_event]))
+            writer.event(16, struct.pack('<Q', i))
+        with open(filename, 'wb') as f:
+            f.write(writer.data)
+        return len(writer.data)
+
+    def write_schema(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.schema(), f)
+
+
+class SyntheticPacket(object):
+    def __init__(self, log_pos):
+        self.log_pos = log_pos
+
+
+class BinlogWriter(object):
+    """events of a binlog file with CRC32 checksums"""
+
+    def __init__(self):
+        self.data = b'\xfebin'
+
+    def event(self, event_type, body):
+        event_size = 19 + len(body) + 4
+        header = struct.pack('<IBIIIH', TIMESTAMP, event_type, 1, event_size, len(self.data) + event_size, 0)
+        event = header + body
+        self.data += event + struct.pack('<I', zlib.crc32(event) & 0xffffffff)
+
+    def format_description(self):
+        body = struct.pack('<H', 4) + b'5.7.20-log'.ljust(50, b'\0') + struct.pack('<IB', TIMESTAMP, 19)
+        self.event(15, body + b'\0' * 38 + b'\x01')
+
+    def query(self, query, schema=b'test'):
+        self.event(2, struct.pack('<IIBHH', 1, 0, len(schema), 0, 0) + schema + b'\0' + query)
+
+
+def bitmap(bits, count):
+    return bytes(bytearray((bits >> (8 * i)) & 0xff for i in range((count + 7) // 8)))
+
+
+def packed_int(value):
+    if value < 251:
+        return struct.pack('<B', value)
+    return b'\xfc' + struct.pack('<H', value)
@@ -1,26 +1,114 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import sys
+import glob
+import time
+import codecs
+import shutil
 import datetime
+import multiprocessing
 import pymysql
 from pymysqlreplication import BinLogStreamReader
-from pymysqlreplication.event import QueryEvent, RotateEvent, FormatDescriptionEvent
-from binlog2sql_util import command_line_args, concat_sql_from_binlog_event, create_unique_file, temp_open, \
-    reversed_lines, is_dml_event, event_type
+from pymysqlreplication.event import QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, GtidEvent, StopEvent
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from binlog2sql_util import command_line_args, concat_sql_from_binlog_event, create_unique_file, \
+    SegmentedTempFile, reversed_segment_lines, open_segment, is_dml_event, event_type, invalidate_sql_pattern_cache, \
+    OfflineConnection, SqlBatcher, concat_batch_sql_from_binlog_event, row_key, row_sql_parts, ddl_event_table, \
+    primary_key_columns, ColumnProjection, HEX_BYTES, generate_sql_pattern, fix_object
+from binlog_file_reader import BinLogFileReader, SchemaSnapshot
+from binlog_time_index import BinlogTimeIndex, TimeIndexBuilder, binlog_fingerprint
+from sql_applier import SqlApplier, query_record
+from sql_output import open_sink
+from binlog_checkpoint import Checkpoint
+from binlog_pipeline import PrefetchStream, PipelineWriter, QueueMonitor
+from binlog_metrics import BinlogMetrics, MeteredOutput, MetricsReporter
+from table_keys import TableKeyCache, server_table_keys, snapshot_table_keys, table_fingerprint
+from row_compactor import RowCompactor
+from binlog_range import BinlogRange, BinlogIndexCache, local_binlog_index
+from compact_rows import compact_row
+from binlog_statements import Statement, FLASHBACK_TYPES
+from change_events import OUTPUT_FORMATS, JsonChanges, ColumnarWriter
 
 
 class Binlog2sql(object):
 
     def __init__(self, connection_settings, start_file=None, start_pos=None, end_file=None, end_pos=None,
                  start_time=None, stop_time=None, only_schemas=None, only_tables=None, no_pk=False,
-                 flashback=False, stop_never=False, back_interval=1.0, only_dml=True, sql_type=None):
+                 flashback=False, stop_never=False, back_interval=1.0, only_dml=True, sql_type=None,
+                 binlog_dir=None, schema_file=None, jobs=1, time_index_dir=None, batch_rows=0,
+                 batch_bytes=1024 * 1024, tmp_segment_size=64 * 1024 * 1024, tmp_compress=False,
+                 apply_settings=None, apply_workers=1, apply_commit_every=1000, apply_rows_per_second=0,
+                 output_file=None, output_buffer_size=1024 * 1024, output_rotate_bytes=0, output_rotate_seconds=0,
+                 output_compress=None, checkpoint_file=None, checkpoint_events=1000, checkpoint_seconds=5.0,
+                 resume=False, pipeline=False, queue_size=1000, render_processes=0, queue_stats_interval=0,
+                 progress=False, stats_file=None, metrics_port=None, metrics_bind='127.0.0.1',
+                 metrics_interval=10.0, where_key_only=False, table_keys_file=None, compact=False,
+                 compact_memory=256 * 1024 * 1024, columns=None,
+                 hex_bytes=HEX_BYTES, binlog_index_cache=None, binlog_index_ttl=60.0, binlog_index=None,
+                 output_format='sql', columnar_batch_rows=10000):
         """
         conn_setting: {'host': 127.0.0.1, 'port': 3306, 'user': user, 'passwd': passwd, 'charset': 'utf8'}
+        binlog_dir: parse local binlog files in this directory instead of the server, using schema_file
+        jobs: number of processes dumping binlog files in parallel
+        time_index_dir: keep timestamp -> position indexes of binlog files here, to seek to start_time
+        batch_rows: merge up to batch_rows rows of a table in one transaction into one statement
+        tmp_segment_size, tmp_compress: temp files are split in segments of this size, optionally gzipped
+        apply_settings: execute sql on this server instead of printing it, with apply_workers connections
+            committing every apply_commit_every statements, at most apply_rows_per_second rows per second
+        output_file: write sql to this file instead of stdout, rotated every output_rotate_bytes or
+            output_rotate_seconds, compressed with output_compress ('gzip' or 'zstd')
+        checkpoint_file: save the last written transaction boundary here every checkpoint_events events or
+            checkpoint_seconds seconds. resume: start from the saved boundary instead of start_file/start_pos
+        pipeline: fetch events, render and write sql in separate threads with queues of queue_size, rendering
+            rows in render_processes processes if set. queue_stats_interval: print queue depths to stderr
+        progress, stats_file, metrics_port: every metrics_interval seconds print a progress line to stderr, save
+            metrics to stats_file as json; serve them in prometheus format on metrics_port of the metrics_bind
+            address
+        where_key_only: UPDATE and DELETE match rows on their primary or unique key only, when the table has one.
+            Keys are looked up once per table and kept in table_keys_file between runs if set, while the
+            table's columns and primary key stay the same
+        compact: write one statement per primary key with the net change of the row over the range, keeping
+            row states in memory up to compact_memory bytes and in a temp sqlite file beyond
+        columns: only write these columns of rows, and the columns identifying them. Not with flashback
+        hex_bytes: write binary values of this many bytes or more, and those not utf-8 text, as hex literals
+        binlog_index_cache: keep the server's binlog list in this file, used for binlog_index_ttl seconds
+        binlog_index: [(binlog, size)] of the binlog files up to the one being written, instead of asking for it
+        output_format: sql, json (a line per change of a row or query) or columnar (batches of columns of the
+            changes of rows, columnar_batch_rows rows at most, to output_file)
         """
 
+        self.checkpoint = Checkpoint(checkpoint_file, every_events=checkpoint_events,
+                                     every_seconds=checkpoint_seconds) if checkpoint_file else None
+        self.resume_state = self.checkpoint.load() if self.checkpoint and resume else None
+        if self.resume_state:
+            start_file, start_pos = (self.resume_state['log_file'], self.resume_state['log_pos'])
         if not start_file:
             raise ValueError('Lack of parameter: start_file')
+        if checkpoint_file and flashback:
+            raise ValueError('Only one of checkpoint_file or flashback can be set')
+        if checkpoint_file and jobs and jobs > 1:
+            # workers dump their binlog files apart, a checkpoint of one would not describe the merged output
+            raise ValueError('Only one of checkpoint_file or jobs can be set')
+        if columns and flashback:
+            # the rollback INSERT of a DELETE would restore the kept columns only
+            raise ValueError('Only one of columns or flashback can be set')
+        if apply_settings and batch_rows > 1:
+            raise ValueError('Only one of apply or batch_rows can be set')
+        if (progress or stats_file or metrics_port) and jobs and jobs > 1:
+            raise ValueError('Only one of jobs or metrics can be set')
+        if compact and (stop_never or checkpoint_file or batch_rows > 1 or (jobs and jobs > 1)):
+            raise ValueError('compact can not be used with stop_never, checkpoint_file, batch_rows or jobs')
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError('unknown output format: %s' % output_format)
+        if output_format != 'sql' and (apply_settings or batch_rows > 1 or compact):
+            raise ValueError('%s output can not be used with apply, batch_rows or compact' % output_format)
+        if output_format == 'columnar' and (not output_file or flashback or (jobs and jobs > 1) or pipeline
+                                            or render_processes or checkpoint_file or output_rotate_bytes
+                                            or output_rotate_seconds):
+            raise ValueError('columnar output needs output_file, and can not be used with flashback, jobs, '
+                             'pipeline, checkpoint_file or rotation')
 
         self.conn_setting = connection_settings
         self.start_file = start_file
@@ -41,37 +129,307 @@ class Binlog2sql(object):
         self.no_pk, self.flashback, self.stop_never, self.back_interval = (no_pk, flashback, stop_never, back_interval)
         self.only_dml = only_dml
         self.sql_type = [t.upper() for t in sql_type] if sql_type else []
+        self.jobs = jobs if jobs and not stop_never else 1
+        self.batch_rows, self.batch_bytes = (batch_rows, batch_bytes)
+        self.tmp_segment_size, self.tmp_compress = (tmp_segment_size, tmp_compress)
+        self.apply_settings, self.apply_workers = (apply_settings, apply_workers)
+        self.apply_commit_every, self.apply_rows_per_second = (apply_commit_every, apply_rows_per_second)
+        self.output_file, self.output_buffer_size = (output_file, output_buffer_size)
+        self.output_rotate_bytes, self.output_rotate_seconds = (output_rotate_bytes, output_rotate_seconds)
+        self.output_compress = output_compress
+        self.pipeline = pipeline or render_processes > 0
+        self.queue_size, self.render_processes = (queue_size, render_processes)
+        self.queue_stats_interval = queue_stats_interval
+        self.progress, self.stats_file, self.metrics_port = (progress, stats_file, metrics_port)
+        self.metrics_bind, self.metrics_interval = (metrics_bind, metrics_interval)
+        self.metrics = None
+        self.where_key_only, self.table_keys_file = (where_key_only, table_keys_file)
+        self.table_keys = TableKeyCache(self.load_table_keys, filename=table_keys_file) if where_key_only else None
+        self.compact, self.compact_memory = (compact, compact_memory)
+        self.compactor = None
+        self.columns = columns
+        self.projection = ColumnProjection(columns) if columns else None
+        self.hex_bytes = hex_bytes
+        self.output_format, self.columnar_batch_rows = (output_format, columnar_batch_rows)
 
-        self.binlogList = []
-        self.connection = pymysql.connect(**self.conn_setting)
+        self.binlog_dir, self.schema_file = (binlog_dir, schema_file)
+        self.time_index_dir = time_index_dir
+        self.index_cache = BinlogIndexCache(binlog_index_cache, ttl=binlog_index_ttl) if binlog_index_cache else None
+        if self.binlog_dir:
+            self.init_offline(schema_file)
+            if binlog_index is None:
+                binlog_index = local_binlog_index(self.binlog_dir, self.start_file)
+        else:
+            self.connection = pymysql.connect(**self.conn_setting)
+            with self.connection as cursor:
+                if binlog_index is None:
+                    binlog_index = self.read_binlog_index(cursor)
+                cursor.execute("SELECT @@server_id")
+                self.server_id = cursor.fetchone()[0]
+                if not self.server_id:
+                    raise ValueError('missing server_id in %s:%s' % (self.conn_setting['host'],
+                                                                     self.conn_setting['port']))
+        self.set_binlog_index(binlog_index)
+
+    def read_binlog_index(self, cursor):
+        """[(binlog, size)] of the server's binlog files, the last one's size being where it is written up to.
+        Taken from the index cache while it holds"""
+        cursor.execute("SHOW MASTER STATUS")
+        eof_file, eof_pos = cursor.fetchone()[:2]
+        server = '%s:%s' % (self.conn_setting['host'], self.conn_setting['port'])
+        binlog_index = self.index_cache.get(server, eof_file) if self.index_cache else None
+        if binlog_index is None:
+            cursor.execute("SHOW BINARY LOGS")
+            binlog_index = [(row[0], row[1] if len(row) > 1 else None) for row in cursor.fetchall()]
+            if self.index_cache:
+                self.index_cache.put(server, binlog_index)
+        return [(binlog, eof_pos if binlog == eof_file else size) for (binlog, size) in binlog_index]
+
+    def set_binlog_index(self, binlog_index):
+        """plan the range to dump in binlog_index, the last binlog of which ends the range if end_pos is unset"""
+        self.binlog_index = binlog_index
+        self.eof_file, self.eof_pos = binlog_index[-1]
+        self.binlog_range_plan = BinlogRange(binlog_index, self.start_file, self.start_pos, self.end_file,
+                                             self.end_pos, eof=(self.eof_file, self.eof_pos))
+        self.binlogList = self.binlog_range_plan.binlogs()
+
+    def init_offline(self, schema_file):
+        """offline mode: table schemas come from a local file instead of the server, as binlog files do"""
+        if not schema_file:
+            raise ValueError('Lack of parameter: schema_file')
+        self.schema_snapshot = SchemaSnapshot.load(schema_file, charset=self.conn_setting.get('charset', 'utf8'))
+        self.connection = OfflineConnection(charset=self.schema_snapshot.charset)
+        self.server_id = None
+
+    def load_table_keys(self, schema, table):
+        if self.binlog_dir:
+            return snapshot_table_keys(self.schema_snapshot, schema, table)
         with self.connection as cursor:
-            cursor.execute("SHOW MASTER STATUS")
-            self.eof_file, self.eof_pos = cursor.fetchone()[:2]
-            cursor.execute("SHOW MASTER LOGS")
-            bin_index = [row[0] for row in cursor.fetchall()]
-            if self.start_file not in bin_index:
-                raise ValueError('parameter error: start_file %s not in mysql server' % self.start_file)
-            binlog2i = lambda x: x.split('.')[1]
-            for binary in bin_index:
-                if binlog2i(self.start_file) <= binlog2i(binary) <= binlog2i(self.end_file):
-                    self.binlogList.append(binary)
-
-            cursor.execute("SELECT @@server_id")
-            self.server_id = cursor.fetchone()[0]
-            if not self.server_id:
-                raise ValueError('missing server_id in %s:%s' % (self.conn_setting['host'], self.conn_setting['port']))
+            return server_table_keys(cursor, schema, table)
+
+    def table_key_columns(self, binlog_event):
+        """key columns of the table of a rows event, from the table key cache"""
+        return self.table_keys.get(binlog_event.schema, binlog_event.table,
+                                   fingerprint=lambda: table_fingerprint(binlog_event))
+
+    def open_stream(self, log_file=None, log_pos=None, only_events=None):
+        log_file = log_file if log_file else self.start_file
+        log_pos = log_pos if log_pos else self.start_pos
+        if self.binlog_dir:
+            return BinLogFileReader(self.binlogList[self.binlogList.index(log_file):], self.schema_snapshot,
+                                    log_dir=self.binlog_dir, log_pos=log_pos, only_events=only_events,
+                                    only_schemas=self.only_schemas, only_tables=self.only_tables)
+        return BinLogStreamReader(connection_settings=self.conn_setting, server_id=self.server_id,
+                                  log_file=log_file, log_pos=log_pos, only_events=only_events,
+                                  only_schemas=self.only_schemas, only_tables=self.only_tables,
+                                  resume_stream=True, blocking=True)
+
+    def stream_events(self):
+        """event classes dump_events uses. Rows events of other sql types are dropped by the stream before
+        their rows are decoded"""
+        events = [QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, GtidEvent, StopEvent]
+        for (sql_type, event_class) in (('INSERT', WriteRowsEvent), ('UPDATE', UpdateRowsEvent),
+                                        ('DELETE', DeleteRowsEvent)):
+            if sql_type in self.sql_type:
+                events.append(event_class)
+        return events
+
+    def binlog_size(self, binlog):
+        if self.binlog_dir:
+            return os.path.getsize(os.path.join(self.binlog_dir, binlog))
+        return self.binlog_range_plan.sizes.get(binlog)
+
+    def read_fingerprint(self, binlog):
+        stream = self.open_stream(log_file=binlog, log_pos=4, only_events=[FormatDescriptionEvent])
+        try:
+            for binlog_event in stream:
+                return binlog_fingerprint(binlog_event)
+        finally:
+            stream.close()
+
+    def seek_start_time(self):
+        """skip binlog files and positions older than start_time, using time indexes of earlier runs"""
+        start_timestamp = time.mktime(self.start_time.timetuple())
+        for binlog in list(self.binlogList):
+            index = BinlogTimeIndex.load(self.time_index_dir, binlog)
+            if index is None or not index.is_valid(self.read_fingerprint(binlog), self.binlog_size(binlog)):
+                return
+            if index.complete and index.max_timestamp < start_timestamp and binlog != self.binlogList[-1]:
+                # every event of this file is older than start_time
+                self.binlogList.remove(binlog)
+                self.start_file, self.start_pos = (self.binlogList[0], 4)
+                self.binlog_range_plan.seek(self.start_file, self.start_pos)
+                continue
+            self.start_pos = max(self.start_pos, index.seek_position(start_timestamp))
+            self.binlog_range_plan.seek(self.start_file, self.start_pos)
+            return
 
     def process_binlog(self):
-        stream = BinLogStreamReader(connection_settings=self.conn_setting, server_id=self.server_id,
-                                    log_file=self.start_file, log_pos=self.start_pos, only_schemas=self.only_schemas,
-                                    only_tables=self.only_tables, resume_stream=True, blocking=True)
+        if self.time_index_dir and not self.stop_never:
+            self.seek_start_time()
+        reporter = self.open_metrics()
+        if self.compact:
+            spill_file = create_unique_file('%s.%s.compact' % (self.conn_setting['host'], self.conn_setting['port']))
+            self.compactor = RowCompactor(spill_file, memory_bytes=self.compact_memory)
+        f_out = self.open_output()
+        try:
+            if self.jobs > 1 and len(self.binlogList) > 1:
+                return self.process_binlog_parallel(f_out)
+
+            if not self.flashback:
+                self.dump_binlog(f_out)
+                return True
+            # to simplify code, we do not use flock for tmp_file.
+            tmp_file = create_unique_file('%s.%s' % (self.conn_setting['host'], self.conn_setting['port']))
+            with self.open_tmp_file(tmp_file) as f_tmp:
+                self.dump_binlog(f_tmp)
+                f_tmp.close()
+                self.print_rollback_sql(filename=f_tmp.segments, f_out=f_out)
+            return True
+        finally:
+            f_out.close()
+            if reporter:
+                reporter.stop()
+            if self.table_keys:
+                self.table_keys.save()
+            if self.compactor:
+                self.compactor.close()
+
+    def iter_statements(self):
+        """Generate a Statement for every statement of the range instead of printing sql, for use as a library.
+
+        The stream is read as statements are taken, so a slow consumer holds up reading rather than piling them
+        up. In flashback mode the range is read into a temp file first, then statements come last first from it.
+        Options shaping printed output (jobs, batch_rows, compact, pipeline, apply) are not supported.
+        """
+        if self.jobs > 1 or self.batch_rows > 1 or self.compact or self.pipeline or self.apply_settings:
+            raise ValueError('iter_statements does not support jobs, batch_rows, compact, pipeline or apply')
+        if self.time_index_dir and not self.stop_never:
+            self.seek_start_time()
+        if self.flashback:
+            return self.reversed_statements()
+        return self.statements(self.open_stream(only_events=self.stream_events()))
+
+    def statements(self, stream):
+        """Statements of the events of stream in the range, in binlog order"""
+        table_keys = self.table_keys
+        connection = OfflineConnection(charset=self.connection.charset, hex_bytes=self.hex_bytes)
+        try:
+            for (binlog_event, e_start_pos) in self.range_events(stream):
+                if isinstance(binlog_event, QueryEvent) and binlog_event.query != 'BEGIN':
+                    invalidate_sql_pattern_cache(binlog_event, table_keys)
+                    sql = concat_sql_from_binlog_event(cursor=connection, binlog_event=binlog_event,
+                                                       flashback=self.flashback) if not self.only_dml else ''
+                    if sql:
+                        # the table of DDL when the query names it
+                        schema, table = ddl_event_table(binlog_event) or (fix_object(binlog_event.schema), None)
+                        yield Statement(stream.log_file, e_start_pos, binlog_event.packet.log_pos,
+                                        binlog_event.timestamp, schema, table, 'QUERY', sql, sql=sql)
+                elif is_dml_event(binlog_event) and event_type(binlog_event) in self.sql_type:
+                    key_columns, identity, rows = self.event_rows(binlog_event, binlog_event.rows)
+                    sql_type = event_type(binlog_event)
+                    if self.flashback:
+                        sql_type = FLASHBACK_TYPES[sql_type]
+                    for row in rows:
+                        pattern = generate_sql_pattern(binlog_event, row=row, flashback=self.flashback,
+                                                       no_pk=self.no_pk, key_columns=key_columns)
+                        yield Statement(stream.log_file, e_start_pos, binlog_event.packet.log_pos,
+                                        binlog_event.timestamp, binlog_event.schema, binlog_event.table, sql_type,
+                                        pattern['template'], pattern['values'], row=row, connection=connection)
+        finally:
+            stream.close()
+            if table_keys:
+                table_keys.save()
+
+    def reversed_statements(self):
+        """Statements of the range last first, read back lazily from a temp file of the range"""
+        connection = OfflineConnection(charset=self.connection.charset, hex_bytes=self.hex_bytes)
+        tmp_file = create_unique_file('%s.%s' % (self.conn_setting['host'], self.conn_setting['port']))
+        with self.open_tmp_file(tmp_file) as f_tmp:
+            for statement in self.statements(self.open_stream(only_events=self.stream_events())):
+                f_tmp.write(statement.dumps() + '\n')
+            f_tmp.close()
+            for line in reversed_segment_lines(f_tmp.segments):
+                yield Statement.loads(line, connection=connection)
+
+    def open_metrics(self):
+        """start collecting metrics if any way to report them is set, return their MetricsReporter"""
+        if not (self.progress or self.stats_file or self.metrics_port):
+            return None
+        # the end of a --stop-never dump is unknown
+        self.metrics = BinlogMetrics([] if self.stop_never else self.binlog_range(), start_pos=self.start_pos,
+                                     inline_write=not self.pipeline)
+        return MetricsReporter(self.metrics, interval=self.metrics_interval, progress=self.progress,
+                               stats_file=self.stats_file, port=self.metrics_port if self.metrics_port else None,
+                               bind=self.metrics_bind)
+
+    def binlog_range(self):
+        """(binlog, size) of the files to dump, size being where the dump stops in it, None if unknown"""
+        return self.binlog_range_plan.stops()
+
+    def open_output(self):
+        """where sql goes: a buffered sink of stdout or output_file, or an SqlApplier executing it. Columnar
+        output goes to a ColumnarWriter instead"""
+        if self.output_format == 'columnar':
+            return ColumnarWriter(self.output_file, batch_rows=self.columnar_batch_rows,
+                                  compress=self.output_compress)
+        if not self.apply_settings:
+            return open_sink(self.output_file, buffer_size=self.output_buffer_size,
+                             rotate_bytes=self.output_rotate_bytes, rotate_seconds=self.output_rotate_seconds,
+                             compress=self.output_compress,
+                             resume=self.resume_state.get('output') if self.resume_state else None)
+        return SqlApplier(self.apply_settings, workers=self.apply_workers, commit_every=self.apply_commit_every,
+                          rows_per_second=self.apply_rows_per_second)
+
+    def open_tmp_file(self, prefix):
+        return SegmentedTempFile(prefix, segment_size=self.tmp_segment_size, compress=self.tmp_compress)
+
+    def dump_binlog(self, f_out):
+        """write sql of the binlog range to f_out. In flashback mode rollback sql is written in binlog order.
 
+        In apply mode every row is prefixed with its SqlApplier key and a tab, and every query is a query_record.
+        """
+        stream = self.open_stream(only_events=self.stream_events())
+        if self.metrics:
+            f_out = MeteredOutput(f_out, self.metrics)
+        if not self.pipeline:
+            return self.dump_events(stream, f_out)
+
+        stream = PrefetchStream(stream, queue_size=self.queue_size)
+        render_pool = multiprocessing.Pool(self.render_processes) if self.render_processes else None
+        writer = PipelineWriter(f_out, queue_size=self.queue_size, pool=render_pool,
+                                charset=self.conn_setting.get('charset', 'utf8'), hex_bytes=self.hex_bytes)
+        stages = stream.stages()
+        stages['write'] = writer
+        monitor = QueueMonitor(stages, self.queue_stats_interval) if self.queue_stats_interval else None
+        try:
+            self.dump_events(stream, writer, render_pool=render_pool)
+            writer.close()
+        finally:
+            if monitor:
+                monitor.stop()
+            stream.close()
+            if render_pool:
+                render_pool.terminate()
+                render_pool.join()
+
+    def range_events(self, stream):
+        """Generate (binlog_event, e_start_pos) for the events of stream in the range to dump, e_start_pos
+        being where the transaction of the event starts. Feeds the time index of the files read"""
+        metrics = self.metrics
         flag_last_event = False
+        binlogs = self.binlog_range_plan
         e_start_pos, last_pos = stream.log_pos, stream.log_pos
-        # to simplify code, we do not use flock for tmp_file.
-        tmp_file = create_unique_file('%s.%s' % (self.conn_setting['host'], self.conn_setting['port']))
-        with temp_open(tmp_file, "w") as f_tmp, self.connection as cursor:
-            for binlog_event in stream:
+        in_transaction = False
+        index_builder = TimeIndexBuilder(self.time_index_dir, stream.log_file, stream.log_pos) \
+            if self.time_index_dir else None
+        try:
+            for binlog_event in metrics.timed_events(stream) if metrics else stream:
+                if index_builder:
+                    index_builder.feed(binlog_event)
+                if isinstance(binlog_event, RotateEvent):
+                    # positions restart in the next binlog file
+                    last_pos = binlog_event.position
                 if not self.stop_never:
                     try:
                         event_time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
@@ -81,11 +439,13 @@ class Binlog2sql(object):
                             (stream.log_file == self.eof_file and stream.log_pos == self.eof_pos):
                         flag_last_event = True
                     elif event_time < self.start_time:
+                        if metrics:
+                            metrics.skip()
                         if not (isinstance(binlog_event, RotateEvent)
                                 or isinstance(binlog_event, FormatDescriptionEvent)):
                             last_pos = binlog_event.packet.log_pos
                         continue
-                    elif (stream.log_file not in self.binlogList) or \
+                    elif (stream.log_file not in binlogs) or \
                             (self.end_pos and stream.log_file == self.end_file and stream.log_pos > self.end_pos) or \
                             (stream.log_file == self.eof_file and stream.log_pos > self.eof_pos) or \
                             (event_time >= self.stop_time):
@@ -94,57 +454,257 @@ class Binlog2sql(object):
                     #     raise ValueError('unknown binlog file or position')
 
                 if isinstance(binlog_event, QueryEvent) and binlog_event.query == 'BEGIN':
+                    e_start_pos, in_transaction = (last_pos, True)
+                elif isinstance(binlog_event, QueryEvent) and binlog_event.query == 'COMMIT':
+                    in_transaction = False
+                elif isinstance(binlog_event, QueryEvent) and not in_transaction:
+                    # DDL is a transaction of its own. Statement-logged DML inside BEGIN ... COMMIT is not
                     e_start_pos = last_pos
+                elif isinstance(binlog_event, XidEvent):
+                    in_transaction = False
+                yield binlog_event, e_start_pos
 
-                if isinstance(binlog_event, QueryEvent) and not self.only_dml:
+                if not (isinstance(binlog_event, RotateEvent) or isinstance(binlog_event, FormatDescriptionEvent)):
+                    last_pos = binlog_event.packet.log_pos
+                if flag_last_event:
+                    break
+        finally:
+            if index_builder:
+                index_builder.finish()
+
+    def dump_events(self, stream, f_out, render_pool=None):
+        """the event loop of dump_binlog. With render_pool, f_out is a PipelineWriter rendering rows in it"""
+        apply_keys = bool(self.apply_settings)
+        checkpoint, metrics, table_keys = (self.checkpoint, self.metrics, self.table_keys)
+        compactor = self.compactor
+        changes = self.change_writer(f_out)
+
+        batcher = SqlBatcher(f_out, max_rows=self.batch_rows, max_bytes=self.batch_bytes, reverse=self.flashback) \
+            if self.batch_rows > 1 else None
+        # rows are rendered without the server, binary values as text or hex literals
+        with OfflineConnection(charset=self.connection.charset, hex_bytes=self.hex_bytes) as cursor:
+            for (binlog_event, e_start_pos) in self.range_events(stream):
+                if batcher and isinstance(binlog_event, (QueryEvent, XidEvent)):
+                    # batches never cross transaction boundaries
+                    batcher.flush()
+                if self.stop_never and isinstance(binlog_event, XidEvent):
+                    # the stream may block for long, show what we have of committed transactions
+                    f_out.flush()
+                if isinstance(binlog_event, QueryEvent) and binlog_event.query != 'BEGIN':
+                    if compactor and ddl_event_table(binlog_event) is not None:
+                        # row images before and after DDL do not compare
+                        self.write_compacted(cursor, f_out)
+                    invalidate_sql_pattern_cache(binlog_event, table_keys)
+
+                if isinstance(binlog_event, QueryEvent) and not self.only_dml and changes:
+                    changes.write_query(stream.log_file, binlog_event, e_start_pos)
+                elif isinstance(binlog_event, QueryEvent) and not self.only_dml:
                     sql = concat_sql_from_binlog_event(cursor=cursor, binlog_event=binlog_event,
                                                        flashback=self.flashback, no_pk=self.no_pk)
                     if sql:
-                        print(sql)
+                        f_out.write((query_record(sql) if apply_keys else sql) + '\n')
                 elif is_dml_event(binlog_event) and event_type(binlog_event) in self.sql_type:
-                    for row in binlog_event.rows:
+                    key_columns, identity, rows = self.event_rows(
+                        binlog_event, metrics.decode(binlog_event) if metrics else binlog_event.rows)
+                    for row in rows:
+                        if compactor and compactor.add(binlog_event, row, identity, e_start_pos):
+                            continue
+                        if changes:
+                            changes.write_row(stream.log_file, binlog_event, row, e_start_pos, key_columns)
+                            continue
+                        if batcher:
+                            if concat_batch_sql_from_binlog_event(cursor=cursor, batcher=batcher,
+                                                                  binlog_event=binlog_event, row=row,
+                                                                  e_start_pos=e_start_pos, flashback=self.flashback,
+                                                                  no_pk=self.no_pk):
+                                continue
+                            batcher.flush()
+                        if render_pool:
+                            template, values, position = row_sql_parts(binlog_event, row=row, e_start_pos=e_start_pos,
+                                                                       flashback=self.flashback, no_pk=self.no_pk,
+                                                                       key_columns=key_columns)
+                            f_out.render(row_key(binlog_event, row) + '\t' if apply_keys else '', template, values,
+                                         position)
+                            continue
                         sql = concat_sql_from_binlog_event(cursor=cursor, binlog_event=binlog_event, no_pk=self.no_pk,
-                                                           row=row, flashback=self.flashback, e_start_pos=e_start_pos)
-                        if self.flashback:
-                            f_tmp.write(sql + '\n')
-                        else:
-                            print(sql)
+                                                           row=row, flashback=self.flashback, e_start_pos=e_start_pos,
+                                                           key_columns=key_columns)
+                        if apply_keys:
+                            sql = row_key(binlog_event, row) + '\t' + sql
+                        f_out.write(sql + '\n')
+                    if metrics:
+                        metrics.rendered()
 
-                if not (isinstance(binlog_event, RotateEvent) or isinstance(binlog_event, FormatDescriptionEvent)):
-                    last_pos = binlog_event.packet.log_pos
-                if flag_last_event:
-                    break
+                if checkpoint and checkpoint.feed(binlog_event, stream.log_file):
+                    checkpoint.transaction_end(f_out)
 
+            if batcher:
+                batcher.flush()
+            if compactor:
+                self.write_compacted(cursor, f_out)
+            if checkpoint:
+                checkpoint.finish(f_out)
             stream.close()
-            f_tmp.close()
+
+    def event_rows(self, binlog_event, rows):
+        """(key_columns, identity, rows) of a row event: the key columns sql of it uses, None for its own primary
+        key, the columns identifying a row to --compact and --columns, and its decoded rows as CompactRows,
+        projected to --columns"""
+        key_columns = self.table_key_columns(binlog_event) if self.table_keys else None
+        identity = (key_columns or primary_key_columns(binlog_event)) if self.compactor or self.projection else None
+        # rendered from tuples from here on
+        rows = (compact_row(binlog_event, row) for row in rows)
+        if self.projection:
+            rows = (self.projection.project(binlog_event, row, identity) for row in rows)
+        return key_columns, identity, rows
+
+    def change_writer(self, f_out):
+        """what writes the changes of rows in place of their sql: a JsonChanges on f_out, or f_out itself when it
+        is a ColumnarWriter. None for sql"""
+        if self.output_format == 'json':
+            return JsonChanges(f_out, flashback=self.flashback, hex_bytes=self.hex_bytes)
+        if self.output_format == 'columnar':
+            return f_out
+        return None
+
+    def write_compacted(self, cursor, f_out):
+        """write the net change of the rows tracked by the compactor, and forget them.
+
+        Flashback sql is written first change first, as dump_binlog does, to be reversed with the rest.
+        """
+        for (binlog_event, row, e_start_pos) in self.compactor.net_rows():
+            key_columns = self.table_key_columns(binlog_event) if self.table_keys else None
+            sql = concat_sql_from_binlog_event(cursor=cursor, binlog_event=binlog_event, row=row, no_pk=self.no_pk,
+                                               flashback=self.flashback, e_start_pos=e_start_pos,
+                                               key_columns=key_columns)
+            if self.apply_settings:
+                sql = row_key(binlog_event, row) + '\t' + sql
+            f_out.write(sql + '\n')
+        self.compactor.clear()
+
+    def process_binlog_parallel(self, f_out):
+        """dump runs of binlog files of similar size in jobs processes, then merge outputs in binlog order
+        (reversed for flashback)"""
+        tasks = []
+        # more chunks than processes, so that a slow chunk does not hold up the others
+        for (first, last) in self.binlog_range_plan.chunks(self.jobs * 4):
+            kwargs = self.worker_settings(first, last)
+            tmp_file = create_unique_file('%s.%s.%s' % (self.conn_setting['host'], self.conn_setting['port'], first))
+            tasks.append((kwargs, tmp_file))
+
+        pool = multiprocessing.Pool(min(self.jobs, len(tasks)))
+        try:
             if self.flashback:
-                self.print_rollback_sql(filename=tmp_file)
+                results = pool.map(dump_binlog_file, tasks)
+                for (_, table_keys) in results:
+                    self.update_table_keys(table_keys)
+                self.print_rollback_sql(filename=sum([segments for (segments, _) in results], []), f_out=f_out)
+            else:
+                # imap keeps binlog order, so every file is printed as soon as it and its predecessors are done
+                for (segments, table_keys) in pool.imap(dump_binlog_file, tasks):
+                    self.update_table_keys(table_keys)
+                    for segment in segments:
+                        with open_segment(segment) as f_tmp:
+                            shutil.copyfileobj(codecs.getreader('utf-8')(f_tmp), f_out)
+        finally:
+            pool.close()
+            pool.join()
+            for (_, tmp_file) in tasks:
+                for segment in glob.glob(tmp_file + '.*'):
+                    os.remove(segment)
         return True
 
-    def print_rollback_sql(self, filename):
-        """print rollback sql from tmp_file"""
-        with open(filename, "rb") as f_tmp:
-            batch_size = 1000
-            i = 0
-            for line in reversed_lines(f_tmp):
-                print(line.rstrip())
-                if i >= batch_size:
-                    i = 0
-                    if self.back_interval:
-                        print('SELECT SLEEP(%s);' % self.back_interval)
-                else:
-                    i += 1
+    def update_table_keys(self, table_keys):
+        """keep the table keys a worker looked up, to be saved in table_keys_file"""
+        if self.table_keys and table_keys:
+            self.table_keys.update(table_keys)
+
+    def worker_settings(self, first, last=None):
+        """Binlog2sql arguments to dump the binlog files from first to last of the range"""
+        last = last if last else first
+        end_pos = None
+        if last == self.end_file and self.end_pos:
+            end_pos = self.end_pos
+        elif last == self.eof_file:
+            # stop at the eof seen now, like the serial run would
+            end_pos = self.eof_pos
+        return dict(connection_settings=self.conn_setting, start_file=first,
+                    start_pos=self.start_pos if first == self.start_file else 4, end_file=last, end_pos=end_pos,
+                    start_time=self.start_time.strftime("%Y-%m-%d %H:%M:%S"),
+                    stop_time=self.stop_time.strftime("%Y-%m-%d %H:%M:%S"), only_schemas=self.only_schemas,
+                    only_tables=self.only_tables, no_pk=self.no_pk, flashback=self.flashback,
+                    back_interval=self.back_interval, only_dml=self.only_dml, sql_type=self.sql_type,
+                    binlog_dir=self.binlog_dir, schema_file=self.schema_file, time_index_dir=self.time_index_dir,
+                    batch_rows=self.batch_rows, batch_bytes=self.batch_bytes,
+                    tmp_segment_size=self.tmp_segment_size, tmp_compress=self.tmp_compress,
+                    apply_settings=self.apply_settings, pipeline=self.pipeline, queue_size=self.queue_size,
+                    where_key_only=self.where_key_only, table_keys_file=self.table_keys_file, columns=self.columns,
+                    hex_bytes=self.hex_bytes, binlog_index=self.binlog_index, output_format=self.output_format)
+
+    def print_rollback_sql(self, filename, f_out=None):
+        """print rollback sql from tmp_file segments, last line first"""
+        f_out = f_out if f_out else sys.stdout
+        batch_size = 1000
+        lines = []
+        for line in reversed_segment_lines(filename):
+            lines.append(line.rstrip())
+            if len(lines) > batch_size:
+                # an SqlApplier throttles by apply_rows_per_second instead
+                if self.back_interval and not self.apply_settings and self.output_format == 'sql':
+                    lines.append('SELECT SLEEP(%s);' % self.back_interval)
+                f_out.write('\n'.join(lines) + '\n')
+                lines = []
+        if lines:
+            f_out.write('\n'.join(lines) + '\n')
 
     def __del__(self):
         pass
 
 
+def dump_binlog_file(task):
+    """process pool worker: dump one binlog file into tmp_file with its own connection and table map.
+    Returns the segments of tmp_file, and the table keys looked up for the parent to save"""
+    kwargs, tmp_file = task
+    binlog2sql = Binlog2sql(**kwargs)
+    f_tmp = binlog2sql.open_tmp_file(tmp_file)
+    try:
+        binlog2sql.dump_binlog(f_tmp)
+    finally:
+        f_tmp.close()
+    return f_tmp.segments, binlog2sql.table_keys.entries() if binlog2sql.table_keys else None
+
+
 if __name__ == '__main__':
     args = command_line_args(sys.argv[1:])
     conn_setting = {'host': args.host, 'port': args.port, 'user': args.user, 'passwd': args.password, 'charset': 'utf8'}
+    if args.dump_schema_file:
+        SchemaSnapshot.from_server(conn_setting, only_schemas=args.databases).save(args.dump_schema_file)
+        sys.exit(0)
+    apply_setting = None
+    if args.apply_host:
+        apply_setting = {'host': args.apply_host, 'port': args.apply_port, 'user': args.apply_user,
+                         'passwd': args.apply_password, 'charset': 'utf8'}
     binlog2sql = Binlog2sql(connection_settings=conn_setting, start_file=args.start_file, start_pos=args.start_pos,
                             end_file=args.end_file, end_pos=args.end_pos, start_time=args.start_time,
                             stop_time=args.stop_time, only_schemas=args.databases, only_tables=args.tables,
                             no_pk=args.no_pk, flashback=args.flashback, stop_never=args.stop_never,
-                            back_interval=args.back_interval, only_dml=args.only_dml, sql_type=args.sql_type)
+                            back_interval=args.back_interval, only_dml=args.only_dml, sql_type=args.sql_type,
+                            binlog_dir=args.binlog_dir, schema_file=args.schema_file, jobs=args.jobs,
+                            time_index_dir=args.time_index_dir, batch_rows=args.batch_rows,
+                            batch_bytes=args.batch_bytes, tmp_segment_size=args.tmp_segment_size,
+                            tmp_compress=args.tmp_compress, apply_settings=apply_setting,
+                            apply_workers=args.apply_workers, apply_commit_every=args.apply_commit_every,
+                            apply_rows_per_second=args.apply_rows_per_second, output_file=args.output_file,
+                            output_buffer_size=args.output_buffer_size, output_rotate_bytes=args.output_rotate_size,
+                            output_rotate_seconds=args.output_rotate_seconds, output_compress=args.output_compress,
+                            checkpoint_file=args.checkpoint_file, checkpoint_events=args.checkpoint_events,
+                            checkpoint_seconds=args.checkpoint_seconds, resume=args.resume_from_checkpoint,
+                            pipeline=args.pipeline, queue_size=args.queue_size, render_processes=args.render_processes,
+                            queue_stats_interval=args.queue_stats_interval, progress=args.progress,
+                            stats_file=args.stats_file, metrics_port=args.metrics_port, metrics_bind=args.metrics_bind,
+                            metrics_interval=args.metrics_interval, where_key_only=args.where_key_only,
+                            table_keys_file=args.table_keys_file, compact=args.compact,
+                            compact_memory=args.compact_memory, columns=args.columns, hex_bytes=args.hex_bytes,
+                            binlog_index_cache=args.binlog_index_cache, binlog_index_ttl=args.binlog_index_ttl,
+                            output_format=args.output_format, columnar_batch_rows=args.columnar_batch_rows)
     binlog2sql.process_binlog()
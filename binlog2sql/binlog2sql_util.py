@@ -2,17 +2,25 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import sys
+import gzip
+import zlib
 import argparse
+import binascii
 import datetime
 import getpass
+from collections import OrderedDict
+from operator import attrgetter
 from contextlib import contextmanager
+from pymysql.converters import escape_item, escape_string, encoders
 from pymysqlreplication.event import QueryEvent
 from pymysqlreplication.row_event import (
     WriteRowsEvent,
     UpdateRowsEvent,
     DeleteRowsEvent,
 )
+from compact_rows import RowColumns, CompactRow, compact_row
 
 
 if sys.version > '3':
@@ -20,6 +28,13 @@ if sys.version > '3':
 else:
     PY3PLUS = False
 
+DDL_RE = re.compile(r'^\s*(ALTER|CREATE|DROP|RENAME|TRUNCATE)\b', re.I)
+DDL_TABLE_RE = re.compile(r'^\s*(?:ALTER|CREATE|DROP|RENAME|TRUNCATE)\s+(?:(?:TEMPORARY|ONLINE|OFFLINE|IGNORE)\s+)*'
+                          r'TABLE\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?'
+                          r'(?:(?P<schema>`[^`]+`|\w+)\.)?(?P<table>`[^`]+`|\w+)', re.I)
+# binary values from this size on are written as hex literals
+HEX_BYTES = 4096
+
 
 def is_valid_datetime(string):
     try:
@@ -76,10 +91,90 @@ def parse_args():
                           help="Start time. format %%Y-%%m-%%d %%H:%%M:%%S", default='')
     interval.add_argument('--stop-datetime', dest='stop_time', type=str,
                           help="Stop Time. format %%Y-%%m-%%d %%H:%%M:%%S;", default='')
+    interval.add_argument('--time-index-dir', dest='time_index_dir', type=str, default='',
+                          help="Keep timestamp to position indexes of binlog files in this directory, "
+                               "so that later runs seek to --start-datetime instead of scanning from --start-file")
+    interval.add_argument('--binlog-index-cache', dest='binlog_index_cache', type=str, default='',
+                          help="Keep the server's list of binlog files and sizes in this file, so that later runs "
+                               "within --binlog-index-ttl skip SHOW BINARY LOGS")
+    interval.add_argument('--binlog-index-ttl', dest='binlog_index_ttl', type=float, default=60.0,
+                          help="Seconds a --binlog-index-cache entry is used for. default 60")
     parser.add_argument('--stop-never', dest='stop_never', action='store_true', default=False,
                         help="Continuously parse binlog. default: stop at the latest event when you start.")
+    parser.add_argument('--checkpoint-file', dest='checkpoint_file', type=str, default='',
+                        help="Save binlog file, position and gtid of the last written transaction to this file")
+    parser.add_argument('--checkpoint-events', dest='checkpoint_events', type=int, default=1000,
+                        help="Save --checkpoint-file at the first transaction end after this many events")
+    parser.add_argument('--checkpoint-seconds', dest='checkpoint_seconds', type=float, default=5.0,
+                        help="Save --checkpoint-file at the first transaction end after this many seconds")
+    parser.add_argument('--resume-from-checkpoint', dest='resume_from_checkpoint', action='store_true',
+                        default=False, help="Start from --checkpoint-file if it exists, instead of --start-file")
+    parser.add_argument('--jobs', dest='jobs', type=int, default=1,
+                        help="Number of processes parsing binlog files in parallel. Output keeps binlog order.")
+    parser.add_argument('--pipeline', dest='pipeline', action='store_true', default=False,
+                        help="Fetch events, render sql and write it in separate threads")
+    parser.add_argument('--queue-size', dest='queue_size', type=int, default=1000,
+                        help="Max events or sql chunks waiting between --pipeline stages. default 1000")
+    parser.add_argument('--render-processes', dest='render_processes', type=int, default=0,
+                        help="Render row sql in this many processes. Implies --pipeline. default 0: in the main thread")
+    parser.add_argument('--queue-stats-interval', dest='queue_stats_interval', type=float, default=0,
+                        help="Print --pipeline queue depths to stderr every this many seconds. default 0: never")
+
+    metrics = parser.add_argument_group('metrics')
+    metrics.add_argument('--progress', dest='progress', action='store_true', default=False,
+                         help="Print position, rows, rate, ETA and time per stage to stderr every --metrics-interval")
+    metrics.add_argument('--stats-file', dest='stats_file', type=str, default='',
+                         help="Save counters and timers as json to this file every --metrics-interval")
+    metrics.add_argument('--metrics-port', dest='metrics_port', type=int, default=0,
+                         help="Serve counters and timers in prometheus text format over http on this port")
+    metrics.add_argument('--metrics-bind', dest='metrics_bind', type=str, default='127.0.0.1',
+                         help="Address --metrics-port listens on. default 127.0.0.1, 0.0.0.0 for all interfaces")
+    metrics.add_argument('--metrics-interval', dest='metrics_interval', type=float, default=10.0,
+                         help="Seconds between --progress lines and --stats-file saves. default 10")
     parser.add_argument('--help', dest='help', action='store_true', help='help information', default=False)
 
+    offline = parser.add_argument_group('offline mode')
+    offline.add_argument('--binlog-dir', dest='binlog_dir', type=str, default='',
+                         help='Parse local binlog files in this directory instead of connecting to mysql server')
+    offline.add_argument('--schema-file', dest='schema_file', type=str, default='',
+                         help='Table schema snapshot used to decode rows with --binlog-dir')
+    offline.add_argument('--dump-schema-file', dest='dump_schema_file', type=str, default='',
+                         help='Save table schema snapshot of -d databases from mysql server to this file and exit')
+
+    output = parser.add_argument_group('output')
+    output.add_argument('--output-file', dest='output_file', type=str, default='',
+                        help='Write sql to this file instead of stdout')
+    output.add_argument('--output-buffer-size', dest='output_buffer_size', type=int, default=1024 * 1024,
+                        help='Bytes of sql buffered before a write. default 1MB')
+    output.add_argument('--output-rotate-size', dest='output_rotate_size', type=int, default=0,
+                        help='Start a new --output-file.NNNN after this many bytes. default 0: no rotation')
+    output.add_argument('--output-rotate-seconds', dest='output_rotate_seconds', type=int, default=0,
+                        help='Start a new --output-file.NNNN after this many seconds. default 0: no rotation')
+    output.add_argument('--output-compress', dest='output_compress', type=str, choices=['gzip', 'zstd'],
+                        default=None, help='Compress --output-file with gzip, or zstd (needs zstandard package)')
+    output.add_argument('--output-format', dest='output_format', type=str, choices=['sql', 'json', 'columnar'],
+                        default='sql', help='sql; json: a line per change of a row, with before and after images '
+                                            'and positions; columnar: batches of columns of row changes, to '
+                                            '--output-file. default sql')
+    output.add_argument('--columnar-batch-rows', dest='columnar_batch_rows', type=int, default=10000,
+                        help='Rows of a --output-format columnar batch. default 10000')
+
+    apply = parser.add_argument_group('apply mode')
+    apply.add_argument('--apply-host', dest='apply_host', type=str, default='',
+                       help='Execute sql on this MySQL server instead of printing it')
+    apply.add_argument('--apply-port', dest='apply_port', type=int, default=3306,
+                       help='Port of --apply-host')
+    apply.add_argument('--apply-user', dest='apply_user', type=str, default='',
+                       help='Username of --apply-host. default: -u')
+    apply.add_argument('--apply-password', dest='apply_password', type=str, default=None,
+                       help='Password of --apply-host. default: -p')
+    apply.add_argument('--apply-workers', dest='apply_workers', type=int, default=1,
+                       help='Number of connections executing rows in parallel. Rows of a primary key keep their order')
+    apply.add_argument('--apply-commit-every', dest='apply_commit_every', type=int, default=1000,
+                       help='Commit after this many statements, at the end of a source transaction. default 1000')
+    apply.add_argument('--apply-rows-per-second', dest='apply_rows_per_second', type=float, default=0,
+                       help='Max rows executed per second. default 0: no limit')
+
     schema = parser.add_argument_group('schema filter')
     schema.add_argument('-d', '--databases', dest='databases', type=str, nargs='*',
                         help='dbs you want to process', default='')
@@ -89,6 +184,9 @@ def parse_args():
     event = parser.add_argument_group('type filter')
     event.add_argument('--only-dml', dest='only_dml', action='store_true', default=False,
                        help='only print dml, ignore ddl')
+    event.add_argument('--columns', dest='columns', type=str, nargs='*', default=None,
+                       help='Only write these columns, and the primary key, of rows. Not with --flashback. '
+                            'default: every column')
     event.add_argument('--sql-type', dest='sql_type', type=str, nargs='*', default=['INSERT', 'UPDATE', 'DELETE'],
                        help='Sql type you want to process, support INSERT, UPDATE, DELETE.')
 
@@ -97,6 +195,30 @@ def parse_args():
                         help='Generate insert sql without primary key if exists', default=False)
     parser.add_argument('-B', '--flashback', dest='flashback', action='store_true',
                         help='Flashback data to start_position of start_file', default=False)
+    parser.add_argument('--where-key-only', dest='where_key_only', action='store_true', default=False,
+                        help="Match UPDATE and DELETE rows on their primary key, or a unique key of NOT NULL columns, "
+                             "instead of every column. Tables without such a key still match every column")
+    parser.add_argument('--table-keys-file', dest='table_keys_file', type=str, default='',
+                        help="Keep the table keys looked up for --where-key-only in this file between runs. A key is "
+                             "looked up again when the columns or primary key of its table changed")
+    parser.add_argument('--compact', dest='compact', action='store_true', default=False,
+                        help="Write only the net change of each row over the range, by primary key: the first "
+                             "before-image is restored with -B, the last state written otherwise")
+    parser.add_argument('--compact-memory', dest='compact_memory', type=int, default=256 * 1024 * 1024,
+                        help="Bytes of row states --compact keeps in memory before moving them to a temp file. "
+                             "default 256MB")
+    parser.add_argument('--batch-rows', dest='batch_rows', type=int, default=0,
+                        help="Merge up to this many consecutive rows of a table in one transaction into a multi-row "
+                             "INSERT, or DELETE ... WHERE pk IN (...). default 0: one statement per row")
+    parser.add_argument('--batch-bytes', dest='batch_bytes', type=int, default=1024 * 1024,
+                        help="Max size of a merged statement with --batch-rows. default 1MB")
+    parser.add_argument('--hex-bytes', dest='hex_bytes', type=int, default=HEX_BYTES,
+                        help="Write binary values of this many bytes or more as hex literals 0x..., as those that "
+                             "are not utf-8 text always are. 0 for every binary value. default 4096")
+    parser.add_argument('--tmp-segment-size', dest='tmp_segment_size', type=int, default=64 * 1024 * 1024,
+                        help="Split temp files of -B and --jobs into segments of this many bytes. default 64MB")
+    parser.add_argument('--tmp-compress', dest='tmp_compress', action='store_true', default=False,
+                        help="Gzip temp file segments of -B and --jobs")
     parser.add_argument('--back-interval', dest='back_interval', type=float, default=1.0,
                         help="Sleep time between chunks of 1000 rollback sql. set it to 0 if do not need sleep")
     return parser
@@ -109,19 +231,68 @@ def command_line_args(args):
     if args.help or need_print_help:
         parser.print_help()
         sys.exit(1)
-    if not args.start_file:
+    if not args.start_file and not args.dump_schema_file and not args.resume_from_checkpoint:
         raise ValueError('Lack of parameter: start_file')
+    if args.resume_from_checkpoint and not args.checkpoint_file:
+        raise ValueError('Lack of parameter: checkpoint_file')
+    if args.checkpoint_file and (args.flashback or args.jobs > 1):
+        raise ValueError('checkpoint-file can not be used with flashback or jobs')
+    if args.binlog_dir and not args.schema_file:
+        raise ValueError('Lack of parameter: schema_file')
+    if args.binlog_dir and args.stop_never:
+        raise ValueError('Only one of binlog-dir or stop-never can be True')
+    if args.jobs > 1 and args.stop_never:
+        raise ValueError('Only one of jobs or stop-never can be set')
+    if args.jobs < 1:
+        raise ValueError('jobs must be a positive integer')
     if args.flashback and args.stop_never:
         raise ValueError('Only one of flashback or stop-never can be True')
     if args.flashback and args.no_pk:
         raise ValueError('Only one of flashback or no_pk can be True')
+    if args.flashback and args.columns:
+        raise ValueError('Only one of flashback or columns can be set')
+    if args.compact and (args.stop_never or args.checkpoint_file or args.batch_rows > 1 or args.jobs > 1):
+        raise ValueError('compact can not be used with stop-never, checkpoint-file, batch-rows or jobs')
+    if args.table_keys_file and not args.where_key_only:
+        raise ValueError('Lack of parameter: where_key_only')
+    if args.apply_host and args.batch_rows > 1:
+        raise ValueError('Only one of apply-host or batch-rows can be set')
+    if (args.output_rotate_size or args.output_rotate_seconds or args.output_compress) and not args.output_file:
+        raise ValueError('Lack of parameter: output_file')
+    if args.output_file and args.apply_host:
+        raise ValueError('Only one of output-file or apply-host can be set')
+    if args.queue_size < 1 or args.render_processes < 0:
+        raise ValueError('queue-size must be positive and render-processes not negative')
+    if (args.progress or args.stats_file or args.metrics_port) and args.jobs > 1:
+        raise ValueError('progress, stats-file and metrics-port can not be used with jobs')
+    if args.metrics_interval <= 0:
+        raise ValueError('metrics-interval must be positive')
+    if args.apply_workers < 1:
+        raise ValueError('apply-workers must be a positive integer')
+    if args.hex_bytes < 0:
+        raise ValueError('hex-bytes must not be negative')
+    if args.output_format != 'sql' and (args.apply_host or args.batch_rows > 1 or args.compact):
+        raise ValueError('output-format %s can not be used with apply-host, batch-rows or compact'
+                         % args.output_format)
+    if args.output_format == 'columnar' and (not args.output_file or args.flashback or args.jobs > 1
+                                             or args.pipeline or args.render_processes or args.checkpoint_file
+                                             or args.output_rotate_size or args.output_rotate_seconds):
+        raise ValueError('output-format columnar needs output-file, and can not be used with flashback, jobs, '
+                         'pipeline, checkpoint-file or output rotation')
+    if args.columnar_batch_rows < 1:
+        raise ValueError('columnar-batch-rows must be a positive integer')
     if (args.start_time and not is_valid_datetime(args.start_time)) or \
             (args.stop_time and not is_valid_datetime(args.stop_time)):
         raise ValueError('Incorrect datetime argument')
-    if not args.password:
+    if args.binlog_dir:
+        args.password = ''
+    elif not args.password:
         args.password = getpass.getpass()
     else:
         args.password = args.password[0]
+    if args.apply_host:
+        args.apply_user = args.apply_user if args.apply_user else args.user
+        args.apply_password = args.apply_password if args.apply_password is not None else args.password
     return args
 
 
@@ -146,6 +317,58 @@ def fix_object(value):
         return value
 
 
+def fix_value(value):
+    """fix_object for values of rows, keeping bytes for OfflineConnection.literal to write as text or hex"""
+    if isinstance(value, set):
+        return ','.join(value)
+    if not PY3PLUS and isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def bytes_literal(value, hex_bytes=HEX_BYTES):
+    """sql literal of a binary value: the utf-8 text it holds, else or from hex_bytes bytes on a hex literal,
+    which takes no escaping nor decoding"""
+    if len(value) < hex_bytes or not value:
+        try:
+            return "'" + escape_string(value.decode('utf-8')) + "'"
+        except UnicodeDecodeError:
+            pass
+    return '0x' + binascii.hexlify(value).decode('ascii')
+
+
+class OfflineConnection(object):
+    """Stand-in for a pymysql connection in offline mode. Renders values like cursor.mogrify without a server.
+
+    Binary values are written by bytes_literal, so sql is rendered with it online too.
+    """
+
+    def __init__(self, charset='utf8', hex_bytes=HEX_BYTES):
+        self.charset = charset
+        self.hex_bytes = hex_bytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, traceback):
+        pass
+
+    def literal(self, obj):
+        if PY3PLUS and isinstance(obj, bytes):
+            return bytes_literal(obj, self.hex_bytes)
+        if isinstance(obj, (str, type(u''))):
+            return "'" + escape_string(obj) + "'"
+        return escape_item(obj, self.charset, mapping=encoders)
+
+    def mogrify(self, query, args=None):
+        if args is not None:
+            query = query % tuple(map(self.literal, args))
+        return query
+
+    def close(self):
+        pass
+
+
 def is_dml_event(event):
     if isinstance(event, WriteRowsEvent) or isinstance(event, UpdateRowsEvent) or isinstance(event, DeleteRowsEvent):
         return True
@@ -164,7 +387,8 @@ def event_type(event):
     return t
 
 
-def concat_sql_from_binlog_event(cursor, binlog_event, row=None, e_start_pos=None, flashback=False, no_pk=False):
+def concat_sql_from_binlog_event(cursor, binlog_event, row=None, e_start_pos=None, flashback=False, no_pk=False,
+                                 key_columns=None):
     if flashback and no_pk:
         raise ValueError('only one of flashback or no_pk can be True')
     if not (isinstance(binlog_event, WriteRowsEvent) or isinstance(binlog_event, UpdateRowsEvent)
@@ -174,10 +398,9 @@ def concat_sql_from_binlog_event(cursor, binlog_event, row=None, e_start_pos=Non
     sql = ''
     if isinstance(binlog_event, WriteRowsEvent) or isinstance(binlog_event, UpdateRowsEvent) \
             or isinstance(binlog_event, DeleteRowsEvent):
-        pattern = generate_sql_pattern(binlog_event, row=row, flashback=flashback, no_pk=no_pk)
-        sql = cursor.mogrify(pattern['template'], pattern['values'])
-        time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
-        sql += ' #start %s end %s time %s' % (e_start_pos, binlog_event.packet.log_pos, time)
+        template, values, position = row_sql_parts(binlog_event, row=row, e_start_pos=e_start_pos,
+                                                   flashback=flashback, no_pk=no_pk, key_columns=key_columns)
+        sql = cursor.mogrify(template, values) + position
     elif flashback is False and isinstance(binlog_event, QueryEvent) and binlog_event.query != 'BEGIN' \
             and binlog_event.query != 'COMMIT':
         if binlog_event.schema:
@@ -187,73 +410,445 @@ def concat_sql_from_binlog_event(cursor, binlog_event, row=None, e_start_pos=Non
     return sql
 
 
-def generate_sql_pattern(binlog_event, row=None, flashback=False, no_pk=False):
-    template = ''
-    values = []
-    if flashback is True:
-        if isinstance(binlog_event, WriteRowsEvent):
-            template = 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(
-                binlog_event.schema, binlog_event.table,
-                ' AND '.join(map(compare_items, row['values'].items()))
-            )
-            values = map(fix_object, row['values'].values())
-        elif isinstance(binlog_event, DeleteRowsEvent):
-            template = 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
-                binlog_event.schema, binlog_event.table,
-                ', '.join(map(lambda key: '`%s`' % key, row['values'].keys())),
-                ', '.join(['%s'] * len(row['values']))
-            )
-            values = map(fix_object, row['values'].values())
-        elif isinstance(binlog_event, UpdateRowsEvent):
-            template = 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
-                binlog_event.schema, binlog_event.table,
-                ', '.join(['`%s`=%%s' % x for x in row['before_values'].keys()]),
-                ' AND '.join(map(compare_items, row['after_values'].items())))
-            values = map(fix_object, list(row['before_values'].values())+list(row['after_values'].values()))
+def row_sql_parts(binlog_event, row=None, e_start_pos=None, flashback=False, no_pk=False, key_columns=None):
+    """template, values and position comment of a row's sql: cursor.mogrify(template, values) + position"""
+    pattern = generate_sql_pattern(binlog_event, row=row, flashback=flashback, no_pk=no_pk, key_columns=key_columns)
+    time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
+    return (pattern['template'], pattern['values'],
+            ' #start %s end %s time %s' % (e_start_pos, binlog_event.packet.log_pos, time))
+
+
+def concat_batch_sql_from_binlog_event(cursor, batcher, binlog_event, row=None, e_start_pos=None, flashback=False,
+                                       no_pk=False):
+    """Add the row to batcher if it can be merged with others. Return False if it can not"""
+    pattern = generate_batch_pattern(binlog_event, row=row, flashback=flashback, no_pk=no_pk)
+    if pattern is None:
+        return False
+    item = cursor.mogrify(pattern['item'], pattern['values'])
+    time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
+    batcher.add(pattern['head'], pattern['tail'], item, e_start_pos, binlog_event.packet.log_pos, time)
+    return True
+
+
+def primary_key_columns(binlog_event):
+    """primary key columns of a row event as a tuple, () if the table has none"""
+    primary_key = getattr(binlog_event, 'primary_key', None)
+    if not primary_key:
+        return ()
+    return tuple(primary_key) if isinstance(primary_key, (tuple, list)) else (primary_key,)
+
+
+class ColumnProjection(object):
+    """Drop the columns of row images other than columns, keeping the key columns that identify the row"""
+
+    def __init__(self, columns):
+        self.columns = frozenset(columns)
+        self._keep = {}
+        # (RowColumns, columns to keep) -> (projected RowColumns, picker of their values)
+        self._shapes = {}
+
+    def project(self, binlog_event, row, key_columns=()):
+        """the CompactRow of row with the kept columns only"""
+        row = compact_row(binlog_event, row)
+        cache_key = (binlog_event.schema, binlog_event.table, key_columns)
+        keep = self._keep.get(cache_key)
+        if keep is None:
+            keep = self._keep[cache_key] = self.columns.union(key_columns)
+        before_columns, before = self._project(row.before_columns, row.before, keep)
+        after_columns, after = self._project(row.after_columns, row.after, keep)
+        return CompactRow(before_columns, before, after_columns, after)
+
+    def _project(self, columns, values, keep):
+        if values is None:
+            return None, None
+        projected = self._shapes.get((columns, keep))
+        if projected is None:
+            names = tuple(k for k in columns.names if k in keep)
+            projected = self._shapes[(columns, keep)] = (RowColumns.get(names), columns.picker(names))
+        return projected[0], projected[1](values)
+
+
+def row_key(binlog_event, row):
+    """Hex hash of the table and primary key a row touches, used to route it to an apply worker.
+
+    Rows of a table without primary key all hash by table. An UPDATE changing the primary key returns ''
+    so that it runs alone.
+    """
+    table = '%s.%s' % (binlog_event.schema, binlog_event.table)
+    columns = primary_key_columns(binlog_event)
+    if columns:
+        row = compact_row(binlog_event, row)
+        if row.before is not None and row.after is not None:
+            values = row.before_columns.values_of(row.before, columns)
+            if values != row.after_columns.values_of(row.after, columns):
+                return ''
+        elif row.before is not None:
+            values = row.before_columns.values_of(row.before, columns)
+        else:
+            values = row.after_columns.values_of(row.after, columns)
+        table = repr((table, values))
+    return '%x' % (zlib.crc32(table.encode('utf-8')) & 0xffffffff)
+
+
+def generate_sql_pattern(binlog_event, row=None, flashback=False, no_pk=False, key_columns=None):
+    """key_columns: match UPDATE and DELETE rows on these columns only, if the row image has them all.
+    row is a CompactRow, or a row dict as pymysqlreplication decodes it"""
+    row = compact_row(binlog_event, row)
+    key_columns = row_where_key(binlog_event, row, flashback, key_columns) if key_columns else None
+    key = sql_pattern_key(binlog_event, row=row, flashback=flashback, no_pk=no_pk) + (key_columns,)
+    compiled = sql_pattern_cache.get(key)
+    if compiled is None:
+        compiled = compile_sql_pattern(binlog_event, row=row, flashback=flashback, no_pk=no_pk,
+                                       key_columns=key_columns)
+        sql_pattern_cache.put(key, compiled)
+    template, render = compiled
+    return {'template': template, 'values': render(row)}
+
+
+def sql_pattern_key(binlog_event, row=None, flashback=False, no_pk=False):
+    """Cache key of a row's sql template: table, event type, mode and the row shape (columns and NULL-mask)"""
+    row = compact_row(binlog_event, row)
+    where_values = row.after if flashback else row.before
+    # INSERT has no WHERE clause, and rows without NULLs in WHERE all share a template
+    if where_values is None or None not in where_values:
+        null_mask = None
+    else:
+        null_mask = tuple(v is None for v in where_values)
+    primary_key = binlog_event.primary_key if no_pk else None
+    return (binlog_event.schema, binlog_event.table, event_type(binlog_event), flashback, no_pk, primary_key,
+            row.before_columns, row.after_columns, null_mask)
+
+
+def has_where(binlog_event, flashback=False):
+    """whether the sql of a row event matches rows in a WHERE clause, all but INSERT do"""
+    if isinstance(binlog_event, UpdateRowsEvent):
+        return True
+    return isinstance(binlog_event, WriteRowsEvent) == bool(flashback)
+
+
+def row_where_key(binlog_event, row, flashback, key_columns):
+    """key_columns if the row's sql has a WHERE clause and its image has every key column, else None"""
+    row = compact_row(binlog_event, row)
+    if (row.after if flashback else row.before) is None:
+        return None
+    index = (row.after_columns if flashback else row.before_columns).index
+    return tuple(key_columns) if all(k in index for k in key_columns) else None
+
+
+def compile_sql_pattern(binlog_event, row=None, flashback=False, no_pk=False, key_columns=None):
+    """Build the (template, render) pair for a row shape. render(row) returns the values to mogrify from the
+    tuples of a CompactRow.
+
+    A row's sql writes its after image and matches its before image, or the other way round for flashback:
+    an INSERT has no image to match, a DELETE none to write. With key_columns, WHERE matches those columns
+    only instead of the whole row image.
+    """
+    row = compact_row(binlog_event, row)
+    if flashback:
+        set_columns, set_image = (row.before_columns, attrgetter('before'))
+        where_columns, where_image = (row.after_columns, attrgetter('after'))
+    else:
+        set_columns, set_image = (row.after_columns, attrgetter('after'))
+        where_columns, where_image = (row.before_columns, attrgetter('before'))
+    if set_image(row) is None:
+        set_columns = None
+    if where_image(row) is None:
+        where_columns = None
+
+    if where_columns is not None:
+        if key_columns:
+            pick, image = (where_columns.picker(key_columns), where_image)
+
+            def where_image(r):
+                return pick(image(r))
+        where = ' AND '.join(map(compare_items, zip(key_columns or where_columns.names, where_image(row))))
+
+    if where_columns is None:
+        columns = set_columns.names
+        if no_pk and not flashback:
+            primary_key = primary_key_columns(binlog_event)
+            columns = tuple(k for k in columns if k not in primary_key)
+        template = 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
+            binlog_event.schema, binlog_event.table,
+            ', '.join(map(lambda key: '`%s`' % key, columns)),
+            ', '.join(['%s'] * len(columns))
+        )
+        if columns == set_columns.names:
+            def render(r):
+                return list(map(fix_value, set_image(r)))
+        else:
+            pick_set = set_columns.picker(columns)
+
+            def render(r):
+                return list(map(fix_value, pick_set(set_image(r))))
+    elif set_columns is None:
+        template = 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(binlog_event.schema, binlog_event.table,
+                                                                       where)
+
+        def render(r):
+            return list(map(fix_value, where_image(r)))
+    else:
+        template = 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
+            binlog_event.schema, binlog_event.table,
+            ', '.join(['`%s`=%%s' % k for k in set_columns.names]), where)
+
+        def render(r):
+            return list(map(fix_value, set_image(r) + where_image(r)))
+    return template, render
+
+
+def generate_batch_pattern(binlog_event, row=None, flashback=False, no_pk=False):
+    """Parts to merge rows into a multi-row INSERT, or a DELETE ... WHERE pk IN (...).
+    Return None if the row can not be batched"""
+    row = compact_row(binlog_event, row)
+    primary_key = getattr(binlog_event, 'primary_key', None)
+    key = sql_pattern_key(binlog_event, row=row, flashback=flashback, no_pk=no_pk) + ('batch', primary_key)
+    compiled = sql_pattern_cache.get(key)
+    if compiled is None:
+        compiled = compile_batch_pattern(binlog_event, row=row, flashback=flashback, no_pk=no_pk)
+        sql_pattern_cache.put(key, compiled)
+    if not compiled:
+        return None
+    head, item, tail, render = compiled
+    return {'head': head, 'item': item, 'tail': tail, 'values': render(row)}
+
+
+def compile_batch_pattern(binlog_event, row=None, flashback=False, no_pk=False):
+    """Build the (head, item, tail, render) parts of a batched statement, or False for rows that can not be merged"""
+    if isinstance(binlog_event, UpdateRowsEvent):
+        return False
+    row = compact_row(binlog_event, row)
+    if isinstance(binlog_event, WriteRowsEvent) != bool(flashback):
+        template, render = compile_sql_pattern(binlog_event, row=row, flashback=flashback, no_pk=no_pk)
+        head, item = template[:-1].rsplit(' VALUES ', 1)
+        return head + ' VALUES ', item, '', render
+
+    columns = primary_key_columns(binlog_event)
+    if not columns:
+        return False
+    where_columns, where_image = (row.after_columns, attrgetter('after')) if flashback \
+        else (row.before_columns, attrgetter('before'))
+    if any(k not in where_columns.index for k in columns):
+        return False
+    if len(columns) == 1:
+        head = 'DELETE FROM `{0}`.`{1}` WHERE `{2}` IN ('.format(binlog_event.schema, binlog_event.table, columns[0])
+        item = '%s'
     else:
-        if isinstance(binlog_event, WriteRowsEvent):
-            if no_pk:
-                # print binlog_event.__dict__
-                # tableInfo = (binlog_event.table_map)[binlog_event.table_id]
-                # if tableInfo.primary_key:
-                #     row['values'].pop(tableInfo.primary_key)
-                if binlog_event.primary_key:
-                    row['values'].pop(binlog_event.primary_key)
-
-            template = 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
-                binlog_event.schema, binlog_event.table,
-                ', '.join(map(lambda key: '`%s`' % key, row['values'].keys())),
-                ', '.join(['%s'] * len(row['values']))
-            )
-            values = map(fix_object, row['values'].values())
-        elif isinstance(binlog_event, DeleteRowsEvent):
-            template = 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(
-                binlog_event.schema, binlog_event.table, ' AND '.join(map(compare_items, row['values'].items())))
-            values = map(fix_object, row['values'].values())
-        elif isinstance(binlog_event, UpdateRowsEvent):
-            template = 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
-                binlog_event.schema, binlog_event.table,
-                ', '.join(['`%s`=%%s' % k for k in row['after_values'].keys()]),
-                ' AND '.join(map(compare_items, row['before_values'].items()))
-            )
-            values = map(fix_object, list(row['after_values'].values())+list(row['before_values'].values()))
-
-    return {'template': template, 'values': list(values)}
-
-
-def reversed_lines(fin):
+        head = 'DELETE FROM `{0}`.`{1}` WHERE ({2}) IN ('.format(
+            binlog_event.schema, binlog_event.table, ', '.join(map(lambda key: '`%s`' % key, columns)))
+        item = '({0})'.format(', '.join(['%s'] * len(columns)))
+    pick = where_columns.picker(columns)
+
+    def render(r):
+        return list(map(fix_value, pick(where_image(r))))
+    return head, item, ')', render
+
+
+class SqlBatcher(object):
+    """Merge consecutive rows with the same statement head into one statement of at most max_rows rows
+    and about max_bytes bytes. The caller flushes at transaction boundaries."""
+
+    def __init__(self, f_out, max_rows=1000, max_bytes=1024 * 1024, reverse=False):
+        self.f_out = f_out
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        # flashback sql is reversed line by line later, so rows inside a line are reversed here
+        self.reverse = reverse
+        self.head = self.tail = None
+        self.items = []
+        self.size = 0
+        self.e_start_pos = self.end_pos = self.time = None
+
+    def add(self, head, tail, item, e_start_pos, end_pos, time):
+        if self.items and (head != self.head or len(self.items) >= self.max_rows
+                           or self.size + len(item) > self.max_bytes):
+            self.flush()
+        if not self.items:
+            self.head, self.tail, self.e_start_pos = (head, tail, e_start_pos)
+            # max_bytes bounds the whole statement, not only its rows
+            self.size = len(head) + len(tail)
+        self.items.append(item)
+        self.size += len(item) + 2
+        self.end_pos, self.time = (end_pos, time)
+
+    def flush(self):
+        if not self.items:
+            return
+        items = reversed(self.items) if self.reverse else self.items
+        self.f_out.write('%s%s%s; #start %s end %s time %s\n' % (self.head, ', '.join(items), self.tail,
+                                                                 self.e_start_pos, self.end_pos, self.time))
+        self.items = []
+        self.size = 0
+
+
+class SqlPatternCache(object):
+    """LRU cache of compiled sql templates, so each row only pays for value escaping"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key):
+        compiled = self._cache.pop(key, None)
+        if compiled is not None:
+            self._cache[key] = compiled
+        return compiled
+
+    def put(self, key, compiled):
+        self._cache.pop(key, None)
+        self._cache[key] = compiled
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, schema=None, table=None):
+        """drop templates of a table, of a whole schema if table is None, or everything if schema is None"""
+        if schema is None:
+            self._cache.clear()
+            return
+        for key in list(self._cache.keys()):
+            if key[0] == schema and (table is None or key[1] == table):
+                del self._cache[key]
+
+
+sql_pattern_cache = SqlPatternCache()
+
+
+def parse_ddl_table(query, schema=None):
+    """Return (schema, table) touched by a DDL query, (schema, None) if it is DDL on an unknown table,
+    or None if it is not DDL at all"""
+    query = fix_object(query)
+    if not DDL_RE.match(query):
+        return None
+    m = DDL_TABLE_RE.match(query)
+    if not m:
+        return schema, None
+    db, table = m.group('schema'), m.group('table')
+    return (db.strip('`') if db else schema), table.strip('`')
+
+
+def ddl_event_table(binlog_event):
+    """(schema, table) touched by a DDL QueryEvent as parse_ddl_table returns it, None for other events"""
+    if not isinstance(binlog_event, QueryEvent) or binlog_event.query in ('BEGIN', 'COMMIT'):
+        return None
+    return parse_ddl_table(binlog_event.query, fix_object(binlog_event.schema) or None)
+
+
+def invalidate_sql_pattern_cache(binlog_event, table_keys=None):
+    """Drop cached templates, and keys of table_keys if given, of the table touched by a DDL QueryEvent"""
+    touched = ddl_event_table(binlog_event)
+    if touched is None:
+        return
+    schema, table = touched
+    for cache in (sql_pattern_cache, table_keys):
+        if cache is None:
+            continue
+        if schema is None:
+            cache.invalidate()
+        else:
+            cache.invalidate(schema, table)
+
+
+def reversed_lines(fin, block_size=1024 * 1024):
     """Generate the lines of file in reverse order."""
-    part = ''
-    for block in reversed_blocks(fin):
-        if PY3PLUS:
-            block = block.decode("utf-8")
-        for c in reversed(block):
-            if c == '\n' and part:
-                yield part[::-1]
-                part = ''
-            part += c
-    if part:
-        yield part[::-1]
+    return reversed_block_lines(reversed_blocks(fin, block_size=block_size))
+
+
+def reversed_block_lines(blocks):
+    """Generate the lines of byte blocks in reverse order. blocks are given last block first.
+
+    Lines are split by bytes.split in large blocks, and only whole lines are decoded.
+    """
+    # head of the lines processed so far, whose start is in an earlier block
+    pending = b''
+    for block in blocks:
+        lines = (block + pending).split(b'\n')
+        if len(lines) == 1:
+            pending = lines[0]
+            continue
+        pending = lines[0] + b'\n'
+        if lines[-1]:
+            # end of file without a newline
+            yield decode_line(lines[-1])
+        for i in range(len(lines) - 2, 0, -1):
+            yield decode_line(lines[i] + b'\n')
+    if pending:
+        yield decode_line(pending)
+
+
+def decode_line(line):
+    return line.decode("utf-8") if PY3PLUS else line
+
+
+class SegmentedTempFile(object):
+    """Temp file split into segments of about segment_size bytes, each optionally gzip compressed.
+
+    Segments only end at write boundaries, so writing whole lines lets reversed_segment_lines replay
+    the file last line first, holding at most one segment in memory.
+    """
+
+    def __init__(self, prefix, segment_size=64 * 1024 * 1024, compress=False):
+        self.prefix = prefix
+        self.segment_size = segment_size
+        self.compress = compress
+        self.segments = []
+        self._f = None
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, traceback):
+        self.close()
+        self.remove()
+
+    def write(self, data):
+        if self._f is None or self._size >= self.segment_size:
+            self._next_segment()
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self._f.write(data)
+        self._size += len(data)
+
+    def _next_segment(self):
+        self.close()
+        segment = '%s.%04d' % (self.prefix, len(self.segments))
+        if self.compress:
+            segment += '.gz'
+            self._f = gzip.open(segment, 'wb', compresslevel=1)
+        else:
+            self._f = open(segment, 'wb')
+        self.segments.append(segment)
+        self._size = 0
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def remove(self):
+        for segment in self.segments:
+            if os.path.exists(segment):
+                os.remove(segment)
+
+
+def open_segment(segment):
+    return gzip.open(segment, 'rb') if segment.endswith('.gz') else open(segment, 'rb')
+
+
+def reversed_segment_lines(segments):
+    """Generate the lines of SegmentedTempFile segments in reverse order"""
+    for segment in reversed(segments):
+        with open_segment(segment) as f:
+            if segment.endswith('.gz'):
+                # gzip can not seek backwards cheaply, segments are small enough to reverse in memory
+                blocks = [f.read()]
+            else:
+                blocks = reversed_blocks(f, block_size=1024 * 1024)
+            for line in reversed_block_lines(blocks):
+                yield line
 
 
 def reversed_blocks(fin, block_size=4096):
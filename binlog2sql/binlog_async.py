@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""asyncio interface of Binlog2sql.iter_statements. Needs python 3.6 or later, unlike the rest of binlog2sql"""
+
+import asyncio
+from itertools import islice
+
+
+async def aiter_statements(binlog2sql, chunk_size=None, executor=None):
+    """Statements of binlog2sql.iter_statements, for async for.
+
+    The stream is read in executor threads chunk_size statements at a time, only when the consumer asks for
+    more, so the event loop never blocks on it and a slow consumer holds up reading. chunk_size defaults to 1
+    with stop_never, not to keep statements waiting for a chunk to fill, and to 100 otherwise.
+    """
+    loop = asyncio.get_event_loop()
+    if chunk_size is None:
+        chunk_size = 1 if binlog2sql.stop_never else 100
+    statements = await loop.run_in_executor(executor, binlog2sql.iter_statements)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, take, statements, chunk_size)
+            for statement in chunk:
+                yield statement
+            if len(chunk) < chunk_size:
+                return
+    finally:
+        # closes the stream and temp files of a consumer stopping early
+        await loop.run_in_executor(executor, statements.close)
+
+
+def take(iterator, count):
+    return list(islice(iterator, count))
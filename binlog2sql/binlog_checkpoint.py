@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import uuid
+from pymysqlreplication.event import QueryEvent, XidEvent, GtidEvent
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+
+
+def event_gtid(binlog_event):
+    """'source_id:transaction_id' of a GtidEvent (GtidEvent.gtid fails on python 3)"""
+    return '%s:%d' % (uuid.UUID(bytes=bytes(binlog_event.sid)), binlog_event.gno)
+
+
+class Checkpoint(object):
+    """Last transaction boundary whose sql is fully written: binlog file, position, gtid of the transaction
+    and the state of the output (files and offset of an --output-file), saved to filename as json.
+
+    The output is synced before the checkpoint is saved, so resuming from it neither loses nor, when the
+    output can be truncated back to the checkpoint, repeats a transaction.
+    """
+
+    def __init__(self, filename, every_events=1000, every_seconds=5.0):
+        self.filename = filename
+        self.every_events = every_events
+        self.every_seconds = every_seconds
+        self.events = 0
+        self.saved_at = time.time()
+        self.in_transaction = False
+        # last transaction boundary with nothing written after it, and its gtid
+        self.boundary = None
+        self.gtid, self.next_gtid = (None, None)
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, log_file, log_pos, gtid=None, output=None):
+        # write then rename, so a crash never leaves half a checkpoint
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump({'log_file': log_file, 'log_pos': log_pos, 'gtid': gtid, 'output': output}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(self.filename + '.tmp', self.filename)
+        self.events = 0
+        self.saved_at = time.time()
+
+    def feed(self, binlog_event, log_file):
+        """track transactions, return True if binlog_event ends one"""
+        self.events += 1
+        end = False
+        if isinstance(binlog_event, GtidEvent):
+            self.next_gtid = event_gtid(binlog_event)
+        elif isinstance(binlog_event, XidEvent):
+            end = True
+        elif isinstance(binlog_event, QueryEvent):
+            if binlog_event.query == 'BEGIN':
+                self.in_transaction = True
+                self.boundary = None
+            elif binlog_event.query == 'COMMIT' or not self.in_transaction:
+                # COMMIT of a non-transactional table, or a DDL
+                end = True
+            else:
+                self.boundary = None
+        elif isinstance(binlog_event, (WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent)):
+            self.boundary = None
+        if end:
+            self.in_transaction = False
+            self.boundary = (log_file, binlog_event.packet.log_pos)
+            self.gtid = self.next_gtid
+        return end
+
+    def transaction_end(self, f_out):
+        """called at every transaction boundary: save if every_events events or every_seconds passed"""
+        if self.events >= self.every_events or time.time() - self.saved_at >= self.every_seconds:
+            self.save(self.boundary[0], self.boundary[1], gtid=self.gtid, output=f_out.sync())
+
+    def finish(self, f_out):
+        """save the last boundary when the stream ended right after it"""
+        if self.boundary is not None:
+            self.save(self.boundary[0], self.boundary[1], gtid=self.gtid, output=f_out.sync())
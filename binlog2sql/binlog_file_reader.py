@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import mmap
+import struct
+import pymysql
+from pymysql.connections import MysqlPacket
+from pymysqlreplication.packet import BinLogPacketWrapper
+from pymysqlreplication.constants.BINLOG import TABLE_MAP_EVENT, ROTATE_EVENT, FORMAT_DESCRIPTION_EVENT, \
+    WRITE_ROWS_EVENT_V1, UPDATE_ROWS_EVENT_V1, DELETE_ROWS_EVENT_V1, WRITE_ROWS_EVENT_V2, UPDATE_ROWS_EVENT_V2, \
+    DELETE_ROWS_EVENT_V2
+from pymysqlreplication.event import (
+    QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, GtidEvent, StopEvent,
+    BeginLoadQueryEvent, ExecuteLoadQueryEvent
+)
+from pymysqlreplication.row_event import UpdateRowsEvent, WriteRowsEvent, DeleteRowsEvent, TableMapEvent
+
+BINLOG_MAGIC = b'\xfebin'
+EVENT_HEADER_LENGTH = 19
+# FormatDescriptionEvent carries checksum algorithm since this server version
+CHECKSUM_VERSION = (5, 6, 1)
+BINLOG_CHECKSUM_ALG_CRC32 = 1
+
+DEFAULT_ALLOWED_EVENTS = frozenset([
+    QueryEvent, RotateEvent, StopEvent, FormatDescriptionEvent, XidEvent, GtidEvent,
+    BeginLoadQueryEvent, ExecuteLoadQueryEvent, UpdateRowsEvent, WriteRowsEvent, DeleteRowsEvent, TableMapEvent
+])
+
+ROWS_EVENTS = {
+    WRITE_ROWS_EVENT_V1: WriteRowsEvent, UPDATE_ROWS_EVENT_V1: UpdateRowsEvent, DELETE_ROWS_EVENT_V1: DeleteRowsEvent,
+    WRITE_ROWS_EVENT_V2: WriteRowsEvent, UPDATE_ROWS_EVENT_V2: UpdateRowsEvent, DELETE_ROWS_EVENT_V2: DeleteRowsEvent,
+}
+
+COLUMN_SCHEMA_FIELDS = ('COLUMN_NAME', 'COLLATION_NAME', 'CHARACTER_SET_NAME', 'COLUMN_COMMENT', 'COLUMN_TYPE',
+                        'COLUMN_KEY')
+
+
+class SchemaSnapshot(object):
+    """Table schemas saved from information_schema.columns, used instead of a live server to decode rows.
+
+    The snapshot file is json: {"schema": {"table": [{"COLUMN_NAME": ..., "COLUMN_TYPE": ..., ...}, ...]}}
+    with the columns in ordinal position.
+    """
+
+    def __init__(self, schemas=None, charset='utf8'):
+        self.schemas = schemas if schemas else {}
+        self.charset = charset
+
+    @classmethod
+    def load(cls, filename, charset='utf8'):
+        with open(filename) as f:
+            return cls(json.load(f), charset=charset)
+
+    @classmethod
+    def from_server(cls, connection_settings, only_schemas=None):
+        sql = "SELECT TABLE_SCHEMA, TABLE_NAME, %s FROM information_schema.columns" % ', '.join(COLUMN_SCHEMA_FIELDS)
+        if only_schemas:
+            sql += " WHERE TABLE_SCHEMA IN (%s)" % ', '.join(['%s'] * len(only_schemas))
+        sql += " ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION"
+        schemas = {}
+        connection = pymysql.connect(**connection_settings)
+        try:
+            with connection as cursor:
+                cursor.execute(sql, only_schemas or None)
+                for row in cursor.fetchall():
+                    columns = schemas.setdefault(row[0], {}).setdefault(row[1], [])
+                    columns.append(dict(zip(COLUMN_SCHEMA_FIELDS, row[2:])))
+        finally:
+            connection.close()
+        return cls(schemas, charset=connection_settings.get('charset', 'utf8'))
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.schemas, f, indent=1, sort_keys=True)
+
+    def _get_table_information(self, schema, table):
+        """same result as BinLogStreamReader's information_schema lookup"""
+        return self.schemas.get(schema, {}).get(table, [])
+
+
+def parse_server_version(version):
+    return tuple(int(x) for x in re.findall(r'\d+', version)[:3])
+
+
+class BinLogFileReader(object):
+    """Read events from local binlog files through mmap, with the same interface as BinLogStreamReader.
+
+    Table schemas come from a SchemaSnapshot instead of information_schema, so no server is needed.
+    Rows events that would be dropped, for their type or for a table filtered out at its TABLE_MAP, are
+    skipped by their header without being copied out of the file.
+    """
+
+    def __init__(self, log_files, schema_snapshot, log_dir='.', log_pos=None, only_events=None,
+                 only_tables=None, ignored_tables=None, only_schemas=None, ignored_schemas=None,
+                 freeze_schema=False, fail_on_table_metadata_unavailable=False):
+        """
+        log_files: binlog file names in order, found under log_dir
+        log_pos: start position in the first file
+        """
+        if not log_files:
+            raise ValueError('Lack of parameter: log_files')
+        self.log_files = list(log_files)
+        self.log_dir = log_dir
+        self.schema_snapshot = schema_snapshot
+        self.start_pos = log_pos if log_pos else 4
+        self.only_tables = only_tables
+        self.ignored_tables = ignored_tables
+        self.only_schemas = only_schemas
+        self.ignored_schemas = ignored_schemas
+        self.freeze_schema = freeze_schema
+        self.fail_on_table_metadata_unavailable = fail_on_table_metadata_unavailable
+        self.allowed_events = frozenset(only_events) if only_events is not None else DEFAULT_ALLOWED_EVENTS
+        # TABLE_MAP and ROTATE are always decoded, other events depend on them
+        self.allowed_events_in_packet = frozenset([TableMapEvent, RotateEvent]).union(self.allowed_events)
+
+        self.table_map = {}
+        self.log_file = self.log_files[0]
+        self.log_pos = self.start_pos
+        self.use_checksum = False
+        self._file_index = -1
+        self._file = None
+        self._mmap = None
+        self._offset = 0
+        self._size = 0
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __open_next_file(self):
+        self.close()
+        self._file_index += 1
+        if self._file_index >= len(self.log_files):
+            return False
+        self.log_file = self.log_files[self._file_index]
+        self._file = open(os.path.join(self.log_dir, self.log_file), 'rb')
+        self._size = os.fstat(self._file.fileno()).st_size
+        if self._size <= len(BINLOG_MAGIC):
+            self._mmap = None
+            self._offset = self._size
+            return True
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(BINLOG_MAGIC)] != BINLOG_MAGIC:
+            raise ValueError('%s is not a binlog file' % self.log_file)
+        self.use_checksum = self.__checksum_enabled()
+        self._offset = self.start_pos if self._file_index == 0 else 4
+        self.log_pos = self._offset
+        self.table_map = {}
+        return True
+
+    def __checksum_enabled(self):
+        """read checksum algorithm from the FormatDescriptionEvent at the head of the file"""
+        offset = len(BINLOG_MAGIC)
+        event_type = struct.unpack('<B', self._mmap[offset + 4:offset + 5])[0]
+        if event_type != FORMAT_DESCRIPTION_EVENT:
+            return False
+        event_size = struct.unpack('<I', self._mmap[offset + 9:offset + 13])[0]
+        body = self._mmap[offset + EVENT_HEADER_LENGTH:offset + event_size]
+        server_version = body[2:52].split(b'\0', 1)[0].decode('ascii', 'replace')
+        if parse_server_version(server_version) < CHECKSUM_VERSION:
+            return False
+        return struct.unpack('<B', body[-5:-4])[0] == BINLOG_CHECKSUM_ALG_CRC32
+
+    def __read_packet(self):
+        """Return the next event as a replication packet, or None at the end of the last file"""
+        while True:
+            if self._mmap is None or self._offset + EVENT_HEADER_LENGTH > self._size:
+                if not self.__open_next_file():
+                    return None
+                continue
+            event_size = struct.unpack('<I', self._mmap[self._offset + 9:self._offset + 13])[0]
+            if event_size < EVENT_HEADER_LENGTH or self._offset + event_size > self._size:
+                # half written event at the tail of an active binlog
+                self._offset = self._size
+                continue
+            if self.__skip_rows_event(event_size):
+                self._offset += event_size
+                continue
+            # the replication protocol prefixes every event with an OK byte
+            data = b'\0' + self._mmap[self._offset:self._offset + event_size]
+            self._offset += event_size
+            return MysqlPacket(data, self.schema_snapshot.charset)
+
+    def __skip_rows_event(self, event_size):
+        """whether the event at the current offset is a rows event the packet wrapper would drop"""
+        event_type = struct.unpack('<B', self._mmap[self._offset + 4:self._offset + 5])[0]
+        event_class = ROWS_EVENTS.get(event_type)
+        if event_class is None or event_size < EVENT_HEADER_LENGTH + 6:
+            return False
+        if event_class in self.allowed_events:
+            table_id = struct.unpack('<Q', self._mmap[self._offset + EVENT_HEADER_LENGTH:
+                                                      self._offset + EVENT_HEADER_LENGTH + 6] + b'\0\0')[0]
+            if table_id in self.table_map:
+                return False
+        log_pos = struct.unpack('<I', self._mmap[self._offset + 13:self._offset + 17])[0]
+        if log_pos:
+            self.log_pos = log_pos
+        return True
+
+    def fetchone(self):
+        while True:
+            pkt = self.__read_packet()
+            if pkt is None:
+                self.close()
+                return None
+
+            binlog_event = BinLogPacketWrapper(pkt, self.table_map, self.schema_snapshot, self.use_checksum,
+                                               self.allowed_events_in_packet, self.only_tables, self.ignored_tables,
+                                               self.only_schemas, self.ignored_schemas, self.freeze_schema,
+                                               self.fail_on_table_metadata_unavailable)
+
+            if binlog_event.event_type == ROTATE_EVENT:
+                self.log_pos = binlog_event.event.position
+                self.log_file = binlog_event.event.next_binlog
+                # table ids are not persistent across binlogs, see BinLogStreamReader.fetchone
+                self.table_map = {}
+            elif binlog_event.log_pos:
+                self.log_pos = binlog_event.log_pos
+
+            if binlog_event.event_type == TABLE_MAP_EVENT and binlog_event.event is not None:
+                self.table_map[binlog_event.event.table_id] = binlog_event.event.get_table()
+
+            if binlog_event.event is None or (binlog_event.event.__class__ not in self.allowed_events):
+                continue
+
+            return binlog_event.event
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
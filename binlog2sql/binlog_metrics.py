@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import threading
+from timeit import default_timer
+from binlog2sql_util import event_type
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+STAGES = ('fetch', 'decode', 'render', 'write')
+
+
+class BinlogMetrics(object):
+    """Counters and stage timers of a dump, updated by the event loop and read by a MetricsReporter.
+
+    Stages are fetch (reading and parsing events of the stream), decode (rows of row events), render (sql
+    of rows) and write (handing sql to the output). Events older than start_time are counted as skipped,
+    with the time spent fetching them.
+
+    binlogs: (binlog, size) of the range to dump in order, size being where the dump stops in that file or
+    None if unknown. Progress, lag and ETA are measured in bytes of it, from start_pos of the first file.
+    inline_write: writes happen in the event loop's thread, so their time is not part of the render stage.
+    """
+
+    def __init__(self, binlogs=(), start_pos=4, inline_write=True):
+        self.started = time.time()
+        # bytes of the range before each binlog
+        self.offsets = {}
+        total = -start_pos
+        for (binlog, size) in binlogs:
+            self.offsets[binlog] = total
+            total = total + size if size is not None and total is not None else None
+        self.total_bytes = total if binlogs else None
+        self.inline_write = inline_write
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.events = {}
+        # (sql type, schema.table) -> rows
+        self.rows = {}
+        self.output_bytes = 0
+        self.skipped_events, self.skip_seconds = (0, 0.0)
+        self.log_file, self.log_pos, self.event_timestamp = (None, None, None)
+        self._fetch_seconds = 0.0
+        self._render_start, self._write_seconds = (0.0, 0.0)
+
+    def timed_events(self, stream):
+        """iterate stream, timing the fetch of every event and tracking its position"""
+        events = iter(stream)
+        stage_seconds = self.stage_seconds
+        while True:
+            start = default_timer()
+            try:
+                binlog_event = next(events)
+            except StopIteration:
+                return
+            self._fetch_seconds = default_timer() - start
+            stage_seconds['fetch'] += self._fetch_seconds
+            name = binlog_event.__class__.__name__
+            self.events[name] = self.events.get(name, 0) + 1
+            self.log_file, self.log_pos = (stream.log_file, stream.log_pos)
+            self.event_timestamp = binlog_event.timestamp
+            yield binlog_event
+
+    def skip(self):
+        """the last event is older than start_time"""
+        self.skipped_events += 1
+        self.skip_seconds += self._fetch_seconds
+
+    def decode(self, binlog_event):
+        """rows of binlog_event, starting the render timer of the event"""
+        start = default_timer()
+        rows = binlog_event.rows
+        self._render_start = default_timer()
+        self.stage_seconds['decode'] += self._render_start - start
+        key = (event_type(binlog_event), '%s.%s' % (binlog_event.schema, binlog_event.table))
+        self.rows[key] = self.rows.get(key, 0) + len(rows)
+        self._write_seconds = self.stage_seconds['write']
+        return rows
+
+    def rendered(self):
+        """every row of the event last decoded is rendered"""
+        seconds = default_timer() - self._render_start
+        if self.inline_write:
+            seconds -= self.stage_seconds['write'] - self._write_seconds
+        self.stage_seconds['render'] += seconds
+
+    def processed_bytes(self):
+        offset = self.offsets.get(self.log_file)
+        if offset is None or self.log_pos is None:
+            return None
+        return offset + self.log_pos
+
+    def snapshot(self):
+        """the metrics as a dict, to save as json"""
+        now = time.time()
+        elapsed = now - self.started
+        processed, total = (self.processed_bytes(), self.total_bytes)
+        lag_bytes, eta = (None, None)
+        if processed is not None and total is not None:
+            lag_bytes = max(total - processed, 0)
+            if processed > 0:
+                eta = lag_bytes * elapsed / processed
+        rows = {}
+        for ((sql_type, table), count) in self.rows.copy().items():
+            rows.setdefault(table, {})[sql_type] = count
+        return {'started': self.started, 'elapsed_seconds': elapsed, 'log_file': self.log_file,
+                'log_pos': self.log_pos, 'event_timestamp': self.event_timestamp,
+                'seconds_behind': now - self.event_timestamp if self.event_timestamp else None,
+                'processed_bytes': processed, 'total_bytes': total, 'lag_bytes': lag_bytes,
+                'progress': float(processed) / total if processed is not None and total else None,
+                'eta_seconds': eta, 'events': self.events.copy(), 'rows': rows,
+                'rows_total': sum(self.rows.copy().values()), 'output_bytes': self.output_bytes,
+                'skipped_events': self.skipped_events, 'skip_seconds': self.skip_seconds,
+                'stage_seconds': self.stage_seconds.copy()}
+
+    def progress_line(self):
+        s = self.snapshot()
+        parts = [time.strftime('%Y-%m-%d %H:%M:%S'), '%s:%s' % (s['log_file'], s['log_pos'])]
+        if s['progress'] is not None:
+            parts.append('%.1f%%' % (s['progress'] * 100))
+        parts.append('%d rows %.0f rows/s' % (s['rows_total'], s['rows_total'] / max(s['elapsed_seconds'], 1e-9)))
+        parts.append('%.1fMB sql' % (s['output_bytes'] / 1024.0 / 1024))
+        if s['eta_seconds'] is not None:
+            parts.append('eta %s' % format_seconds(s['eta_seconds']))
+        if s['seconds_behind'] is not None:
+            parts.append('behind %s' % format_seconds(s['seconds_behind']))
+        if s['skipped_events']:
+            parts.append('skipped %d events %.1fs' % (s['skipped_events'], s['skip_seconds']))
+        stages = ', '.join('%s %.1fs' % (stage, s['stage_seconds'][stage]) for stage in STAGES)
+        return '%s | %s' % (' '.join(parts), stages)
+
+    def prometheus(self):
+        """the metrics in prometheus text exposition format"""
+        s = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP binlog2sql_%s %s' % (name, help_text))
+            lines.append('# TYPE binlog2sql_%s %s' % (name, kind))
+            for (labels, value) in samples:
+                if value is None:
+                    continue
+                label_text = ','.join('%s="%s"' % (k, escape_label(v)) for (k, v) in labels)
+                lines.append('binlog2sql_%s%s %s' % (name, '{%s}' % label_text if labels else '', value))
+
+        metric('events_total', 'counter', 'Binlog events read, by event type.',
+               [((('type', name),), count) for (name, count) in sorted(s['events'].items())])
+        metric('rows_total', 'counter', 'Rows of row events, by sql type and table.',
+               [((('table', table), ('type', sql_type)), count) for (table, counts) in sorted(s['rows'].items())
+                for (sql_type, count) in sorted(counts.items())])
+        metric('stage_seconds_total', 'counter', 'Seconds spent in each stage of the event loop.',
+               [((('stage', stage),), s['stage_seconds'][stage]) for stage in STAGES])
+        metric('output_bytes_total', 'counter', 'Characters of sql written.', [((), s['output_bytes'])])
+        metric('skipped_events_total', 'counter', 'Events skipped for being older than the start time.',
+               [((), s['skipped_events'])])
+        metric('skip_seconds_total', 'counter', 'Seconds spent fetching skipped events.', [((), s['skip_seconds'])])
+        metric('position', 'gauge', 'Binlog position after the last event read.',
+               [((('file', s['log_file']),), s['log_pos'])] if s['log_file'] else [])
+        metric('lag_bytes', 'gauge', 'Bytes of binlog left until the end of the range.', [((), s['lag_bytes'])])
+        metric('seconds_behind', 'gauge', 'Seconds since the timestamp of the last event read.',
+               [((), s['seconds_behind'])])
+        metric('eta_seconds', 'gauge', 'Estimated seconds until the end of the range.', [((), s['eta_seconds'])])
+        return '\n'.join(lines) + '\n'
+
+
+class MeteredOutput(object):
+    """f_out counting the sql written to it and the time it takes into metrics"""
+
+    def __init__(self, f_out, metrics):
+        self.f_out = f_out
+        self.metrics = metrics
+
+    def write(self, data):
+        start = default_timer()
+        self.f_out.write(data)
+        self.metrics.stage_seconds['write'] += default_timer() - start
+        self.metrics.output_bytes += len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f_out, name)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.metrics.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # stderr is for the progress line
+        pass
+
+
+class MetricsReporter(object):
+    """Report metrics every interval seconds: a progress line to stderr if progress, the json snapshot to
+    stats_file. With a port, metrics are served in prometheus format over http on the bind address, only to the
+    local host by default. stop() reports once more."""
+
+    def __init__(self, metrics, interval=10.0, progress=False, stats_file=None, port=None, bind='127.0.0.1',
+                 f_err=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.progress = progress
+        self.stats_file = stats_file
+        self.f_err = f_err if f_err else sys.stderr
+        self.server = None
+        if port is not None:
+            self.server = HTTPServer((bind, port), MetricsHandler)
+            self.server.metrics = metrics
+            self.port = self.server.server_address[1]
+            self.server_thread = threading.Thread(target=self.server.serve_forever, name='binlog2sql-metrics-http')
+            self.server_thread.daemon = True
+            self.server_thread.start()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='binlog2sql-metrics')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        if self.progress:
+            self.f_err.write(self.metrics.progress_line() + '\n')
+        if self.stats_file:
+            self.save_stats()
+
+    def save_stats(self):
+        # write then rename, so readers never see half a file
+        with open(self.stats_file + '.tmp', 'w') as f:
+            json.dump(self.metrics.snapshot(), f, sort_keys=True)
+        os.rename(self.stats_file + '.tmp', self.stats_file)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.report()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def escape_label(value):
+    return ('%s' % value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import threading
+from pymysqlreplication.row_event import RowsEvent
+from binlog2sql_util import OfflineConnection, HEX_BYTES
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+# queue markers
+END = 'END'
+FLUSH = 'FLUSH'
+
+
+class PrefetchStream(object):
+    """Fetch events of stream in a thread and decode the rows of rows events in another, each stage up to
+    queue_size events ahead of the next one.
+
+    log_file and log_pos are those of the stream right after the event last yielded, like a stream
+    iterated directly.
+    """
+
+    def __init__(self, stream, queue_size=1000):
+        self.stream = stream
+        self.log_file, self.log_pos = (stream.log_file, stream.log_pos)
+        # fetched events, then events with their rows decoded
+        self.fetched = QueueStage(Queue(maxsize=queue_size))
+        self.queue = Queue(maxsize=queue_size)
+        self.error = None
+        self.stopped = False
+        self.closed = False
+        self.thread = threading.Thread(target=self._fetch, name='binlog2sql-fetch')
+        self.thread.daemon = True
+        self.decoder = threading.Thread(target=self._decode, name='binlog2sql-decode')
+        self.decoder.daemon = True
+        self.thread.start()
+        self.decoder.start()
+
+    def _fetch(self):
+        try:
+            for binlog_event in self.stream:
+                if self.stopped:
+                    break
+                self.fetched.queue.put((binlog_event, self.stream.log_file, self.stream.log_pos))
+        except Exception as e:
+            if not self.stopped:
+                self.error = e
+        self.fetched.queue.put(END)
+
+    def _decode(self):
+        while True:
+            item = self.fetched.queue.get()
+            if item is END:
+                break
+            if self.stopped:
+                # take what is fetched until the fetch stops, so that it never waits for room
+                continue
+            try:
+                if isinstance(item[0], RowsEvent):
+                    # pymysqlreplication decodes rows when they are first read
+                    item[0].rows
+            except Exception as e:
+                self.error, self.stopped = (e, True)
+                continue
+            self.queue.put(item)
+        self.queue.put(END)
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is END:
+                break
+            binlog_event, self.log_file, self.log_pos = item
+            yield binlog_event
+        if self.error is not None:
+            raise self.error
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def stages(self):
+        """the queues of the fetch and decode stages for QueueMonitor"""
+        return {'fetch': self.fetched, 'decode': self}
+
+    def _drain(self, timeout=None):
+        """take what the threads queue until both end, or timeout seconds passed"""
+        deadline = time.time() + timeout if timeout is not None else None
+        while self.decoder.is_alive() and (deadline is None or time.time() < deadline):
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except Empty:
+                    break
+            self.decoder.join(timeout=0.01)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.stopped = True
+        # unblock the threads waiting for room in the queues
+        self._drain(timeout=1)
+        # still blocked reading from the server: closing the stream ends the read
+        self.stream.close()
+        self._drain()
+        self.thread.join()
+
+
+class QueueStage(object):
+    """a bare queue of a stage, for QueueMonitor"""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def depth(self):
+        return self.queue.qsize()
+
+
+class PipelineWriter(object):
+    """Write to f_out in a thread, queueing up to queue_size chunks.
+
+    With a process pool, rows added by render() are mogrified in the pool in chunks of chunk_rows. Pending
+    results are queued in order with the plain sql given to write(), so output keeps the order of calls.
+    Binary values from hex_bytes bytes on are rendered as hex literals.
+    """
+
+    def __init__(self, f_out, queue_size=1000, pool=None, charset='utf8', chunk_rows=1000, hex_bytes=HEX_BYTES):
+        self.f_out = f_out
+        self.queue = Queue(maxsize=queue_size)
+        self.pool = pool
+        self.charset = charset
+        self.hex_bytes = hex_bytes
+        self.chunk_rows = chunk_rows
+        self.chunk = []
+        self.error = None
+        self.thread = threading.Thread(target=self._write, name='binlog2sql-write')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is END:
+                    return
+                if self.error is not None:
+                    continue
+                if item is FLUSH:
+                    self.f_out.flush()
+                elif isinstance(item, str) or isinstance(item, type(u'')):
+                    self.f_out.write(item)
+                else:
+                    # AsyncResult of render_chunk
+                    self.f_out.write(item.get())
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _put(self, item):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(item)
+
+    def render(self, prefix, template, values, position):
+        """add the sql prefix + cursor.mogrify(template, values) + position"""
+        self.chunk.append((prefix, template, values, position))
+        if len(self.chunk) >= self.chunk_rows:
+            self.submit()
+
+    def submit(self):
+        if self.chunk:
+            self._put(self.pool.apply_async(render_chunk, (self.charset, self.chunk, self.hex_bytes)))
+            self.chunk = []
+
+    def write(self, data):
+        self.submit()
+        self._put(data)
+
+    def flush(self):
+        self.submit()
+        self._put(FLUSH)
+
+    def sync(self):
+        """wait until everything is written, then sync f_out"""
+        self.submit()
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+        return self.f_out.sync()
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def close(self):
+        """write what is left. f_out itself is not closed"""
+        self.submit()
+        self.queue.put(END)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class QueueMonitor(object):
+    """Print the depth of each stage's queue to stderr every interval seconds, to show the bottleneck:
+    a full queue waits on the stage after it, an empty one on the stage before it"""
+
+    def __init__(self, stages, interval=10.0, f_err=None):
+        self.stages = stages
+        self.interval = interval
+        self.f_err = f_err if f_err else sys.stderr
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='binlog2sql-monitor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def depths(self):
+        return dict((name, stage.depth()) for (name, stage) in self.stages.items())
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.f_err.write('%s queue depth: %s\n' % (
+                time.strftime('%Y-%m-%d %H:%M:%S'),
+                ', '.join('%s %d/%d' % (name, stage.depth(), stage.queue.maxsize)
+                          for (name, stage) in sorted(self.stages.items()))))
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+_render_connection = None
+
+
+def render_chunk(charset, chunk, hex_bytes=HEX_BYTES):
+    """process pool worker: render rows of PipelineWriter.render, like cursor.mogrify"""
+    global _render_connection
+    if _render_connection is None or \
+            (_render_connection.charset, _render_connection.hex_bytes) != (charset, hex_bytes):
+        _render_connection = OfflineConnection(charset=charset, hex_bytes=hex_bytes)
+    return ''.join([prefix + _render_connection.mogrify(template, values) + position + '\n'
+                    for (prefix, template, values, position) in chunk])
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+from collections import namedtuple
+
+# bytes [start, stop) of a binlog file a dump scans, stop None if unknown
+BinlogSpan = namedtuple('BinlogSpan', ['binlog', 'start', 'stop'])
+
+
+def binlog_number(binlog):
+    """Sequence number of a binlog file: mysql-bin.000042 -> 42.
+
+    Past mysql-bin.999999 comes mysql-bin.1000000, so numbers compare as integers, never as strings.
+    """
+    return int(binlog.rsplit('.', 1)[1])
+
+
+def local_binlog_index(binlog_dir, start_file):
+    """[(binlog, size)] of the binlog files in binlog_dir named like start_file, in sequence order"""
+    prefix = start_file.rsplit('.', 1)[0] + '.'
+    binlogs = [f for f in os.listdir(binlog_dir) if f.startswith(prefix) and f[len(prefix):].isdigit()]
+    return [(binlog, os.path.getsize(os.path.join(binlog_dir, binlog)))
+            for binlog in sorted(binlogs, key=binlog_number)]
+
+
+class BinlogRange(object):
+    """The binlog files of a dump in order, with the bytes of each it scans.
+
+    binlog_index: [(binlog, size)] of the binlog files of the server, size None if unknown. eof: (binlog, pos)
+    the server has written up to, where a range without end_pos stops.
+    """
+
+    def __init__(self, binlog_index, start_file, start_pos=4, end_file=None, end_pos=None, eof=None):
+        self.binlog_index = binlog_index
+        self.sizes = dict(binlog_index)
+        if start_file not in self.sizes:
+            raise ValueError('parameter error: start_file %s not in mysql server' % start_file)
+        self.end_file, self.end_pos = (end_file if end_file else start_file, end_pos)
+        self.eof = eof
+        first, last = (binlog_number(start_file), binlog_number(self.end_file))
+        self.spans = [self.span(binlog, start_pos if binlog == start_file else 4) for (binlog, _) in binlog_index
+                      if first <= binlog_number(binlog) <= last]
+        self._positions = dict((span.binlog, i) for (i, span) in enumerate(self.spans))
+
+    def span(self, binlog, start):
+        if self.end_pos and binlog == self.end_file:
+            stop = self.end_pos
+        elif self.eof and binlog == self.eof[0]:
+            stop = self.eof[1]
+        else:
+            stop = self.sizes.get(binlog)
+        return BinlogSpan(binlog, start, stop)
+
+    def __contains__(self, binlog):
+        return binlog in self._positions
+
+    def __len__(self):
+        return len(self.spans)
+
+    def binlogs(self):
+        return [span.binlog for span in self.spans]
+
+    def seek(self, binlog, pos):
+        """start the range at pos of binlog, dropping the files before it"""
+        spans = self.spans[self._positions[binlog]:]
+        self.spans = [self.span(binlog, pos)] + spans[1:]
+        self._positions = dict((span.binlog, i) for (i, span) in enumerate(self.spans))
+
+    def stops(self):
+        """(binlog, stop) of every file, where the dump stops reading it"""
+        return [(span.binlog, span.stop) for span in self.spans]
+
+    def total_bytes(self):
+        """bytes to scan, None if the size of a file is unknown"""
+        if any(span.stop is None for span in self.spans):
+            return None
+        return sum(span.stop - span.start for span in self.spans)
+
+    def chunks(self, count):
+        """(first, last) binlogs of runs of consecutive files splitting the range in about count chunks of
+        similar bytes, a file per chunk if sizes are unknown. Files are never split"""
+        total = self.total_bytes()
+        if total is None:
+            return [(span.binlog, span.binlog) for span in self.spans]
+        target = float(total) / max(count, 1)
+        chunks = []
+        size = 0
+        for span in self.spans:
+            if not chunks or size >= target:
+                chunks.append([span.binlog, span.binlog])
+                size = 0
+            chunks[-1][1] = span.binlog
+            size += span.stop - span.start
+        return [tuple(chunk) for chunk in chunks]
+
+
+class BinlogIndexCache(object):
+    """SHOW BINARY LOGS of servers kept in a json file for ttl seconds, to skip it in repeated runs.
+
+    Sizes of binlogs before the one being written never change, so an entry holds while that one is still
+    its last binlog. ttl bounds how long purged binlogs stay listed. The file maps "host:port" to
+    {"time": fetched at, "binlogs": [[binlog, size], ...]}.
+    """
+
+    def __init__(self, filename, ttl=60.0):
+        self.filename = filename
+        self.ttl = ttl
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return {}
+        with open(self.filename) as f:
+            return json.load(f)
+
+    def get(self, server, eof_file):
+        """[(binlog, size)] cached for server, None if stale or rotated past eof_file"""
+        entry = self.load().get(server)
+        if not entry or time.time() - entry['time'] > self.ttl or not entry['binlogs'] \
+                or entry['binlogs'][-1][0] != eof_file:
+            return None
+        return [tuple(binlog) for binlog in entry['binlogs']]
+
+    def put(self, server, binlog_index):
+        servers = self.load()
+        servers[server] = {'time': time.time(), 'binlogs': [list(binlog) for binlog in binlog_index]}
+        # write then rename, so a crash or another run never leaves half a file
+        tmp_file = '%s.%d.tmp' % (self.filename, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(servers, f, sort_keys=True)
+        os.rename(tmp_file, self.filename)
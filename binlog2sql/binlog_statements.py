@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import base64
+import pickle
+import datetime
+from compact_rows import RowColumns, CompactRow
+
+# sql type of the statement undoing a row event of each type
+FLASHBACK_TYPES = {'INSERT': 'DELETE', 'UPDATE': 'UPDATE', 'DELETE': 'INSERT'}
+
+
+class Statement(object):
+    """A statement of Binlog2sql.iter_statements, with the table and binlog position it comes from.
+
+    type is the sql type of the statement: INSERT, UPDATE or DELETE for a row, which in flashback mode undoes
+    a row event of the opposite type, QUERY for other statements, with the table of DDL naming one. start_pos
+    is where the transaction of the statement starts in log_file, end_pos where its event ends. Statements of
+    rows hold the CompactRow of the row event, and template and values to execute with a driver; their sql is
+    only rendered when read.
+    """
+
+    __slots__ = ('log_file', 'start_pos', 'end_pos', 'timestamp', 'schema', 'table', 'type', 'template', 'values',
+                 'row', 'connection', '_sql')
+
+    def __init__(self, log_file, start_pos, end_pos, timestamp, schema, table, type, template, values=None, row=None,
+                 connection=None, sql=None):
+        self.log_file, self.start_pos, self.end_pos, self.timestamp = (log_file, start_pos, end_pos, timestamp)
+        self.schema, self.table, self.type = (schema, table, type)
+        self.template, self.values, self.row = (template, values, row)
+        self.connection = connection
+        self._sql = sql
+
+    @property
+    def sql(self):
+        """the statement, without the position comment of printed sql"""
+        if self._sql is None:
+            self._sql = self.connection.mogrify(self.template, self.values)
+        return self._sql
+
+    @property
+    def time(self):
+        return datetime.datetime.fromtimestamp(self.timestamp)
+
+    def dumps(self):
+        """one line of text to be read back with Statement.loads"""
+        row = self.row.images() if self.row is not None else None
+        state = (self.log_file, self.start_pos, self.end_pos, self.timestamp, self.schema, self.table, self.type,
+                 self.template, self.values, row, self._sql)
+        return base64.b64encode(pickle.dumps(state, protocol=2)).decode('ascii')
+
+    @classmethod
+    def loads(cls, line, connection=None):
+        state = pickle.loads(base64.b64decode(line))
+        row = None
+        if state[9] is not None:
+            before_names, before, after_names, after = state[9]
+            row = CompactRow(row_columns(before_names), before, row_columns(after_names), after)
+        return cls(*state[:9], row=row, connection=connection, sql=state[10])
+
+    def __repr__(self):
+        return 'Statement(%s:%s-%s %s %s.%s)' % (self.log_file, self.start_pos, self.end_pos, self.type,
+                                                 self.schema, self.table)
+
+
+def row_columns(names):
+    return RowColumns.get(names) if names is not None else None
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import zlib
+from pymysqlreplication.event import QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent
+
+# a seek lands at most this many bytes before the first event we need
+DEFAULT_STRIDE = 1024 * 1024
+
+
+def binlog_fingerprint(binlog_event):
+    """crc32 of a FormatDescriptionEvent's timestamp, server_id, binlog and server version and header length.
+
+    The create time of the body is left out: the server zeroes it in the event it sends when a dump starts
+    mid-file. The fields kept are the same whether the event is read from file or streamed from any position,
+    and the timestamp changes when a binlog name is reused.
+    """
+    data = binlog_event.packet.packet.get_all_data()
+    # ok byte, timestamp(4), type(1), server_id(4), ..., 19 bytes header, then the body: binlog version(2),
+    # server version(50), create time(4), header length(1)
+    return zlib.crc32(data[1:5] + data[6:10] + data[20:72] + data[76:77]) & 0xffffffff
+
+
+class BinlogTimeIndex(object):
+    """Sparse index of one binlog file: positions of events outside transactions, every `stride` bytes,
+    each with the max timestamp of all events before it.
+
+    Only the first `covered` bytes of the file are indexed. `complete` is set when the whole file was read.
+    """
+
+    def __init__(self, log_file, fingerprint=None, stride=DEFAULT_STRIDE, entries=None, covered=4,
+                 complete=False, max_timestamp=0):
+        self.log_file = log_file
+        self.fingerprint = fingerprint
+        self.stride = stride
+        self.entries = entries if entries else []
+        self.covered = covered
+        self.complete = complete
+        self.max_timestamp = max_timestamp
+
+    @staticmethod
+    def index_file(index_dir, log_file):
+        return os.path.join(index_dir, '%s.tsidx' % log_file)
+
+    @classmethod
+    def load(cls, index_dir, log_file):
+        try:
+            with open(cls.index_file(index_dir, log_file)) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        return cls(log_file, fingerprint=data['fingerprint'], stride=data['stride'],
+                   entries=[tuple(entry) for entry in data['entries']], covered=data['covered'],
+                   complete=data['complete'], max_timestamp=data['max_timestamp'])
+
+    def save(self, index_dir):
+        filename = self.index_file(index_dir, self.log_file)
+        # write then rename, so a concurrent run never reads half an index
+        with open(filename + '.tmp', 'w') as f:
+            json.dump({'fingerprint': self.fingerprint, 'stride': self.stride, 'entries': self.entries,
+                       'covered': self.covered, 'complete': self.complete, 'max_timestamp': self.max_timestamp}, f)
+        os.rename(filename + '.tmp', filename)
+
+    def is_valid(self, fingerprint, size):
+        """an index is stale if the binlog name was reused, or the file is not the one it was built from"""
+        if self.fingerprint is None or fingerprint != self.fingerprint or size is None:
+            return False
+        if self.complete:
+            return size == self.covered
+        return size >= self.covered
+
+    def add(self, timestamp, position):
+        if not self.entries or position - self.entries[-1][1] >= self.stride:
+            self.entries.append((timestamp, position))
+
+    def seek_position(self, timestamp):
+        """the last indexed position with all events before it older than timestamp"""
+        position = 4
+        for (max_timestamp, entry_pos) in self.entries:
+            if max_timestamp >= timestamp:
+                break
+            position = entry_pos
+        return position
+
+
+class TimeIndexBuilder(object):
+    """Build time indexes of the binlog files a stream reads from their first event"""
+
+    def __init__(self, index_dir, log_file, log_pos, stride=DEFAULT_STRIDE):
+        self.index_dir = index_dir
+        self.stride = stride
+        self.log_file = log_file
+        self.last_pos = log_pos
+        self.in_transaction = False
+        self.index = BinlogTimeIndex(log_file, stride=stride) if log_pos == 4 else None
+
+    def feed(self, binlog_event):
+        if isinstance(binlog_event, RotateEvent):
+            if binlog_event.next_binlog != self.log_file:
+                if binlog_event.packet.log_pos:
+                    self.last_pos = binlog_event.packet.log_pos
+                self.finish(complete=True)
+                self.log_file = binlog_event.next_binlog
+                self.index = BinlogTimeIndex(self.log_file, stride=self.stride) \
+                    if binlog_event.position == 4 else None
+            self.last_pos = binlog_event.position
+            return
+
+        if self.index is not None:
+            if isinstance(binlog_event, FormatDescriptionEvent):
+                if self.index.fingerprint is None:
+                    self.index.fingerprint = binlog_fingerprint(binlog_event)
+            elif isinstance(binlog_event, QueryEvent) and not self.in_transaction:
+                # BEGIN or DDL: the position before it is outside any transaction
+                self.index.add(self.index.max_timestamp, self.last_pos)
+            if binlog_event.timestamp > self.index.max_timestamp:
+                self.index.max_timestamp = binlog_event.timestamp
+        if isinstance(binlog_event, QueryEvent) and binlog_event.query in ('BEGIN', 'COMMIT'):
+            self.in_transaction = binlog_event.query == 'BEGIN'
+        elif isinstance(binlog_event, XidEvent):
+            self.in_transaction = False
+        if binlog_event.packet.log_pos:
+            self.last_pos = binlog_event.packet.log_pos
+
+    def finish(self, complete=False):
+        if self.index is not None and self.index.fingerprint is not None:
+            self.index.covered = self.last_pos
+            self.index.complete = complete
+            saved = BinlogTimeIndex.load(self.index_dir, self.log_file)
+            # keep an index of the same file that already covers more of it
+            if saved is None or saved.fingerprint != self.index.fingerprint or saved.covered < self.index.covered:
+                self.index.save(self.index_dir)
+        self.index = None
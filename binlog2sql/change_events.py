@@ -0,0 +1,413 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import gzip
+import struct
+import binascii
+import datetime
+from decimal import Decimal
+from collections import OrderedDict
+from pymysqlreplication.constants import FIELD_TYPE
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+from binlog2sql_util import PY3PLUS, HEX_BYTES, fix_object, event_type, primary_key_columns, ddl_event_table
+from sql_output import COMPRESS_SUFFIX, open_compressed
+from binlog_statements import FLASHBACK_TYPES
+from compact_rows import compact_row
+
+OUTPUT_FORMATS = ('sql', 'json', 'columnar')
+# first bytes of a columnar file
+COLUMNAR_MAGIC = b'B2SQLC1\n'
+INT64_MIN, INT64_MAX = (-2 ** 63, 2 ** 63 - 1)
+TEXT_TYPES = (str, type(u''))
+
+
+def time_text(value):
+    """a TIME value, decoded as timedelta, as MySQL writes it: -838:59:59 to 838:59:59"""
+    microseconds = (value.days * 86400 + value.seconds) * 1000000 + value.microseconds
+    sign = '-' if microseconds < 0 else ''
+    seconds, microseconds = divmod(abs(microseconds), 1000000)
+    text = '%s%02d:%02d:%02d' % (sign, seconds // 3600, seconds // 60 % 60, seconds % 60)
+    if microseconds:
+        text += '.%06d' % microseconds
+    return text
+
+
+def text_value(value):
+    """a value json and columns have no type for as text: DECIMAL exactly, dates and times as MySQL writes them,
+    SET values joined by commas"""
+    if isinstance(value, datetime.timedelta):
+        return time_text(value)
+    if isinstance(value, set):
+        return ','.join(sorted(value))
+    if PY3PLUS and isinstance(value, bytes):
+        return '0x' + binascii.hexlify(value).decode('ascii')
+    return fix_object(str(value))
+
+
+def logical_type(value):
+    if isinstance(value, Decimal):
+        return 'decimal'
+    if isinstance(value, datetime.datetime):
+        return 'datetime'
+    if isinstance(value, datetime.date):
+        return 'date'
+    if isinstance(value, datetime.timedelta):
+        return 'time'
+    if isinstance(value, set):
+        return 'set'
+    return 'text'
+
+
+class JsonChanges(object):
+    """Write the change events of rows to f_out as lines of json, in place of sql.
+
+    A row is {"log_file", "start_pos", "end_pos", "timestamp", "schema", "table", "type", "key", "before",
+    "after"}, key being the columns identifying rows, before and after the row images, null for the image an
+    INSERT or a DELETE has not. In flashback mode it is the change undoing the row: type inverted and images
+    swapped. A query is {..., "type": "QUERY", "sql"}. Binary values are text if they are utf-8 and shorter than
+    hex_bytes, else {"hex": "..."}; DECIMAL, date and time values are text as MySQL writes them, SET values lists.
+    """
+
+    def __init__(self, f_out, flashback=False, hex_bytes=HEX_BYTES):
+        self.f_out = f_out
+        self.flashback = flashback
+        self.hex_bytes = hex_bytes
+        self.encode = json.JSONEncoder(default=self.json_value, separators=(',', ':'), ensure_ascii=False).encode
+
+    def json_value(self, value):
+        if PY3PLUS and isinstance(value, bytes):
+            if len(value) < self.hex_bytes or not value:
+                try:
+                    return value.decode('utf-8')
+                except UnicodeDecodeError:
+                    pass
+            return {'hex': binascii.hexlify(value).decode('ascii')}
+        if isinstance(value, set):
+            return sorted(value)
+        return text_value(value)
+
+    def write_row(self, log_file, binlog_event, row, e_start_pos, key_columns=None):
+        row = compact_row(binlog_event, row)
+        before = dict(zip(row.before_columns.names, row.before)) if row.before is not None else None
+        after = dict(zip(row.after_columns.names, row.after)) if row.after is not None else None
+        sql_type = event_type(binlog_event)
+        if self.flashback:
+            sql_type, before, after = (FLASHBACK_TYPES[sql_type], after, before)
+        self.f_out.write(self.encode({
+            'log_file': log_file, 'start_pos': e_start_pos, 'end_pos': binlog_event.packet.log_pos,
+            'timestamp': binlog_event.timestamp, 'schema': binlog_event.schema, 'table': binlog_event.table,
+            'type': sql_type, 'key': list(key_columns or primary_key_columns(binlog_event)), 'before': before,
+            'after': after}) + '\n')
+
+    def write_query(self, log_file, binlog_event, e_start_pos):
+        # as in sql, queries are not undone in flashback mode
+        if self.flashback or binlog_event.query in ('BEGIN', 'COMMIT'):
+            return
+        self.f_out.write(self.encode({
+            'log_file': log_file, 'start_pos': e_start_pos, 'end_pos': binlog_event.packet.log_pos,
+            'timestamp': binlog_event.timestamp, 'schema': fix_object(binlog_event.schema), 'type': 'QUERY',
+            'sql': fix_object(binlog_event.query)}) + '\n')
+
+
+def column_type(values, locked=None):
+    """(type, logical type) to store values in: int64, float64, utf8, binary or null if all are None. Values
+    of other types, or of mixed types, are stored as utf8 text, with the logical type of the first one.
+
+    locked is the (type, logical type) earlier batches of the column got, kept if all values fit in it"""
+    kinds = set(type(value) for value in values if value is not None)
+    if not kinds:
+        return 'null', None
+    if locked is not None and fits(locked[0], kinds, values):
+        return locked
+    if kinds <= set([int, bool, type(2 ** 64)]):
+        numbers = [value for value in values if value is not None]
+        # BIGINT UNSIGNED goes past int64
+        if INT64_MIN <= min(numbers) and max(numbers) <= INT64_MAX:
+            return 'int64', None
+        return 'utf8', 'decimal'
+    if kinds <= set([float, int]):
+        return 'float64', None
+    if kinds <= set(TEXT_TYPES):
+        return 'utf8', None
+    if PY3PLUS and kinds == set([bytes]):
+        return 'binary', None
+    return 'utf8', logical_type(next(value for value in values if value is not None))
+
+
+def fits(ctype, kinds, values):
+    """whether values, of the python types kinds, can be stored as ctype. Anything can be utf8 text"""
+    if ctype == 'int64':
+        numbers = [value for value in values if value is not None]
+        return kinds <= set([int, bool, type(2 ** 64)]) and INT64_MIN <= min(numbers) and max(numbers) <= INT64_MAX
+    if ctype == 'float64':
+        return kinds <= set([float, int])
+    if ctype == 'binary':
+        return kinds == set([bytes])
+    return ctype == 'utf8'
+
+
+def validity_bitmap(values):
+    """bit i set if values[i] is not None, least significant bit first"""
+    bits = bytearray((len(values) + 7) // 8)
+    for (i, value) in enumerate(values):
+        if value is not None:
+            bits[i >> 3] |= 1 << (i & 7)
+    return bytes(bits)
+
+
+def encode_column(name, values, locked=None):
+    """(header, buffers) of a column. buffers are the validity bitmap (empty without nulls), the offsets of
+    variable length values and the data, laid out as arrow arrays of int64, float64, large_string and
+    large_binary are. locked is passed on to column_type"""
+    ctype, logical = column_type(values, locked)
+    nulls = values.count(None)
+    validity = validity_bitmap(values) if nulls else b''
+    offsets, data = (b'', b'')
+    if ctype in ('int64', 'float64'):
+        fill = 0 if ctype == 'int64' else 0.0
+        data = struct.pack('<%d%s' % (len(values), 'q' if ctype == 'int64' else 'd'),
+                           *[fill if value is None else value for value in values])
+    elif ctype != 'null':
+        parts = []
+        for value in values:
+            if value is None:
+                value = b''
+            elif ctype != 'binary':
+                if not isinstance(value, TEXT_TYPES):
+                    value = text_value(value)
+                if isinstance(value, type(u'')):
+                    value = value.encode('utf-8')
+            parts.append(value)
+        positions = [0] * (len(parts) + 1)
+        position = 0
+        for (i, part) in enumerate(parts):
+            position += len(part)
+            positions[i + 1] = position
+        offsets, data = (struct.pack('<%dq' % len(positions), *positions), b''.join(parts))
+    header = {'name': name, 'type': ctype, 'nulls': nulls, 'buffers': [len(validity), len(offsets), len(data)]}
+    if logical:
+        header['logical'] = logical
+    return header, [validity, offsets, data]
+
+
+def padding(size):
+    return b'\0' * (-size % 8)
+
+
+class ColumnarWriter(object):
+    """Write the change events of rows to filename in batches of columns, in place of sql.
+
+    Rows of the same table, type and columns go into a batch of the columns seq (the order of the row in the
+    output), log_file, start_pos, end_pos and timestamp, then before.<column> and after.<column> for the columns
+    of the row images the type has. Batches are written when batch_rows rows are pending between them.
+
+    The type a column is stored as is locked in at the first batch of its table with values in it, so that
+    readers see one type per column. BIGINT UNSIGNED, which may go past int64, is always decimal text. DDL on
+    the table unlocks its columns. Only values that do not fit the locked type at all make a batch of their own
+    type.
+
+    The file is COLUMNAR_MAGIC then batches: a 4 bytes little endian header length, a json header
+    {"schema", "table", "type", "key", "rows", "columns": [{"name", "type", "nulls", "buffers", "logical"}]}
+    and the buffers of each column, every part padded to 8 bytes. read_columnar reads it back.
+    """
+
+    def __init__(self, filename, batch_rows=10000, compress=None):
+        if compress and compress not in COMPRESS_SUFFIX:
+            raise ValueError('unknown compression: %s' % compress)
+        if compress and not filename.endswith(COMPRESS_SUFFIX[compress]):
+            filename += COMPRESS_SUFFIX[compress]
+        self.filename = filename
+        self.batch_rows = batch_rows
+        self.compress = compress
+        self.raw = open(filename, 'wb')
+        self.f = open_compressed(self.raw, compress) if compress else self.raw
+        self.f.write(COLUMNAR_MAGIC)
+        self.seq = 0
+        self._batches = OrderedDict()
+        self._rows = 0
+        # (schema, table, column name) to the (type, logical type) its batches are stored as
+        self.column_types = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, traceback):
+        self.close()
+
+    def write_row(self, log_file, binlog_event, row, e_start_pos, key_columns=None):
+        row = compact_row(binlog_event, row)
+        shape = (binlog_event.schema, binlog_event.table, event_type(binlog_event),
+                 row.before_columns if row.before is not None else None,
+                 row.after_columns if row.after is not None else None,
+                 tuple(key_columns or primary_key_columns(binlog_event)))
+        batch = self._batches.get(shape)
+        if batch is None:
+            batch = self._batches[shape] = []
+            for column in getattr(binlog_event, 'columns', None) or []:
+                if column.type == FIELD_TYPE.LONGLONG and getattr(column, 'unsigned', False):
+                    for prefix in ('before.', 'after.'):
+                        self.column_types.setdefault(shape[:2] + (prefix + column.name,), ('utf8', 'decimal'))
+        batch.append((self.seq, log_file, e_start_pos, binlog_event.packet.log_pos, binlog_event.timestamp,
+                      row.before, row.after))
+        self.seq += 1
+        self._rows += 1
+        if self._rows >= self.batch_rows:
+            self.drain()
+
+    def write_query(self, log_file, binlog_event, e_start_pos):
+        """queries have no place in batches of rows, DDL unlocks the column types of its table"""
+        touched = ddl_event_table(binlog_event)
+        if touched is None:
+            return
+        # rows from before the DDL are stored with the types they had
+        self.drain()
+        schema, table = touched
+        for key in list(self.column_types):
+            if schema is None or (key[0] == schema and table in (None, key[1])):
+                del self.column_types[key]
+
+    def write(self, data):
+        raise ValueError('columnar output only takes rows')
+
+    def drain(self):
+        """write out the pending batches"""
+        for (shape, rows) in self._batches.items():
+            self.write_batch(shape, rows)
+        self._batches = OrderedDict()
+        self._rows = 0
+
+    def write_batch(self, shape, rows):
+        schema, table, sql_type, before_columns, after_columns, key = shape
+        columns = list(zip(('seq', 'log_file', 'start_pos', 'end_pos', 'timestamp'),
+                           zip(*[row[:5] for row in rows])))
+        for (prefix, columns_of, i) in (('before.', before_columns, 5), ('after.', after_columns, 6)):
+            if columns_of is not None:
+                columns += zip([prefix + name for name in columns_of.names], zip(*[row[i] for row in rows]))
+        headers, buffers = ([], [])
+        for (name, values) in columns:
+            type_key = (schema, table, name)
+            header, column_buffers = encode_column(name, list(values), self.column_types.get(type_key))
+            if type_key not in self.column_types and header['type'] != 'null':
+                self.column_types[type_key] = (header['type'], header.get('logical'))
+            headers.append(header)
+            buffers += column_buffers
+        header = json.dumps({'schema': schema, 'table': table, 'type': sql_type, 'key': list(key),
+                             'rows': len(rows), 'columns': headers}, separators=(',', ':')).encode('utf-8')
+        parts = [struct.pack('<I', len(header)), header, padding(4 + len(header))]
+        for buffer in buffers:
+            parts += [buffer, padding(len(buffer))]
+        self.f.write(b''.join(parts))
+
+    def flush(self):
+        self.drain()
+        if not self.compress:
+            self.f.flush()
+
+    def close(self):
+        if self.raw is not None:
+            self.drain()
+            if self.compress:
+                self.f.close()
+            self.raw.close()
+            self.raw, self.f = (None, None)
+
+
+class ColumnBatch(object):
+    """A batch of a columnar file: schema, table, type, key and rows of the header, columns decoded on demand"""
+
+    def __init__(self, header, data):
+        self.schema, self.table, self.type = (header['schema'], header['table'], header['type'])
+        self.key, self.rows = (header['key'], header['rows'])
+        self.columns = header['columns']
+        self.names = [column['name'] for column in self.columns]
+        self._buffers = {}
+        offset = 0
+        for column in self.columns:
+            buffers = []
+            for size in column['buffers']:
+                buffers.append(data[offset:offset + size])
+                offset += size + (-size % 8)
+            self._buffers[column['name']] = buffers
+
+    def column(self, name):
+        """the values of column name as a list, None for nulls. Values of a logical type are text"""
+        column = self.columns[self.names.index(name)]
+        validity, offsets, data = self._buffers[name]
+        n = self.rows
+        if column['type'] == 'null':
+            return [None] * n
+        if column['type'] in ('int64', 'float64'):
+            values = list(struct.unpack('<%d%s' % (n, 'q' if column['type'] == 'int64' else 'd'), data))
+        else:
+            positions = struct.unpack('<%dq' % (n + 1), offsets)
+            values = [data[positions[i]:positions[i + 1]] for i in range(n)]
+            if column['type'] == 'utf8':
+                values = [value.decode('utf-8') for value in values]
+        if validity:
+            validity = bytearray(validity)
+            values = [value if validity[i >> 3] & (1 << (i & 7)) else None for (i, value) in enumerate(values)]
+        return values
+
+    def to_arrow(self):
+        """the batch as a pyarrow RecordBatch, made from the buffers as they are"""
+        if pyarrow is None:
+            raise ValueError('to_arrow needs the pyarrow package')
+        types = {'int64': pyarrow.int64(), 'float64': pyarrow.float64(), 'utf8': pyarrow.large_string(),
+                 'binary': pyarrow.large_binary()}
+        arrays = []
+        for column in self.columns:
+            validity, offsets, data = self._buffers[column['name']]
+            if column['type'] == 'null':
+                arrays.append(pyarrow.nulls(self.rows))
+                continue
+            buffers = [pyarrow.py_buffer(validity) if validity else None]
+            if offsets:
+                buffers.append(pyarrow.py_buffer(offsets))
+            buffers.append(pyarrow.py_buffer(data))
+            arrays.append(pyarrow.Array.from_buffers(types[column['type']], self.rows, buffers,
+                                                     null_count=column['nulls']))
+        return pyarrow.RecordBatch.from_arrays(arrays, self.names)
+
+
+def open_columnar(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    if filename.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError('zstd compression needs the zstandard package')
+        return zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True)
+    return open(filename, 'rb')
+
+
+def read_exactly(f, size):
+    data = f.read(size)
+    # decompressing streams may return less than asked for
+    while len(data) < size:
+        more = f.read(size - len(data))
+        if not more:
+            raise ValueError('truncated columnar file')
+        data += more
+    return data
+
+
+def read_columnar(filename):
+    """Generate the ColumnBatches of a file of ColumnarWriter"""
+    with open_columnar(filename) as f:
+        if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError('not a columnar file: %s' % filename)
+        while True:
+            size = f.read(4)
+            if not size:
+                return
+            size = struct.unpack('<I', size + read_exactly(f, 4 - len(size)))[0]
+            header = json.loads(read_exactly(f, size + (-(4 + size) % 8))[:size].decode('utf-8'))
+            data_size = sum(size + (-size % 8) for column in header['columns'] for size in column['buffers'])
+            yield ColumnBatch(header, read_exactly(f, data_size))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from operator import itemgetter
+from collections import OrderedDict
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent
+
+# distinct column lists kept by RowColumns.get before it starts over
+MAX_SHAPES = 65536
+
+
+class RowColumns(object):
+    """Column names of a row image, shared by every image with the same columns.
+
+    RowColumns.get returns the same object for the same names, so row shapes compare and hash by identity.
+    """
+
+    __slots__ = ('names', 'index')
+    _shapes = {}
+
+    def __init__(self, names):
+        self.names = names
+        self.index = dict((name, i) for (i, name) in enumerate(names))
+
+    @classmethod
+    def get(cls, names):
+        columns = cls._shapes.get(names)
+        if columns is None:
+            if len(cls._shapes) >= MAX_SHAPES:
+                cls._shapes.clear()
+            columns = cls._shapes[names] = cls(names)
+        return columns
+
+    def picker(self, names):
+        """function returning the values of names, in that order, from a tuple of values of these columns"""
+        indexes = tuple(self.index[name] for name in names)
+        if len(indexes) > 1:
+            # a tuple already
+            return itemgetter(*indexes)
+
+        def pick(values):
+            return tuple(values[i] for i in indexes)
+        return pick
+
+    def values_of(self, values, names):
+        """values of names in a tuple of values of these columns, None for columns it does not have"""
+        index = self.index
+        return [values[index[name]] if name in index else None for name in names]
+
+    def __repr__(self):
+        return 'RowColumns(%r)' % (self.names,)
+
+
+class CompactRow(object):
+    """A row of a row event as tuples of values, with the columns of each image shared by all rows.
+
+    before is the image the row event matches: the row of a DELETE, the before image of an UPDATE, None for
+    an INSERT. after is the image it leaves: the row of an INSERT, the after image of an UPDATE, None for a
+    DELETE. row['values'], row['before_values'] and row['after_values'] build the dicts pymysqlreplication
+    decodes, for code that needs them.
+    """
+
+    __slots__ = ('before_columns', 'before', 'after_columns', 'after')
+
+    def __init__(self, before_columns, before, after_columns, after):
+        self.before_columns, self.before = (before_columns, before)
+        self.after_columns, self.after = (after_columns, after)
+
+    def __getitem__(self, name):
+        if name == 'values':
+            if self.before is not None:
+                return image_dict(self.before_columns, self.before)
+            return image_dict(self.after_columns, self.after)
+        if name == 'before_values' and self.before is not None and self.after is not None:
+            return image_dict(self.before_columns, self.before)
+        if name == 'after_values' and self.before is not None and self.after is not None:
+            return image_dict(self.after_columns, self.after)
+        raise KeyError(name)
+
+    def __eq__(self, other):
+        return isinstance(other, CompactRow) and self.images() == other.images()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def images(self):
+        """(before names, before, after names, after), None for the names of a missing image"""
+        return (self.before_columns.names if self.before is not None else None, self.before,
+                self.after_columns.names if self.after is not None else None, self.after)
+
+    def __repr__(self):
+        return 'CompactRow(%r, %r, %r, %r)' % self.images()
+
+
+def image_dict(columns, values):
+    return OrderedDict(zip(columns.names, values))
+
+
+def compact_row(binlog_event, row):
+    """the CompactRow of a row dict of binlog_event, as pymysqlreplication decodes it"""
+    if isinstance(row, CompactRow):
+        return row
+    if isinstance(binlog_event, UpdateRowsEvent):
+        before, after = (row['before_values'], row['after_values'])
+        return CompactRow(RowColumns.get(tuple(before)), tuple(before.values()),
+                          RowColumns.get(tuple(after)), tuple(after.values()))
+    values = row['values']
+    columns, values = (RowColumns.get(tuple(values)), tuple(values.values()))
+    if isinstance(binlog_event, WriteRowsEvent):
+        return CompactRow(None, None, columns, values)
+    return CompactRow(columns, values, None, None)
+
+
+def compact_rows(binlog_event, rows):
+    """CompactRows of row dicts of binlog_event"""
+    return [compact_row(binlog_event, row) for row in rows]
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+import sqlite3
+from collections import OrderedDict
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from compact_rows import RowColumns, CompactRow, compact_row
+
+# fields of a row state
+(SEQ, SCHEMA, TABLE, PRIMARY_KEY, BEFORE, AFTER, START_POS, LOG_POS, TIMESTAMP) = range(9)
+
+
+class RowCompactor(object):
+    """Net change of every row over a binlog range, tracked by table and key.
+
+    A row's state holds its image before its first change (None if the range inserted it) and after its last
+    change (None if the range deleted it), each as a (column names, values) pair of tuples. net_rows() turns
+    each state into one row event: an INSERT, UPDATE or DELETE from the first image to the last, or nothing
+    for a row inserted then deleted, or updated back to where it started. Rendered with flashback, that
+    event restores the first image.
+
+    States are kept pickled. Once they take more than memory_bytes, they are moved to an sqlite database in
+    spill_file and looked up there, and read back from it in order of first change.
+    """
+
+    def __init__(self, spill_file, memory_bytes=256 * 1024 * 1024):
+        self.spill_file = spill_file
+        self.memory_bytes = memory_bytes
+        # key -> (seq, pickled state), in order of first change unless spilled
+        self.states = OrderedDict()
+        self.size = 0
+        self.seq = 0
+        self.db = None
+
+    def add(self, binlog_event, row, key_columns, e_start_pos):
+        """track a row of a row event, a CompactRow or a row dict. Return False if the row can not be tracked:
+        no key, or an image without the key columns"""
+        if not key_columns:
+            return False
+        row = compact_row(binlog_event, row)
+        images = [(row.before_columns, row.before), (row.after_columns, row.after)]
+        if any(values is not None and any(k not in columns.index for k in key_columns)
+               for (columns, values) in images):
+            return False
+        before, after = [(columns.names, values) if values is not None else None for (columns, values) in images]
+        old_key = self.key(binlog_event, row.before_columns, row.before, key_columns) if before else None
+        new_key = self.key(binlog_event, row.after_columns, row.after, key_columns) if after else None
+        position = (e_start_pos, binlog_event.packet.log_pos, binlog_event.timestamp)
+        if old_key is not None and old_key != new_key:
+            # a DELETE, or an UPDATE moving the row to another key: the row leaves old_key
+            self._change(old_key, binlog_event, before, None, position)
+            before = None
+        if new_key is not None:
+            self._change(new_key, binlog_event, before, after, position)
+        return True
+
+    @staticmethod
+    def key(binlog_event, columns, values, key_columns):
+        return repr((binlog_event.schema, binlog_event.table, columns.values_of(values, key_columns)))
+
+    def _change(self, key, binlog_event, before, after, position):
+        state = self._get(key)
+        if state is None:
+            self.seq += 1
+            state = [self.seq, binlog_event.schema, binlog_event.table, getattr(binlog_event, 'primary_key', None),
+                     before, after, position[0], position[1], position[2]]
+        else:
+            state[AFTER], state[LOG_POS], state[TIMESTAMP] = (after, position[1], position[2])
+        self._put(key, state)
+
+    def _get(self, key):
+        item = self.states.get(key)
+        if item is not None:
+            return pickle.loads(item[1])
+        if self.db is not None:
+            found = self.db.execute('SELECT state FROM rows WHERE key = ?', (key,)).fetchone()
+            if found:
+                return pickle.loads(bytes(found[0]))
+        return None
+
+    def _put(self, key, state):
+        data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+        old = self.states.get(key)
+        if old is not None:
+            self.size -= len(old[1])
+        else:
+            self.size += len(key)
+        self.states[key] = (state[SEQ], data)
+        self.size += len(data)
+        if self.size > self.memory_bytes:
+            self.spill()
+
+    def spill(self):
+        """move the states in memory to spill_file"""
+        if self.db is None:
+            self.db = sqlite3.connect(self.spill_file)
+            # a scratch database: nothing to recover after a crash
+            self.db.execute('PRAGMA journal_mode = OFF')
+            self.db.execute('PRAGMA synchronous = OFF')
+            self.db.execute('CREATE TABLE rows (key TEXT PRIMARY KEY, seq INTEGER, state BLOB)')
+            self.db.execute('CREATE INDEX rows_seq ON rows (seq)')
+        self.db.executemany('INSERT OR REPLACE INTO rows VALUES (?, ?, ?)',
+                            ((key, seq, sqlite3.Binary(data)) for (key, (seq, data)) in self.states.items()))
+        self.states = OrderedDict()
+        self.size = 0
+
+    def changes(self, reverse=False):
+        """row states in order of first change, last first if reverse"""
+        if self.db is None:
+            items = list(self.states.values())
+            for (_, data) in reversed(items) if reverse else items:
+                yield pickle.loads(data)
+            return
+        self.spill()
+        for (data,) in self.db.execute('SELECT state FROM rows ORDER BY seq' + (' DESC' if reverse else '')):
+            yield pickle.loads(bytes(data))
+
+    def net_rows(self, reverse=False):
+        """(row event, CompactRow, e_start_pos) of the net change of every row that has one"""
+        for state in self.changes(reverse):
+            before, after = (state[BEFORE], state[AFTER])
+            if before == after:
+                continue
+            if before is None:
+                event_class = WriteRowsEvent
+            elif after is None:
+                event_class = DeleteRowsEvent
+            else:
+                event_class = UpdateRowsEvent
+            row = CompactRow(RowColumns.get(before[0]) if before else None, before[1] if before else None,
+                             RowColumns.get(after[0]) if after else None, after[1] if after else None)
+            yield (compacted_event(event_class, state), row, state[START_POS])
+
+    def clear(self):
+        self.states = OrderedDict()
+        self.size = 0
+        if self.db is not None:
+            self.db.execute('DELETE FROM rows')
+
+    def close(self):
+        self.clear()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+            os.remove(self.spill_file)
+
+
+class CompactedPacket(object):
+    def __init__(self, log_pos):
+        self.log_pos = log_pos
+
+
+def compacted_event(event_class, state):
+    """a row event of event_class standing for the net change of a row state, to render sql from"""
+    binlog_event = event_class.__new__(event_class)
+    binlog_event.schema, binlog_event.table = (state[SCHEMA], state[TABLE])
+    binlog_event.primary_key = state[PRIMARY_KEY]
+    binlog_event.timestamp = state[TIMESTAMP]
+    binlog_event.packet = CompactedPacket(state[LOG_POS])
+    return binlog_event
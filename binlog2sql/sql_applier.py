@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import threading
+import pymysql
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+# a row key in hex (empty for a barrier row), or QUERY_KEY for a query with its newlines escaped
+RECORD_RE = re.compile(r'^([0-9a-f]*|q)\t')
+QUERY_KEY = 'q'
+ESCAPE_RE = re.compile(r'\\(.)')
+UNESCAPES = {'n': '\n', 'r': '\r'}
+# worker control tasks
+COMMIT = 'COMMIT'
+STOP = 'STOP'
+
+
+def query_record(sql):
+    """the 'q\\tsql' record of a query statement, on one line: backslashes and line breaks are escaped"""
+    return QUERY_KEY + '\t' + sql.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def unescape_query(sql):
+    return ESCAPE_RE.sub(lambda m: UNESCAPES.get(m.group(1), m.group(1)), sql)
+
+
+def split_position_comment(sql):
+    """split 'sql; #start 4 end 120 time ...' into the sql and the transaction start position"""
+    i = sql.rfind(' #start ')
+    if i < 0:
+        return sql, None
+    return sql[:i], sql[i + len(' #start '):].split(' ', 1)[0]
+
+
+class SqlApplier(object):
+    """Execute generated sql on a target server through a pool of worker connections.
+
+    It is written to like a file, one 'key\\tsql' record per line. Rows with the same key (a hash of table and
+    primary key) always go to the same worker, so their order is kept. An empty key (an UPDATE that changes
+    the primary key) or a query record (DDL, see query_record) is a barrier: every worker commits, then it
+    runs alone.
+
+    Each worker commits at the first source transaction boundary after commit_every statements, and when
+    it has been idle for commit_interval seconds. rows_per_second throttles rows sent to workers.
+
+    Applying is not transaction-atomic: the rows of one source transaction are spread over the workers by key,
+    each worker commits on its own, and an idle commit may come in the middle of a source transaction. A
+    crash or an error can leave a source transaction partly applied on the target, even with one worker.
+    """
+
+    def __init__(self, connection_settings, workers=1, commit_every=1000, rows_per_second=0, commit_interval=1.0,
+                 queue_size=10000, connect=None):
+        self.commit_every = commit_every
+        self.rows_per_second = rows_per_second
+        self.commit_interval = commit_interval
+        connect = connect if connect else pymysql.connect
+        self.connections = [connect(**connection_settings) for _ in range(workers)]
+        self.queues = [Queue(maxsize=queue_size) for _ in range(workers)]
+        self.error = None
+        self.rows = 0
+        self._start = time.time()
+        self._buffer = ''
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, args=(i,), name='binlog2sql-apply-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def write(self, data):
+        lines = (self._buffer + data).split('\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self._add_line(line)
+
+    def flush(self):
+        pass
+
+    def _add_line(self, line):
+        if not line:
+            return
+        m = RECORD_RE.match(line)
+        if not m:
+            raise ValueError('not an apply record: %r' % line[:100])
+        key, sql = (m.group(1), line[m.end():])
+        if key == QUERY_KEY:
+            sql = unescape_query(sql)
+        sql, txn = split_position_comment(sql)
+        if not key or key == QUERY_KEY:
+            self.barrier()
+            if sql.startswith('USE ') and '\n' in sql:
+                # 'USE db;\nDDL;' of a QueryEvent: two statements on the same connection
+                use, sql = sql.split('\n', 1)
+                self._put(0, (None, use))
+            self._put(0, (None, sql))
+            self.barrier()
+            return
+        if self.rows_per_second:
+            self.rows += 1
+            delay = self.rows / float(self.rows_per_second) - (time.time() - self._start)
+            if delay > 0:
+                time.sleep(delay)
+        self._put(int(key, 16) % len(self.queues), (txn, sql))
+
+    def _put(self, i, task):
+        self.check()
+        self.queues[i].put(task)
+
+    def sync(self):
+        """commit everything written so far. There is no output state to keep in a checkpoint"""
+        self.barrier()
+        return None
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def barrier(self):
+        """wait until every worker has executed and committed what it was sent"""
+        for q in self.queues:
+            q.put(COMMIT)
+        for q in self.queues:
+            q.join()
+        self.check()
+
+    def close(self):
+        if self._buffer:
+            self._add_line(self._buffer)
+            self._buffer = ''
+        try:
+            self.barrier()
+        finally:
+            for q in self.queues:
+                q.put(STOP)
+            for thread in self.threads:
+                thread.join()
+            for connection in self.connections:
+                connection.close()
+
+    def _work(self, i):
+        connection = self.connections[i]
+        cursor = connection.cursor()
+        q = self.queues[i]
+        pending, last_txn = (0, None)
+        while True:
+            try:
+                task = q.get(timeout=self.commit_interval)
+                idle = False
+            except Empty:
+                # nothing new for a while, e.g. --stop-never on a quiet server: don't hold rows uncommitted
+                task = COMMIT
+                idle = True
+            try:
+                if task is STOP:
+                    break
+                if self.error is not None:
+                    continue
+                if task is COMMIT:
+                    if pending:
+                        connection.commit()
+                        pending = 0
+                    continue
+                txn, sql = task
+                if txn != last_txn and pending >= self.commit_every:
+                    connection.commit()
+                    pending = 0
+                last_txn = txn
+                cursor.execute(sql)
+                pending += 1
+            except Exception as e:
+                self.error = e
+                try:
+                    connection.rollback()
+                except Exception:
+                    pass
+            finally:
+                if not idle:
+                    q.task_done()
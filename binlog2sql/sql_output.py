@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import gzip
+import time
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESS_SUFFIX = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def open_compressed(f, compress=None):
+    """Wrap binary file f in a streaming gzip or zstd compressor. Closing the compressor ends the compressed
+    stream but not f, and streams appended to each other decompress as one."""
+    if compress == 'gzip':
+        return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6)
+    if compress == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compression needs the zstandard package')
+        return zstandard.ZstdCompressor().stream_writer(f, closefd=False)
+    raise ValueError('unknown compression: %s' % compress)
+
+
+class OutputSink(object):
+    """Buffer sql and write it to a stream in chunks of buffer_size, encoded once per chunk"""
+
+    def __init__(self, f=None, buffer_size=1024 * 1024):
+        self.f = f if f else sys.stdout
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, traceback):
+        self.close()
+
+    def write(self, data):
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.drain()
+        self.f.flush()
+
+    def drain(self):
+        """write out the buffer"""
+        if self._parts:
+            data = ''.join(self._parts)
+            self._parts = []
+            self._size = 0
+            self.write_out(data)
+
+    def write_out(self, data):
+        # a text stream with a binary buffer (python 3 stdout) is written to as bytes
+        f = getattr(self.f, 'buffer', None)
+        if f is not None:
+            self.f.flush()
+            f.write(data.encode('utf-8'))
+        else:
+            self.f.write(data)
+
+    def sync(self):
+        """flush, and return the output state to keep in a checkpoint: none, stdout can not be rewound"""
+        self.flush()
+        return None
+
+    def close(self):
+        self.flush()
+
+
+class FileSink(OutputSink):
+    """OutputSink writing to filename, optionally gzip or zstd compressed.
+
+    With rotate_bytes or rotate_seconds, output goes to filename.0000, filename.0001, ... and a new file is
+    started once the current one got rotate_bytes of sql or is rotate_seconds old. Files only end with a
+    whole line.
+
+    resume is a state returned by sync(): the output written after it is removed and writing goes on there.
+    ValueError if the output up to it is no longer there.
+    """
+
+    def __init__(self, filename, buffer_size=1024 * 1024, rotate_bytes=0, rotate_seconds=0, compress=None,
+                 resume=None):
+        super(FileSink, self).__init__(None, buffer_size=buffer_size)
+        if compress and compress not in COMPRESS_SUFFIX:
+            raise ValueError('unknown compression: %s' % compress)
+        self.filename = filename
+        self.rotate_bytes, self.rotate_seconds = (rotate_bytes, rotate_seconds)
+        self.compress = compress
+        self.files = []
+        self._written = 0
+        self._opened = 0
+        self._line_end = True
+        self.raw, self.f = (None, None)
+        if resume:
+            self._resume(resume['files'], resume['offset'])
+        else:
+            self._next_file()
+
+    def file_name(self, i):
+        filename = '%s.%04d' % (self.filename, i) if self.rotate_bytes or self.rotate_seconds else self.filename
+        if self.compress and not filename.endswith(COMPRESS_SUFFIX[self.compress]):
+            filename += COMPRESS_SUFFIX[self.compress]
+        return filename
+
+    def _open(self, filename, mode, truncate=None):
+        self.raw = open(filename, mode)
+        if truncate is not None:
+            self.raw.truncate(truncate)
+            self.raw.seek(0, os.SEEK_END)
+        self.f = open_compressed(self.raw, self.compress) if self.compress else self.raw
+        self._opened = time.time()
+
+    def _next_file(self):
+        filename = self.file_name(len(self.files))
+        self._open(filename, 'wb')
+        self.files.append(filename)
+        self._written = 0
+
+    def _resume(self, files, offset):
+        i = len(files)
+        while (self.rotate_bytes or self.rotate_seconds) and os.path.exists(self.file_name(i)):
+            # rotated after the checkpoint
+            os.remove(self.file_name(i))
+            i += 1
+        size = os.path.getsize(files[-1]) if os.path.exists(files[-1]) else None
+        if (size is None and offset) or (size is not None and size < offset):
+            # truncate would pad it with zeros where the output up to the checkpoint was
+            raise ValueError('%s is missing or shorter than the checkpoint offset %d, can not resume from it'
+                             % (files[-1], offset))
+        self.files = list(files)
+        self._open(files[-1], 'wb' if size is None else 'r+b', truncate=offset)
+        self._written = offset
+
+    def rotate_due(self):
+        return (self.rotate_bytes and self._written + self._size >= self.rotate_bytes) or \
+               (self.rotate_seconds and time.time() - self._opened >= self.rotate_seconds)
+
+    def rotate(self):
+        self._close()
+        self._next_file()
+
+    def write(self, data):
+        if (self.rotate_bytes or self.rotate_seconds) and data and self.rotate_due():
+            if self._line_end:
+                self.rotate()
+            else:
+                # the current file ends in the middle of a line: finish it first
+                i = data.find('\n')
+                if i >= 0:
+                    super(FileSink, self).write(data[:i + 1])
+                    self.rotate()
+                    data = data[i + 1:]
+            self._line_end = data.endswith('\n') if data else True
+        elif data:
+            self._line_end = data.endswith('\n')
+        if data:
+            super(FileSink, self).write(data)
+
+    def flush(self):
+        self.drain()
+        if not self.compress:
+            # flushing a compressor often costs compression ratio, its output is readable once closed
+            self.f.flush()
+
+    def sync(self):
+        """write everything to disk, ending the compressed stream, and return the state to resume from"""
+        self.drain()
+        if self.compress:
+            self.f.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        offset = self.raw.tell()
+        if self.compress:
+            self.f = open_compressed(self.raw, self.compress)
+        return {'files': list(self.files), 'offset': offset}
+
+    def write_out(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self.f.write(data)
+        self._written += len(data)
+
+    def _close(self):
+        self.drain()
+        if self.compress:
+            self.f.close()
+        self.raw.close()
+
+    def close(self):
+        if self.raw is not None:
+            self._close()
+            self.raw, self.f = (None, None)
+
+
+def open_sink(filename=None, buffer_size=1024 * 1024, rotate_bytes=0, rotate_seconds=0, compress=None, resume=None):
+    """FileSink for filename, or a buffered OutputSink of stdout"""
+    if filename:
+        return FileSink(filename, buffer_size=buffer_size, rotate_bytes=rotate_bytes,
+                        rotate_seconds=rotate_seconds, compress=compress, resume=resume)
+    return OutputSink(sys.stdout, buffer_size=buffer_size)
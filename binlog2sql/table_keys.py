@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+
+# unique indexes of a table with the nullability of their columns, primary key first
+KEY_SQL = ("SELECT s.INDEX_NAME, s.COLUMN_NAME, c.IS_NULLABLE FROM information_schema.STATISTICS s "
+           "JOIN information_schema.COLUMNS c ON c.TABLE_SCHEMA = s.TABLE_SCHEMA AND c.TABLE_NAME = s.TABLE_NAME "
+           "AND c.COLUMN_NAME = s.COLUMN_NAME "
+           "WHERE s.TABLE_SCHEMA = %s AND s.TABLE_NAME = %s AND s.NON_UNIQUE = 0 "
+           "ORDER BY s.INDEX_NAME != 'PRIMARY', s.INDEX_NAME, s.SEQ_IN_INDEX")
+
+
+def server_table_keys(cursor, schema, table):
+    """Columns identifying a row of the table: the primary key, else the shortest unique key of NOT NULL
+    columns (a unique key allows many rows with NULLs). [] if the table has neither"""
+    cursor.execute(KEY_SQL, (schema, table))
+    indexes = []
+    for (index_name, column, nullable) in cursor.fetchall():
+        if not indexes or indexes[-1][0] != index_name:
+            indexes.append((index_name, [], []))
+        indexes[-1][1].append(column)
+        indexes[-1][2].append(nullable)
+    candidates = [(index_name != 'PRIMARY', len(columns), columns) for (index_name, columns, nullable) in indexes
+                  if all(n == 'NO' for n in nullable)]
+    return min(candidates)[2] if candidates else []
+
+
+def snapshot_table_keys(schema_snapshot, schema, table):
+    """primary key columns of a table in a SchemaSnapshot, which does not keep unique keys"""
+    return [c['COLUMN_NAME'] for c in schema_snapshot._get_table_information(schema, table)
+            if c.get('COLUMN_KEY') == 'PRI']
+
+
+def table_fingerprint(binlog_event):
+    """digest of the columns (name and type) and primary key of the table of a rows event, as its table map
+    describes them"""
+    columns = [(column.name, column.type) for column in binlog_event.columns]
+    primary_key = getattr(binlog_event, 'primary_key', None)
+    if primary_key and not isinstance(primary_key, (tuple, list)):
+        primary_key = [primary_key]
+    data = json.dumps([columns, list(primary_key or [])])
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
+class TableKeyCache(object):
+    """Key columns of tables, looked up once per table with load(schema, table).
+
+    DDL on a table drops its entry, so it is looked up again. With a filename, the cache is loaded from it
+    and save() writes it back as json {"schema": {"table": {"key": ["column", ...], "fingerprint": "..."}}}.
+    Keys from the file are only trusted while the fingerprint of the table (see table_fingerprint) is the
+    same: the first get() of a table in a run compares them, and looks the key up again if the table changed.
+    """
+
+    def __init__(self, load, filename=None):
+        self.load = load
+        self.filename = filename
+        self.tables = {}
+        self.fingerprints = {}
+        # entries of the file not compared with their table yet: {(schema, table): (columns, fingerprint)}
+        self.saved = {}
+        self.dirty = False
+        if filename and os.path.exists(filename):
+            with open(filename) as f:
+                for (schema, tables) in json.load(f).items():
+                    for (table, entry) in tables.items():
+                        # a list is the key of a file written without fingerprints, never trusted
+                        if isinstance(entry, dict):
+                            self.saved[(schema, table)] = (tuple(entry['key']), entry.get('fingerprint'))
+
+    def get(self, schema, table, fingerprint=None):
+        """key columns of a table. fingerprint() gives the table's current fingerprint, checked against the
+        saved one"""
+        columns = self.tables.get((schema, table))
+        if columns is None:
+            current = fingerprint() if fingerprint else None
+            (columns, saved) = self.saved.pop((schema, table), (None, None))
+            if columns is None or saved is None or saved != current:
+                columns = tuple(self.load(schema, table))
+                self.dirty = True
+            self.tables[(schema, table)] = columns
+            self.fingerprints[(schema, table)] = current
+        return columns
+
+    def update(self, tables):
+        """take the entries of another cache's entries(), e.g. of a worker process; later ones win"""
+        for (key, (columns, fingerprint)) in tables.items():
+            self.saved.pop(key, None)
+            if self.tables.get(key) != columns or self.fingerprints.get(key) != fingerprint:
+                self.tables[key], self.fingerprints[key] = (columns, fingerprint)
+                self.dirty = True
+
+    def entries(self):
+        """{(schema, table): (columns, fingerprint)} of the tables looked up in this run"""
+        return dict((key, (columns, self.fingerprints.get(key))) for (key, columns) in self.tables.items())
+
+    def invalidate(self, schema=None, table=None):
+        """drop keys of a table, of a whole schema if table is None, or everything if schema is None"""
+        for cache in (self.tables, self.saved):
+            for key in list(cache.keys()):
+                if schema is None or (key[0] == schema and (table is None or key[1] == table)):
+                    del cache[key]
+                    self.fingerprints.pop(key, None)
+                    self.dirty = True
+
+    def save(self):
+        if not (self.filename and self.dirty):
+            return
+        tables = {}
+        # tables not seen in this run are kept as they were
+        entries = dict(self.saved)
+        entries.update(self.entries())
+        for ((schema, table), (columns, fingerprint)) in entries.items():
+            tables.setdefault(schema, {})[table] = {'key': list(columns), 'fingerprint': fingerprint}
+        # write then rename, so a crash never leaves half a file
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump(tables, f, indent=1, sort_keys=True)
+        os.rename(self.filename + '.tmp', self.filename)
+        self.dirty = False
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import zlib
+import struct
+import shutil
+import tempfile
+import unittest
+import mock
+from io import StringIO
+
+sys.path.append("..")
+from binlog2sql.binlog2sql import Binlog2sql
+
+SCHEMAS = {'test': {'tbl': [
+    {'COLUMN_NAME': 'id', 'COLLATION_NAME': None, 'CHARACTER_SET_NAME': None, 'COLUMN_COMMENT': '',
+     'COLUMN_TYPE': 'int(11)', 'COLUMN_KEY': 'PRI'},
+    {'COLUMN_NAME': 'data', 'COLLATION_NAME': 'utf8_general_ci', 'CHARACTER_SET_NAME': 'utf8',
+     'COLUMN_COMMENT': '', 'COLUMN_TYPE': 'varchar(255)', 'COLUMN_KEY': ''},
+]}}
+TIMESTAMP = 1481299200
+
+
+class BinlogWriter(object):
+    """build a binlog file with CRC32 checksum: BEGIN, TABLE_MAP + row events of test.tbl, COMMIT"""
+
+    def __init__(self, timestamp=TIMESTAMP):
+        self.data = b'\xfebin'
+        self.timestamp = timestamp
+
+    def event(self, event_type, body):
+        event_size = 19 + len(body) + 4
+        header = struct.pack('<IBIIIH', self.timestamp, event_type, 1, event_size, len(self.data) + event_size, 0)
+        event = header + body
+        self.data += event + struct.pack('<I', zlib.crc32(event) & 0xffffffff)
+
+    def format_description(self):
+        body = struct.pack('<H', 4) + b'5.7.20-log'.ljust(50, b'\0') + struct.pack('<IB', TIMESTAMP, 19)
+        self.event(15, body + b'\0' * 38 + b'\x01')
+
+    def query(self, query, schema=b'test'):
+        body = struct.pack('<IIBHH', 1, 0, len(schema), 0, 0) + schema + b'\0' + query
+        self.event(2, body)
+
+    def write_rows(self, rows):
+        self.rows_event(23, [self.image(row) for row in rows])
+
+    def update_rows(self, rows):
+        self.rows_event(24, [self.image(before) + self.image(after) for (before, after) in rows], b'\x03')
+
+    def delete_rows(self, rows):
+        self.rows_event(25, [self.image(row) for row in rows])
+
+    def rows_event(self, event_type, images, update_columns=b''):
+        table_id = struct.pack('<Q', 70)[:6]
+        table_map = table_id + struct.pack('<H', 1) + b'\x04test\0' + b'\x03tbl\0' + b'\x02' + b'\x03\x0f' \
+            + b'\x02' + struct.pack('<H', 255) + b'\x00'
+        self.event(19, table_map)
+        self.event(event_type, table_id + struct.pack('<H', 1) + b'\x02' + b'\x03' + update_columns + b''.join(images))
+
+    @staticmethod
+    def image(row):
+        (i, data) = row
+        return b'\x00' + struct.pack('<i', i) + struct.pack('<B', len(data)) + data
+
+    def xid(self, xid):
+        self.event(16, struct.pack('<Q', xid))
+
+    def rotate(self, next_binlog):
+        self.event(4, struct.pack('<Q', 4) + next_binlog)
+
+
+class BinlogDirTestCase(unittest.TestCase):
+    """a binlog directory holding mysql-bin.000001 (one transaction inserting two rows) and its schema file"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        writer = BinlogWriter()
+        writer.format_description()
+        writer.query(b'BEGIN')
+        writer.write_rows([(1, b'hello'), (2, b'binlog2sql')])
+        writer.xid(10)
+        self.size = len(writer.data)
+        self.write_binlog('mysql-bin.000001', writer.data)
+        self.schema_file = os.path.join(self.dir, 'schema.json')
+        with open(self.schema_file, 'w') as f:
+            json.dump(SCHEMAS, f)
+
+    def write_binlog(self, name, data):
+        with open(os.path.join(self.dir, name), 'wb') as f:
+            f.write(data)
+
+    def write_binlogs(self, count):
+        """replace the fixture with count binlog files, each holding one transaction of two rows"""
+        for n in range(1, count + 1):
+            writer = BinlogWriter(TIMESTAMP + n * 3600)
+            writer.format_description()
+            writer.query(b'BEGIN')
+            writer.write_rows([(n * 10 + 1, b'a%d' % n), (n * 10 + 2, b'b%d' % n)])
+            writer.xid(n)
+            if n < count:
+                writer.rotate(b'mysql-bin.%06d' % (n + 1))
+            self.write_binlog('mysql-bin.%06d' % n, writer.data)
+
+    def run_binlog2sql(self, **kwargs):
+        kwargs.setdefault('sql_type', ['INSERT', 'UPDATE', 'DELETE'])
+        self.binlog2sql = binlog2sql = Binlog2sql(
+            connection_settings={'host': 'localhost', 'port': 3306, 'charset': 'utf8'}, start_file='mysql-bin.000001',
+            binlog_dir=self.dir, schema_file=self.schema_file, **kwargs)
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            binlog2sql.process_binlog()
+        return stdout.getvalue().splitlines()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
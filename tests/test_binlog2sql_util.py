@@ -1,12 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import io
+import os
 import sys
+import tempfile
 import unittest
 import mock
 
 sys.path.append("..")
 from binlog2sql.binlog2sql_util import *
+from binlog_fixtures import BinlogDirTestCase
 
 
 class TestBinlog2sqlUtil(unittest.TestCase):
@@ -41,10 +45,20 @@ class TestBinlog2sqlUtil(unittest.TestCase):
             command_line_args(['--start-file', 'mysql-bin.000058', '--flashback', '--stop-never'])
         except Exception as e:
             self.assertEqual(str(e), "Only one of flashback or stop-never can be True")
+        try:
+            command_line_args(['--start-file', 'mysql-bin.000058', '--flashback', '--columns', 'id'])
+        except Exception as e:
+            self.assertEqual(str(e), "Only one of flashback or columns can be set")
         try:
             command_line_args(['--start-file', 'mysql-bin.000058', '--start-datetime', '2016-12-12'])
         except Exception as e:
             self.assertEqual(str(e), "Incorrect datetime argument")
+        try:
+            command_line_args(['--start-file', 'mysql-bin.000058', '--output-format', 'columnar'])
+        except Exception as e:
+            self.assertTrue(str(e).startswith("output-format columnar needs output-file"))
+        args = command_line_args(['--start-file', 'mysql-bin.000058', '-p', 'pwd', '--metrics-port', '9104'])
+        self.assertEqual((args.metrics_port, args.metrics_bind), (9104, '127.0.0.1'))
 
     def test_compare_items(self):
         self.assertEqual(compare_items(('data', '12345')), '`data`=%s')
@@ -54,6 +68,14 @@ class TestBinlog2sqlUtil(unittest.TestCase):
         self.assertEqual(fix_object('ascii'), 'ascii')
         self.assertEqual(fix_object(u'unicode'), u'unicode'.encode('utf-8'))
 
+    def test_bytes_literal(self):
+        self.assertEqual(bytes_literal(b"it's"), "'it\\'s'")
+        self.assertEqual(bytes_literal(b''), "''")
+        self.assertEqual(bytes_literal(b'\xff\x00'), '0xff00')
+        self.assertEqual(bytes_literal(b'abc', hex_bytes=3), '0x616263')
+        connection = OfflineConnection()
+        self.assertEqual(connection.mogrify('%s, %s', [b'\xe4\xb8\xad', b'\xe4\xb8']), u"'\u4e2d', 0xe4b8")
+
     def test_generate_sql_pattern(self):
         row = {'values': {'data': 'hello', 'id': 1}}
         mock_write_event = mock.create_autospec(WriteRowsEvent)
@@ -93,6 +115,179 @@ class TestBinlog2sqlUtil(unittest.TestCase):
                                    'template': 'UPDATE `test`.`tbl` SET `data`=%s, `id`=%s WHERE `data`=%s AND'
                                                ' `id`=%s LIMIT 1;'})
 
+    def test_generate_sql_pattern_key_columns(self):
+        mock_delete_event = mock.create_autospec(DeleteRowsEvent)
+        mock_delete_event.schema = 'test'
+        mock_delete_event.table = 'tbl_key'
+        row = {'values': {'data': 'hello', 'id': 1}}
+        pattern = generate_sql_pattern(binlog_event=mock_delete_event, row=row, key_columns=('id',))
+        self.assertEqual(pattern, {'values': [1], 'template': 'DELETE FROM `test`.`tbl_key` WHERE `id`=%s LIMIT 1;'})
+        # INSERT has no WHERE clause
+        pattern = generate_sql_pattern(binlog_event=mock_delete_event, row=row, flashback=True, key_columns=('id',))
+        self.assertEqual(pattern['values'], ['hello', 1])
+        # a row image without the key, as with binlog_row_image=MINIMAL, matches every column it has
+        pattern = generate_sql_pattern(binlog_event=mock_delete_event, row={'values': {'data': 'hello'}},
+                                       key_columns=('id',))
+        self.assertEqual(pattern, {'values': ['hello'],
+                                   'template': 'DELETE FROM `test`.`tbl_key` WHERE `data`=%s LIMIT 1;'})
+
+        mock_update_event = mock.create_autospec(UpdateRowsEvent)
+        mock_update_event.schema = 'test'
+        mock_update_event.table = 'tbl_key'
+        row = {'before_values': {'data': 'hello', 'id': 1, 'k': 2},
+               'after_values': {'data': 'binlog2sql', 'id': 1, 'k': 3}}
+        pattern = generate_sql_pattern(binlog_event=mock_update_event, row=row, key_columns=('id', 'k'))
+        self.assertEqual(pattern, {'values': ['binlog2sql', 1, 3, 1, 2],
+                                   'template': 'UPDATE `test`.`tbl_key` SET `data`=%s, `id`=%s, `k`=%s '
+                                               'WHERE `id`=%s AND `k`=%s LIMIT 1;'})
+        pattern = generate_sql_pattern(binlog_event=mock_update_event, row=row, flashback=True, key_columns=('id', 'k'))
+        self.assertEqual(pattern['values'], ['hello', 1, 2, 1, 3])
+
+    def test_sql_pattern_cache(self):
+        cache = SqlPatternCache(max_size=2)
+        cache.put(('test', 'tbl', 1), 'a')
+        cache.put(('test', 'tbl2', 1), 'b')
+        self.assertEqual(cache.get(('test', 'tbl', 1)), 'a')
+        cache.put(('test2', 'tbl', 1), 'c')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(('test', 'tbl2', 1)))
+        cache.invalidate('test', 'tbl')
+        self.assertIsNone(cache.get(('test', 'tbl', 1)))
+        self.assertEqual(cache.get(('test2', 'tbl', 1)), 'c')
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+    def test_generate_sql_pattern_null_mask(self):
+        mock_delete_event = mock.create_autospec(DeleteRowsEvent)
+        mock_delete_event.schema = 'test'
+        mock_delete_event.table = 'tbl_null'
+        pattern = generate_sql_pattern(binlog_event=mock_delete_event, row={'values': {'data': None, 'id': 1}})
+        self.assertEqual(pattern, {'values': [None, 1],
+                                   'template': 'DELETE FROM `test`.`tbl_null` WHERE `data` IS %s AND `id`=%s LIMIT 1;'})
+        pattern = generate_sql_pattern(binlog_event=mock_delete_event, row={'values': {'data': 'hi', 'id': 2}})
+        self.assertEqual(pattern, {'values': ['hi', 2],
+                                   'template': 'DELETE FROM `test`.`tbl_null` WHERE `data`=%s AND `id`=%s LIMIT 1;'})
+
+        # flashback of an UPDATE matches the after image
+        mock_update_event = mock.create_autospec(UpdateRowsEvent)
+        mock_update_event.schema = 'test'
+        mock_update_event.table = 'tbl_null'
+        for (data, where) in ((None, '`data` IS %s'), ('hi', '`data`=%s')):
+            pattern = generate_sql_pattern(binlog_event=mock_update_event, flashback=True,
+                                           row={'before_values': {'data': 'a'}, 'after_values': {'data': data}})
+            self.assertEqual(pattern['template'], 'UPDATE `test`.`tbl_null` SET `data`=%s WHERE ' + where + ' LIMIT 1;')
+
+    def test_parse_ddl_table(self):
+        self.assertEqual(parse_ddl_table('ALTER TABLE `tbl` ADD COLUMN c INT', 'test'), ('test', 'tbl'))
+        self.assertEqual(parse_ddl_table('drop table if exists db.tbl', 'test'), ('db', 'tbl'))
+        self.assertEqual(parse_ddl_table('CREATE DATABASE db', 'test'), ('test', None))
+        self.assertIsNone(parse_ddl_table('BEGIN', 'test'))
+
+    def test_generate_batch_pattern(self):
+        mock_write_event = mock.create_autospec(WriteRowsEvent)
+        mock_write_event.schema = 'test'
+        mock_write_event.table = 'tbl'
+        mock_write_event.primary_key = 'id'
+        row = {'values': {'data': 'hello', 'id': 1}}
+        pattern = generate_batch_pattern(binlog_event=mock_write_event, row=row, flashback=False)
+        self.assertEqual(pattern, {'head': 'INSERT INTO `test`.`tbl`(`data`, `id`) VALUES ', 'item': '(%s, %s)',
+                                   'tail': '', 'values': ['hello', 1]})
+        pattern = generate_batch_pattern(binlog_event=mock_write_event, row=row, flashback=True)
+        self.assertEqual(pattern, {'head': 'DELETE FROM `test`.`tbl` WHERE `id` IN (', 'item': '%s', 'tail': ')',
+                                   'values': [1]})
+        mock_write_event.primary_key = ('data', 'id')
+        pattern = generate_batch_pattern(binlog_event=mock_write_event, row=row, flashback=True)
+        self.assertEqual(pattern['head'], 'DELETE FROM `test`.`tbl` WHERE (`data`, `id`) IN (')
+        self.assertEqual(pattern['item'], '(%s, %s)')
+        mock_write_event.primary_key = ''
+        self.assertIsNone(generate_batch_pattern(binlog_event=mock_write_event, row=row, flashback=True))
+
+        mock_update_event = mock.create_autospec(UpdateRowsEvent)
+        mock_update_event.schema = 'test'
+        mock_update_event.table = 'tbl'
+        row = {'before_values': {'data': 'hello', 'id': 1}, 'after_values': {'data': 'binlog2sql', 'id': 1}}
+        self.assertIsNone(generate_batch_pattern(binlog_event=mock_update_event, row=row))
+
+    def test_row_key(self):
+        mock_write_event = mock.create_autospec(WriteRowsEvent)
+        mock_write_event.schema = 'test'
+        mock_write_event.table = 'tbl'
+        mock_write_event.primary_key = 'id'
+        key = row_key(mock_write_event, {'values': {'data': 'hello', 'id': 1}})
+        self.assertEqual(key, row_key(mock_write_event, {'values': {'data': 'other', 'id': 1}}))
+        self.assertNotEqual(key, row_key(mock_write_event, {'values': {'data': 'hello', 'id': 2}}))
+        mock_write_event.primary_key = ''
+        self.assertEqual(row_key(mock_write_event, {'values': {'data': 'hello', 'id': 1}}),
+                         row_key(mock_write_event, {'values': {'data': 'other', 'id': 2}}))
+
+        mock_update_event = mock.create_autospec(UpdateRowsEvent)
+        mock_update_event.schema = 'test'
+        mock_update_event.table = 'tbl'
+        mock_update_event.primary_key = 'id'
+        row = {'before_values': {'data': 'hello', 'id': 1}, 'after_values': {'data': 'binlog2sql', 'id': 1}}
+        self.assertEqual(row_key(mock_update_event, row), key)
+        row['after_values']['id'] = 2
+        self.assertEqual(row_key(mock_update_event, row), '')
+
+    def test_sql_batcher(self):
+        f_out = mock.Mock()
+        batcher = SqlBatcher(f_out, max_rows=2, reverse=True)
+        head = 'INSERT INTO `test`.`tbl`(`id`) VALUES '
+        batcher.add(head, '', '(1)', 4, 100, 't')
+        batcher.add(head, '', '(2)', 4, 120, 't')
+        batcher.add(head, '', '(3)', 4, 140, 't')
+        batcher.add('DELETE FROM `test`.`tbl` WHERE `id` IN (', ')', '4', 4, 160, 't')
+        batcher.flush()
+        self.assertEqual([c[0][0] for c in f_out.write.call_args_list], [
+            'INSERT INTO `test`.`tbl`(`id`) VALUES (2), (1); #start 4 end 120 time t\n',
+            'INSERT INTO `test`.`tbl`(`id`) VALUES (3); #start 4 end 140 time t\n',
+            'DELETE FROM `test`.`tbl` WHERE `id` IN (4); #start 4 end 160 time t\n',
+        ])
+
+    def test_sql_batcher_max_bytes(self):
+        f_out = mock.Mock()
+        head = 'INSERT INTO `test`.`tbl`(`id`) VALUES '
+        # the head counts too: two rows make a statement of 46 bytes, a third would take it past 48
+        batcher = SqlBatcher(f_out, max_rows=100, max_bytes=48)
+        for i in (1, 2, 3):
+            batcher.add(head, '', '(%d)' % i, 4, 100, 't')
+        batcher.flush()
+        self.assertEqual([c[0][0] for c in f_out.write.call_args_list], [
+            'INSERT INTO `test`.`tbl`(`id`) VALUES (1), (2); #start 4 end 100 time t\n',
+            'INSERT INTO `test`.`tbl`(`id`) VALUES (3); #start 4 end 100 time t\n',
+        ])
+
+    def test_reversed_lines(self):
+        for data in [u'a\nbb\n中文\n', u'a\nbb\n中文', u'\n\nx\n', u'']:
+            f = io.BytesIO(data.encode('utf-8'))
+            self.assertEqual(list(reversed_lines(f, block_size=3)), data.splitlines(True)[::-1])
+
+    def test_segmented_temp_file(self):
+        lines = [u'INSERT INTO `test`.`tbl` VALUES (%d, \'中文\');\n' % i for i in range(100)]
+        for compress in (False, True):
+            prefix = os.path.join(tempfile.mkdtemp(), 'tmp')
+            with SegmentedTempFile(prefix, segment_size=200, compress=compress) as f_tmp:
+                for line in lines:
+                    f_tmp.write(line)
+                f_tmp.close()
+                self.assertTrue(len(f_tmp.segments) > 1)
+                self.assertEqual(list(reversed_segment_lines(f_tmp.segments)), lines[::-1])
+            self.assertFalse(os.path.exists(f_tmp.segments[0]))
+            os.rmdir(os.path.dirname(prefix))
+
+
+class TestBinlog2sqlBatchRows(BinlogDirTestCase):
+
+    def test_binlog2sql_batch_rows(self):
+        self.write_binlogs(2)
+        lines = self.run_binlog2sql(end_file='mysql-bin.000002', batch_rows=10)
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("INSERT INTO `test`.`tbl`(`id`, `data`) VALUES (11, 'a1'), (12, 'b1');"))
+        self.assertTrue(lines[1].startswith("INSERT INTO `test`.`tbl`(`id`, `data`) VALUES (21, 'a2'), (22, 'b2');"))
+        lines = self.run_binlog2sql(end_file='mysql-bin.000002', batch_rows=10, flashback=True)
+        self.assertEqual([line.split(';')[0] for line in lines], ['DELETE FROM `test`.`tbl` WHERE `id` IN (22, 21)',
+                                                                  'DELETE FROM `test`.`tbl` WHERE `id` IN (12, 11)'])
+
 
 if __name__ == '__main__':
     unittest.main()
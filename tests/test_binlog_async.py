@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import glob
+import unittest
+
+sys.path.append("..")
+from binlog2sql.binlog2sql import Binlog2sql
+from binlog_fixtures import BinlogDirTestCase
+try:
+    import asyncio
+    from binlog2sql.binlog_async import aiter_statements
+except (ImportError, SyntaxError):
+    asyncio = None
+
+
+@unittest.skipIf(asyncio is None, 'asyncio is not available')
+class TestBinlogAsync(BinlogDirTestCase):
+
+    def settings(self, **kwargs):
+        return dict(connection_settings={'host': 'localhost', 'port': 3306, 'charset': 'utf8'},
+                    start_file='mysql-bin.000001', end_file='mysql-bin.000002', binlog_dir=self.dir,
+                    schema_file=self.schema_file, sql_type=['INSERT', 'UPDATE', 'DELETE'], **kwargs)
+
+    def consume(self, binlog2sql, chunk_size=None, limit=None):
+        """sql of the first limit statements of aiter_statements, driven without async syntax"""
+        loop = asyncio.new_event_loop()
+        statements = aiter_statements(binlog2sql, chunk_size=chunk_size)
+        sqls = []
+        try:
+            while limit is None or len(sqls) < limit:
+                try:
+                    sqls.append(loop.run_until_complete(statements.__anext__()).sql)
+                except StopAsyncIteration:
+                    break
+            loop.run_until_complete(statements.aclose())
+        finally:
+            loop.close()
+        return sqls
+
+    def test_aiter_statements(self):
+        self.write_binlogs(2)
+        expected = [s.sql for s in Binlog2sql(**self.settings()).iter_statements()]
+        self.assertEqual(len(expected), 4)
+        for chunk_size in (None, 1, 4):
+            self.assertEqual(self.consume(Binlog2sql(**self.settings()), chunk_size=chunk_size), expected)
+
+    def test_aiter_statements_stop_early(self):
+        # the temp file of flashback statements goes away with a consumer stopping early
+        self.write_binlogs(2)
+        self.assertEqual(len(self.consume(Binlog2sql(**self.settings(flashback=True)), chunk_size=1, limit=1)), 1)
+        self.assertEqual(glob.glob('localhost.3306*'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import gzip
+import json
+import unittest
+
+sys.path.append("..")
+from binlog_fixtures import BinlogDirTestCase
+
+
+class TestBinlog2sqlCheckpoint(BinlogDirTestCase):
+
+    def test_binlog2sql_checkpoint(self):
+        self.write_binlogs(3)
+        expected = self.run_binlog2sql(end_file='mysql-bin.000003')
+        checkpoint_file = os.path.join(self.dir, 'checkpoint.json')
+        output_file = os.path.join(self.dir, 'out.sql')
+        kwargs = dict(checkpoint_file=checkpoint_file, output_file=output_file, output_compress='gzip')
+        self.run_binlog2sql(end_file='mysql-bin.000001', **kwargs)
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        self.assertEqual((checkpoint['log_file'], checkpoint['gtid']), ('mysql-bin.000001', None))
+        self.assertEqual(checkpoint['output']['files'], [output_file + '.gz'])
+
+        # a crash after more sql was written than the checkpoint covers
+        with open(output_file + '.gz', 'ab') as f:
+            f.write(b'partial')
+        self.run_binlog2sql(end_file='mysql-bin.000003', resume=True, **kwargs)
+        with gzip.open(output_file + '.gz', 'rb') as f:
+            self.assertEqual(f.read().decode('utf-8').splitlines(), expected)
+        with open(checkpoint_file) as f:
+            self.assertEqual(json.load(f)['log_file'], 'mysql-bin.000003')
+
+        for option in ({'flashback': True}, {'jobs': 2}):
+            self.assertRaises(ValueError, self.run_binlog2sql, end_file='mysql-bin.000003', **dict(kwargs, **option))
+
+
+if __name__ == '__main__':
+    unittest.main()
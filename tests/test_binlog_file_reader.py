@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import datetime
+import unittest
+import mock
+from io import StringIO
+
+sys.path.append("..")
+from binlog2sql.binlog2sql import Binlog2sql
+from binlog2sql.binlog_file_reader import BinLogFileReader, SchemaSnapshot, parse_server_version
+from pymysqlreplication.event import QueryEvent, XidEvent, FormatDescriptionEvent
+from pymysqlreplication.row_event import WriteRowsEvent, TableMapEvent
+from pymysql.connections import MysqlPacket
+from binlog_fixtures import SCHEMAS, TIMESTAMP, BinlogWriter, BinlogDirTestCase
+
+
+class TestBinlogFileReader(BinlogDirTestCase):
+
+    def test_parse_server_version(self):
+        self.assertEqual(parse_server_version('5.7.20-log'), (5, 7, 20))
+        self.assertTrue(parse_server_version('10.1.9-MariaDB') > (5, 6, 1))
+
+    def test_read_events(self):
+        stream = BinLogFileReader(['mysql-bin.000001'], SchemaSnapshot.load(self.schema_file), log_dir=self.dir)
+        events = list(stream)
+        self.assertEqual([e.__class__ for e in events],
+                         [FormatDescriptionEvent, QueryEvent, TableMapEvent, WriteRowsEvent, XidEvent])
+        self.assertTrue(stream.use_checksum)
+        self.assertEqual(events[1].query, 'BEGIN')
+        self.assertEqual(events[3].schema, 'test')
+        self.assertEqual(events[3].primary_key, 'id')
+        self.assertEqual([row['values'] for row in events[3].rows],
+                         [{'id': 1, 'data': 'hello'}, {'id': 2, 'data': 'binlog2sql'}])
+        self.assertEqual(events[4].packet.log_pos, self.size)
+        self.assertEqual(stream.log_pos, self.size)
+
+    def test_only_tables(self):
+        stream = BinLogFileReader(['mysql-bin.000001'], SchemaSnapshot.load(self.schema_file), log_dir=self.dir,
+                                  only_tables=['other'])
+        self.assertEqual([e.__class__ for e in stream], [FormatDescriptionEvent, QueryEvent, XidEvent])
+
+    def test_skip_rows_events(self):
+        # rows events of a filtered table or type are never made into packets
+        for kwargs in ({'only_tables': ['other']}, {'only_events': [QueryEvent, XidEvent]}):
+            stream = BinLogFileReader(['mysql-bin.000001'], SchemaSnapshot.load(self.schema_file), log_dir=self.dir,
+                                      **kwargs)
+            with mock.patch('binlog2sql.binlog_file_reader.MysqlPacket', wraps=MysqlPacket) as packet:
+                list(stream)
+            self.assertEqual(packet.call_count, 4)
+            self.assertEqual(stream.log_pos, self.size)
+
+    def test_binlog2sql_offline(self):
+        binlog2sql = Binlog2sql(connection_settings={'host': 'localhost', 'port': 3306, 'charset': 'utf8'},
+                                start_file='mysql-bin.000001', binlog_dir=self.dir, schema_file=self.schema_file,
+                                sql_type=['INSERT', 'UPDATE', 'DELETE'])
+        self.assertEqual(binlog2sql.binlogList, ['mysql-bin.000001'])
+        self.assertEqual(binlog2sql.eof_pos, self.size)
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            binlog2sql.process_binlog()
+        position = ' #start 4 end %s time %s' % (self.size - 31, datetime.datetime.fromtimestamp(TIMESTAMP))
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            "INSERT INTO `test`.`tbl`(`id`, `data`) VALUES (1, 'hello');" + position,
+            "INSERT INTO `test`.`tbl`(`id`, `data`) VALUES (2, 'binlog2sql');" + position,
+        ])
+
+    def test_binlog2sql_binary_values(self):
+        # a varbinary column: values are decoded as bytes
+        schemas = json.loads(json.dumps(SCHEMAS))
+        schemas['test']['tbl'][1].update({'COLLATION_NAME': None, 'CHARACTER_SET_NAME': None,
+                                          'COLUMN_TYPE': 'varbinary(255)'})
+        with open(self.schema_file, 'w') as f:
+            json.dump(schemas, f)
+        writer = BinlogWriter()
+        writer.format_description()
+        writer.query(b'BEGIN')
+        writer.write_rows([(1, b'\xff\x00\'x'), (2, b'text\'s')])
+        writer.xid(10)
+        self.write_binlog('mysql-bin.000001', writer.data)
+        for kwargs in ({}, {'render_processes': 1}):
+            lines = [line.split(' #')[0] for line in self.run_binlog2sql(**kwargs)]
+            self.assertEqual(lines, ["INSERT INTO `test`.`tbl`(`id`, `data`) VALUES (1, 0xff002778);",
+                                     "INSERT INTO `test`.`tbl`(`id`, `data`) VALUES (2, 'text\\'s');"])
+        lines = [line.split(' #')[0] for line in self.run_binlog2sql(hex_bytes=0, flashback=True)]
+        self.assertEqual(lines, ["DELETE FROM `test`.`tbl` WHERE `id`=2 AND `data`=0x746578742773 LIMIT 1;",
+                                 "DELETE FROM `test`.`tbl` WHERE `id`=1 AND `data`=0xff002778 LIMIT 1;"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import datetime
+import unittest
+from io import StringIO
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+sys.path.append("..")
+from binlog2sql.binlog_metrics import BinlogMetrics, MeteredOutput, MetricsReporter, format_seconds
+from pymysqlreplication.row_event import WriteRowsEvent
+from binlog_fixtures import TIMESTAMP, BinlogDirTestCase
+
+
+class FakeStream(object):
+    """two binlogs of 1000 bytes, a row event every 100 bytes"""
+
+    def __init__(self):
+        self.log_file, self.log_pos = ('mysql-bin.000001', 4)
+
+    def __iter__(self):
+        for log_file in ('mysql-bin.000001', 'mysql-bin.000002'):
+            self.log_file = log_file
+            for log_pos in range(100, 1001, 100):
+                self.log_pos = log_pos
+                yield row_event(['a', "b\"'"])
+
+
+def row_event(rows):
+    event = WriteRowsEvent.__new__(WriteRowsEvent)
+    event.schema, event.table, event.timestamp = ('test', 'tbl', time.time() - 60)
+    event._RowsEvent__rows = [{'values': {'data': row}} for row in rows]
+    return event
+
+
+class TestBinlogMetrics(unittest.TestCase):
+
+    def dump(self, metrics, stop_at=None):
+        f_out = MeteredOutput(StringIO(), metrics)
+        stream = FakeStream()
+        for event in metrics.timed_events(stream):
+            for row in metrics.decode(event):
+                f_out.write(u'%s\n' % row['values']['data'])
+            metrics.rendered()
+            if (stream.log_file, stream.log_pos) == stop_at:
+                break
+        return f_out
+
+    def test_counters(self):
+        metrics = BinlogMetrics([('mysql-bin.000001', 1000), ('mysql-bin.000002', 1000)], start_pos=4)
+        f_out = self.dump(metrics, stop_at=('mysql-bin.000002', 500))
+        s = metrics.snapshot()
+        self.assertEqual(s['events'], {'WriteRowsEvent': 15})
+        self.assertEqual(s['rows'], {'test.tbl': {'INSERT': 30}})
+        self.assertEqual(s['output_bytes'], len(f_out.f_out.getvalue()))
+        self.assertEqual((s['log_file'], s['log_pos']), ('mysql-bin.000002', 500))
+        self.assertEqual((s['processed_bytes'], s['total_bytes'], s['lag_bytes']), (1496, 1996, 500))
+        self.assertAlmostEqual(s['progress'], 1496 / 1996.0)
+        self.assertTrue(s['eta_seconds'] >= 0)
+        self.assertTrue(59 < s['seconds_behind'] < 70)
+        self.assertTrue(all(seconds >= 0 for seconds in s['stage_seconds'].values()))
+        self.assertTrue('mysql-bin.000002:500 74.9% 30 rows' in metrics.progress_line())
+
+    def test_unknown_range(self):
+        metrics = BinlogMetrics([])
+        self.dump(metrics)
+        s = metrics.snapshot()
+        self.assertEqual((s['total_bytes'], s['progress'], s['lag_bytes'], s['eta_seconds']), (None, None, None, None))
+        self.assertTrue(' eta ' not in metrics.progress_line())
+        metrics = BinlogMetrics([('mysql-bin.000001', None), ('mysql-bin.000002', 1000)])
+        self.dump(metrics)
+        self.assertEqual(metrics.snapshot()['progress'], None)
+
+    def test_skip(self):
+        metrics = BinlogMetrics([])
+        for _ in metrics.timed_events(FakeStream()):
+            metrics.skip()
+        self.assertEqual(metrics.skipped_events, 20)
+        self.assertAlmostEqual(metrics.skip_seconds, metrics.stage_seconds['fetch'])
+
+    def test_prometheus(self):
+        metrics = BinlogMetrics([('mysql-bin.000001', 1000), ('mysql-bin.000002', 1000)])
+        self.dump(metrics)
+        metrics.rows[('UPDATE', 'test.a"b')] = 1
+        text = metrics.prometheus()
+        self.assertTrue('# TYPE binlog2sql_rows_total counter\n' in text)
+        self.assertTrue('binlog2sql_rows_total{table="test.tbl",type="INSERT"} 40\n' in text)
+        self.assertTrue('binlog2sql_rows_total{table="test.a\\"b",type="UPDATE"} 1\n' in text)
+        self.assertTrue('binlog2sql_events_total{type="WriteRowsEvent"} 20\n' in text)
+        self.assertTrue('binlog2sql_position{file="mysql-bin.000002"} 1000\n' in text)
+        self.assertTrue('binlog2sql_lag_bytes 0\n' in text)
+
+    def test_reporter(self):
+        metrics = BinlogMetrics([('mysql-bin.000001', 1000), ('mysql-bin.000002', 1000)])
+        f_err = StringIO()
+        reporter = MetricsReporter(metrics, interval=60, progress=True, port=0, f_err=f_err)
+        try:
+            self.dump(metrics)
+            # only the local host, unless told to listen on more
+            self.assertEqual(reporter.server.server_address[0], '127.0.0.1')
+            body = urlopen('http://127.0.0.1:%d/metrics' % reporter.port).read().decode('utf-8')
+            self.assertTrue('binlog2sql_rows_total{table="test.tbl",type="INSERT"} 40\n' in body)
+        finally:
+            reporter.stop()
+        # stop reports once more
+        self.assertEqual(len(f_err.getvalue().splitlines()), 1)
+        self.assertTrue('100.0%' in f_err.getvalue())
+
+    def test_format_seconds(self):
+        self.assertEqual(format_seconds(3725.5), '1:02:05')
+        self.assertEqual(format_seconds(59), '0:00:59')
+
+
+class TestBinlog2sqlMetrics(BinlogDirTestCase):
+
+    def test_binlog2sql_metrics(self):
+        self.write_binlogs(3)
+        stats_file = os.path.join(self.dir, 'stats.json')
+        for pipeline in (False, True):
+            lines = self.run_binlog2sql(end_file='mysql-bin.000003', stats_file=stats_file, pipeline=pipeline)
+            with open(stats_file) as f:
+                stats = json.load(f)
+            self.assertEqual(stats['rows'], {'test.tbl': {'INSERT': 6}})
+            self.assertEqual(stats['events']['WriteRowsEvent'], 3)
+            self.assertEqual(stats['output_bytes'], sum(len(line) + 1 for line in lines))
+            self.assertEqual((stats['log_file'], stats['progress'], stats['lag_bytes']), ('mysql-bin.000003', 1, 0))
+            self.assertEqual(stats['total_bytes'], sum(os.path.getsize(os.path.join(self.dir, 'mysql-bin.%06d' % n))
+                                                       for n in (1, 2, 3)) - 4)
+            self.assertEqual(sorted(stats['stage_seconds']), ['decode', 'fetch', 'render', 'write'])
+
+        # events before start_time are skipped
+        start_time = datetime.datetime.fromtimestamp(TIMESTAMP + 3 * 3600).strftime('%Y-%m-%d %H:%M:%S')
+        self.run_binlog2sql(end_file='mysql-bin.000003', stats_file=stats_file, start_time=start_time)
+        with open(stats_file) as f:
+            stats = json.load(f)
+        self.assertEqual(stats['rows'], {'test.tbl': {'INSERT': 2}})
+        self.assertTrue(stats['skipped_events'] > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
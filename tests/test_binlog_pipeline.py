@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import unittest
+import threading
+import multiprocessing
+from io import StringIO
+
+sys.path.append("..")
+from binlog2sql.binlog_pipeline import PrefetchStream, PipelineWriter, QueueMonitor
+from pymysqlreplication.row_event import RowsEvent
+from binlog_fixtures import BinlogDirTestCase
+
+
+class FakeStream(object):
+    """yields events 0..count-1, log_pos is 100 * the next event"""
+
+    def __init__(self, count):
+        self.count = count
+        self.log_file, self.log_pos = ('mysql-bin.000001', 4)
+        self.closed = False
+
+    def __iter__(self):
+        for i in range(self.count):
+            self.log_pos = (i + 1) * 100
+            yield i
+
+    def close(self):
+        self.closed = True
+
+
+class LazyRowsEvent(RowsEvent):
+    """notes the thread its rows are first read in, as pymysqlreplication decodes them then"""
+
+    def __init__(self):
+        self.decoded_in = None
+
+    @property
+    def rows(self):
+        if self.decoded_in is None:
+            self.decoded_in = threading.current_thread().name
+        return []
+
+
+class RowsEventStream(FakeStream):
+
+    def __iter__(self):
+        for i in super(RowsEventStream, self).__iter__():
+            yield LazyRowsEvent()
+
+
+class TestBinlogPipeline(unittest.TestCase):
+
+    def test_prefetch_stream(self):
+        stream = PrefetchStream(FakeStream(50), queue_size=3)
+        self.assertEqual(stream.log_pos, 4)
+        positions = []
+        for event in stream:
+            positions.append((event, stream.log_pos))
+        self.assertEqual(positions, [(i, (i + 1) * 100) for i in range(50)])
+        stream.close()
+        self.assertTrue(stream.stream.closed)
+
+    def test_prefetch_stream_decode(self):
+        stream = PrefetchStream(RowsEventStream(20), queue_size=3)
+        self.assertEqual(sorted(stream.stages()), ['decode', 'fetch'])
+        self.assertEqual(set(event.decoded_in for event in stream), set(['binlog2sql-decode']))
+        stream.close()
+        self.assertFalse(stream.decoder.is_alive())
+
+    def test_prefetch_stream_close_early(self):
+        stream = PrefetchStream(FakeStream(1000), queue_size=2)
+        for event in stream:
+            if event == 5:
+                break
+        stream.close()
+        self.assertFalse(stream.thread.is_alive() or stream.decoder.is_alive())
+
+    def test_pipeline_writer(self):
+        f_out = StringIO()
+        pool = multiprocessing.Pool(2)
+        try:
+            writer = PipelineWriter(f_out, queue_size=2, pool=pool, chunk_rows=2)
+            writer.write(u'USE test;\n')
+            for i in range(5):
+                writer.render('', 'INSERT INTO t VALUES (%s, %s);', [i, u'中文'], ' #start 4')
+            writer.write(u'COMMIT;\n')
+            writer.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        self.assertEqual(f_out.getvalue().splitlines(),
+                         [u'USE test;'] + [u"INSERT INTO t VALUES (%d, '中文'); #start 4" % i for i in range(5)] +
+                         [u'COMMIT;'])
+
+    def test_queue_monitor(self):
+        f_err = StringIO()
+        writer = PipelineWriter(StringIO())
+        monitor = QueueMonitor({'write': writer}, interval=0.01, f_err=f_err)
+        self.assertEqual(monitor.depths(), {'write': 0})
+        writer.close()
+        for _ in range(500):
+            if f_err.getvalue():
+                break
+            time.sleep(0.01)
+        monitor.stop()
+        self.assertIn(u'queue depth: write 0/1000', f_err.getvalue())
+
+
+class TestBinlog2sqlPipeline(BinlogDirTestCase):
+
+    def test_binlog2sql_pipeline(self):
+        self.write_binlogs(3)
+        for flashback in (False, True):
+            expected = self.run_binlog2sql(end_file='mysql-bin.000003', flashback=flashback)
+            self.assertEqual(len(expected), 6)
+            self.assertEqual(self.run_binlog2sql(end_file='mysql-bin.000003', flashback=flashback, pipeline=True,
+                                                 queue_size=1), expected)
+            self.assertEqual(self.run_binlog2sql(end_file='mysql-bin.000003', flashback=flashback,
+                                                 render_processes=2), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
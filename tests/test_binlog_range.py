@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.append("..")
+from binlog2sql.binlog_range import binlog_number, local_binlog_index, BinlogRange, BinlogIndexCache
+from binlog_fixtures import BinlogDirTestCase
+
+# across the rollover of the sequence number from 6 to 7 digits
+BINLOG_INDEX = [('mysql-bin.999998', 1000), ('mysql-bin.999999', 3000), ('mysql-bin.1000000', 500),
+                ('mysql-bin.1000001', 500), ('mysql-bin.1000002', 200)]
+
+
+class TestBinlogRange(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_binlog_number(self):
+        self.assertEqual(binlog_number('mysql-bin.000042'), 42)
+        self.assertTrue(binlog_number('mysql-bin.1000000') > binlog_number('mysql-bin.999999'))
+        for (binlog, size) in BINLOG_INDEX[::-1]:
+            with open(os.path.join(self.dir, binlog), 'wb') as f:
+                f.write(b'\0' * size)
+        with open(os.path.join(self.dir, 'mysql-bin.index'), 'w') as f:
+            f.write('')
+        self.assertEqual(local_binlog_index(self.dir, 'mysql-bin.999999'), BINLOG_INDEX)
+
+    def test_binlog_range(self):
+        binlog_range = BinlogRange(BINLOG_INDEX, 'mysql-bin.999999', 1000, 'mysql-bin.1000002',
+                                   eof=('mysql-bin.1000002', 120))
+        self.assertEqual(binlog_range.binlogs(), ['mysql-bin.999999', 'mysql-bin.1000000', 'mysql-bin.1000001',
+                                                  'mysql-bin.1000002'])
+        self.assertTrue('mysql-bin.1000000' in binlog_range)
+        self.assertFalse('mysql-bin.999998' in binlog_range)
+        self.assertEqual(binlog_range.stops()[-1], ('mysql-bin.1000002', 120))
+        self.assertEqual(binlog_range.total_bytes(), 2000 + 496 + 496 + 116)
+        self.assertEqual(binlog_range.chunks(2), [('mysql-bin.999999', 'mysql-bin.999999'),
+                                                  ('mysql-bin.1000000', 'mysql-bin.1000002')])
+        self.assertEqual(len(binlog_range.chunks(100)), 4)
+        binlog_range.seek('mysql-bin.1000000', 300)
+        self.assertEqual(binlog_range.spans[0].start, 300)
+        self.assertEqual(binlog_range.total_bytes(), 200 + 496 + 116)
+
+        binlog_range = BinlogRange(BINLOG_INDEX, 'mysql-bin.999998', end_file='mysql-bin.999999', end_pos=400)
+        self.assertEqual(binlog_range.stops(), [('mysql-bin.999998', 1000), ('mysql-bin.999999', 400)])
+        self.assertIsNone(BinlogRange([('mysql-bin.000001', None)], 'mysql-bin.000001').total_bytes())
+        self.assertRaises(ValueError, BinlogRange, BINLOG_INDEX, 'mysql-bin.000001')
+
+    def test_binlog_index_cache(self):
+        filename = os.path.join(self.dir, 'binlogs.json')
+        cache = BinlogIndexCache(filename, ttl=60)
+        self.assertIsNone(cache.get('localhost:3306', 'mysql-bin.1000002'))
+        cache.put('localhost:3306', BINLOG_INDEX)
+        self.assertEqual(cache.get('localhost:3306', 'mysql-bin.1000002'), BINLOG_INDEX)
+        # the server moved on to a new binlog
+        self.assertIsNone(cache.get('localhost:3306', 'mysql-bin.1000003'))
+        self.assertIsNone(cache.get('localhost:3307', 'mysql-bin.1000002'))
+        self.assertIsNone(BinlogIndexCache(filename, ttl=-1).get('localhost:3306', 'mysql-bin.1000002'))
+        with open(filename) as f:
+            self.assertEqual(json.load(f)['localhost:3306']['binlogs'][0], ['mysql-bin.999998', 1000])
+        self.assertEqual(os.listdir(self.dir), ['binlogs.json'])
+
+
+class TestBinlog2sqlJobs(BinlogDirTestCase):
+
+    def test_binlog2sql_jobs(self):
+        self.write_binlogs(4)
+        serial = self.run_binlog2sql(end_file='mysql-bin.000004')
+        self.assertEqual(len(serial), 8)
+        self.assertEqual(self.run_binlog2sql(end_file='mysql-bin.000004', jobs=3), serial)
+
+        serial = self.run_binlog2sql(end_file='mysql-bin.000004', flashback=True)
+        self.assertTrue(serial[0].startswith('DELETE FROM `test`.`tbl` WHERE `id`=42'))
+        self.assertEqual(self.run_binlog2sql(end_file='mysql-bin.000004', flashback=True, jobs=3), serial)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import glob
+import unittest
+
+sys.path.append("..")
+from binlog2sql.binlog2sql import Binlog2sql
+from binlog_fixtures import TIMESTAMP, BinlogWriter, BinlogDirTestCase
+
+
+class TestBinlogStatements(BinlogDirTestCase):
+
+    def settings(self, **kwargs):
+        return dict(connection_settings={'host': 'localhost', 'port': 3306, 'charset': 'utf8'},
+                    start_file='mysql-bin.000001', end_file='mysql-bin.000002', binlog_dir=self.dir,
+                    schema_file=self.schema_file, sql_type=['INSERT', 'UPDATE', 'DELETE'], **kwargs)
+
+    def test_binlog2sql_iter_statements(self):
+        self.write_binlogs(2)
+        statements = list(Binlog2sql(**self.settings()).iter_statements())
+        lines = self.run_binlog2sql(end_file='mysql-bin.000002')
+        self.assertEqual([s.sql for s in statements], [line.split(' #')[0] for line in lines])
+        first = statements[0]
+        self.assertEqual((first.log_file, first.start_pos, first.schema, first.table, first.type, first.timestamp),
+                         ('mysql-bin.000001', 4, 'test', 'tbl', 'INSERT', TIMESTAMP + 3600))
+        self.assertEqual(lines[0].split(' #')[1],
+                         'start %s end %s time %s' % (first.start_pos, first.end_pos, first.time))
+        self.assertEqual(first.template, 'INSERT INTO `test`.`tbl`(`id`, `data`) VALUES (%s, %s);')
+        self.assertEqual((first.values, first.row.after), ([11, 'a1'], (11, 'a1')))
+
+        # flashback statements are read back last first
+        flashback = list(Binlog2sql(**self.settings(flashback=True)).iter_statements())
+        lines = self.run_binlog2sql(end_file='mysql-bin.000002', flashback=True)
+        self.assertEqual([s.sql for s in flashback], [line.split(' #')[0] for line in lines])
+        self.assertEqual((flashback[0].type, flashback[0].log_file, flashback[0].row.after),
+                         ('DELETE', 'mysql-bin.000002', (22, 'b2')))
+        self.assertEqual(glob.glob('localhost.3306*'), [])
+        self.assertRaises(ValueError, Binlog2sql(**self.settings(batch_rows=10)).iter_statements)
+
+    def test_transaction_start_pos(self):
+        # a statement-logged query inside a transaction keeps its start, DDL outside of one starts its own
+        writer = BinlogWriter()
+        writer.format_description()
+        # the first transaction starts where reading starts
+        begin_pos = 4
+        writer.query(b'BEGIN')
+        writer.query(b"INSERT INTO tbl VALUES (3, 'statement')")
+        writer.write_rows([(1, b'hello')])
+        writer.xid(10)
+        ddl_pos = len(writer.data)
+        writer.query(b'CREATE TABLE other (id INT)')
+        second_pos = len(writer.data)
+        writer.query(b'BEGIN')
+        writer.write_rows([(2, b'binlog2sql')])
+        writer.xid(11)
+        self.write_binlog('mysql-bin.000001', writer.data)
+
+        settings = self.settings(only_dml=False)
+        settings.pop('end_file')
+        statements = list(Binlog2sql(**settings).iter_statements())
+        self.assertEqual([(s.type, s.start_pos) for s in statements],
+                         [('QUERY', begin_pos), ('INSERT', begin_pos), ('QUERY', ddl_pos), ('INSERT', second_pos)])
+        lines = [line for line in self.run_binlog2sql(only_dml=False) if ' #start ' in line]
+        self.assertEqual([int(line.split(' #start ')[1].split(' ')[0]) for line in lines], [begin_pos, second_pos])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import struct
+import datetime
+import unittest
+import mock
+
+sys.path.append("..")
+from binlog2sql.binlog_time_index import BinlogTimeIndex, binlog_fingerprint
+from binlog_fixtures import TIMESTAMP, BinlogDirTestCase
+
+
+def format_description(timestamp, created):
+    """a FormatDescriptionEvent as the server sends it, ok byte first"""
+    header = struct.pack('<IBIIIH', timestamp, 15, 1, 120, 0, 0)
+    body = struct.pack('<H50sIB', 4, b'5.7.20-log', created, 19) + b'\x00' * 38
+    event = mock.Mock()
+    event.packet.packet.get_all_data.return_value = b'\x00' + header + body
+    return event
+
+
+class TestBinlogTimeIndex(BinlogDirTestCase):
+
+    def test_binlog_fingerprint(self):
+        fingerprint = binlog_fingerprint(format_description(TIMESTAMP, TIMESTAMP))
+        # the event of a dump starting mid-file has created zeroed
+        self.assertEqual(binlog_fingerprint(format_description(TIMESTAMP, 0)), fingerprint)
+        self.assertNotEqual(binlog_fingerprint(format_description(TIMESTAMP + 1, TIMESTAMP + 1)), fingerprint)
+
+    def test_binlog2sql_time_index(self):
+        self.write_binlogs(4)
+        index_dir = os.path.join(self.dir, 'index')
+        os.mkdir(index_dir)
+        start_time = datetime.datetime.fromtimestamp(TIMESTAMP + 3 * 3600).strftime("%Y-%m-%d %H:%M:%S")
+        expected = self.run_binlog2sql(end_file='mysql-bin.000004', start_time=start_time)
+        self.assertEqual(len(expected), 4)
+
+        self.assertEqual(self.run_binlog2sql(end_file='mysql-bin.000004', start_time=start_time,
+                                             time_index_dir=index_dir), expected)
+        self.assertEqual(self.binlog2sql.binlogList, ['mysql-bin.000001', 'mysql-bin.000002', 'mysql-bin.000003',
+                                                      'mysql-bin.000004'])
+        index = BinlogTimeIndex.load(index_dir, 'mysql-bin.000001')
+        self.assertTrue(index.complete)
+        self.assertEqual(index.max_timestamp, TIMESTAMP + 3600)
+
+        self.assertEqual(self.run_binlog2sql(end_file='mysql-bin.000004', start_time=start_time,
+                                             time_index_dir=index_dir), expected)
+        self.assertEqual(self.binlog2sql.binlogList, ['mysql-bin.000003', 'mysql-bin.000004'])
+
+        # a binlog rewritten under the same name invalidates its index
+        with open(os.path.join(self.dir, 'mysql-bin.000001'), 'ab') as f:
+            f.write(b'\0')
+        self.run_binlog2sql(end_file='mysql-bin.000004', start_time=start_time, time_index_dir=index_dir)
+        self.assertEqual(len(self.binlog2sql.binlogList), 4)
+
+    def test_time_index_seek_position(self):
+        index = BinlogTimeIndex('mysql-bin.000001', stride=100, entries=[(0, 120), (1000, 300), (2000, 700)])
+        self.assertEqual(index.seek_position(500), 120)
+        self.assertEqual(index.seek_position(1001), 300)
+        self.assertEqual(index.seek_position(5000), 700)
+        index.add(2000, 750)
+        index.add(2000, 800)
+        self.assertEqual(index.entries[-1], (2000, 800))
+        self.assertFalse(index.is_valid(None, 800))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import shutil
+import datetime
+import tempfile
+import unittest
+from io import StringIO
+from decimal import Decimal
+from collections import OrderedDict
+
+sys.path.append("..")
+from binlog2sql.change_events import JsonChanges, ColumnarWriter, read_columnar, encode_column, time_text
+from pymysqlreplication.column import Column
+from pymysqlreplication.event import QueryEvent
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from binlog_fixtures import TIMESTAMP, BinlogDirTestCase
+
+
+class Packet(object):
+    log_pos = 500
+
+
+def row_event(event_class, table='tbl'):
+    event = event_class.__new__(event_class)
+    event.schema, event.table, event.primary_key = ('test', table, 'id')
+    event.timestamp, event.packet = (1481299200, Packet())
+    return event
+
+
+class TestChangeEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_json_changes(self):
+        f_out = StringIO()
+        changes = JsonChanges(f_out, hex_bytes=4)
+        row = {'before_values': OrderedDict([('id', 1), ('data', b'abc'), ('price', Decimal('1.10'))]),
+               'after_values': OrderedDict([('id', 1), ('data', b'abcd'), ('price', None)])}
+        changes.write_row('mysql-bin.000001', row_event(UpdateRowsEvent), row, 120)
+        change = json.loads(f_out.getvalue())
+        self.assertEqual(change, {'log_file': 'mysql-bin.000001', 'start_pos': 120, 'end_pos': 500,
+                                  'timestamp': 1481299200, 'schema': 'test', 'table': 'tbl', 'type': 'UPDATE',
+                                  'key': ['id'], 'before': {'id': 1, 'data': 'abc', 'price': '1.10'},
+                                  'after': {'id': 1, 'data': {'hex': '61626364'}, 'price': None}})
+
+        f_out = StringIO()
+        row = {'values': OrderedDict([('id', 2), ('at', datetime.datetime(2016, 12, 10, 1, 2, 3)),
+                                      ('tags', set(['b', 'a']))])}
+        JsonChanges(f_out, flashback=True).write_row('mysql-bin.000001', row_event(WriteRowsEvent), row, 120)
+        change = json.loads(f_out.getvalue())
+        self.assertEqual((change['type'], change['before'], change['after']),
+                         ('DELETE', {'id': 2, 'at': '2016-12-10 01:02:03', 'tags': ['a', 'b']}, None))
+
+    def test_encode_column(self):
+        self.assertEqual(encode_column('id', [1, None, 3])[0],
+                         {'name': 'id', 'type': 'int64', 'nulls': 1, 'buffers': [1, 0, 24]})
+        self.assertEqual(encode_column('n', [2 ** 64 - 1])[0]['logical'], 'decimal')
+        self.assertEqual(encode_column('t', [datetime.timedelta(hours=-25, seconds=-1)])[0]['logical'], 'time')
+        self.assertEqual(time_text(datetime.timedelta(seconds=-0.5)), '-00:00:00.500000')
+
+    def test_columnar(self):
+        for compress in (None, 'gzip'):
+            filename = os.path.join(self.dir, 'changes.col')
+            with ColumnarWriter(filename, batch_rows=3, compress=compress) as writer:
+                for i in range(4):
+                    writer.write_row('mysql-bin.000001', row_event(WriteRowsEvent),
+                                     {'values': OrderedDict([('id', i), ('data', u'd中%d' % i if i else None),
+                                                             ('price', Decimal('%d.5' % i))])}, 4)
+                writer.write_row('mysql-bin.000001', row_event(DeleteRowsEvent),
+                                 {'values': OrderedDict([('id', 9), ('data', b'\xff')])}, 4)
+            batches = list(read_columnar(writer.filename))
+            self.assertEqual([(b.type, b.rows) for b in batches], [('INSERT', 3), ('INSERT', 1), ('DELETE', 1)])
+            inserts = batches[0]
+            self.assertEqual((inserts.schema, inserts.table, inserts.key), ('test', 'tbl', ['id']))
+            self.assertEqual(inserts.names, ['seq', 'log_file', 'start_pos', 'end_pos', 'timestamp', 'after.id',
+                                             'after.data', 'after.price'])
+            self.assertEqual(inserts.column('seq'), [0, 1, 2])
+            self.assertEqual(inserts.column('after.data'), [None, u'd中1', u'd中2'])
+            self.assertEqual(inserts.column('after.price'), ['0.5', '1.5', '2.5'])
+            self.assertEqual(inserts.columns[7]['logical'], 'decimal')
+            self.assertEqual((batches[2].column('before.data'), batches[2].column('seq')), ([b'\xff'], [4]))
+
+    def test_columnar_column_types(self):
+        filename = os.path.join(self.dir, 'changes.col')
+        event = row_event(WriteRowsEvent)
+        event.columns = [Column(name='n', type=8, unsigned=True)]
+        alter = QueryEvent.__new__(QueryEvent)
+        alter.schema, alter.query = (b'test', 'ALTER TABLE tbl MODIFY score INT')
+        with ColumnarWriter(filename, batch_rows=1) as writer:
+            for (score, n) in ((None, 1), (1.5, 2), (2, 3), (None, 2 ** 64 - 1)):
+                writer.write_row('mysql-bin.000001', event, {'values': OrderedDict([('score', score), ('n', n)])}, 4)
+            writer.write_query('mysql-bin.000001', alter, 4)
+            writer.write_row('mysql-bin.000001', event, {'values': OrderedDict([('score', 3), ('n', 4)])}, 4)
+        types = [[(c['type'], c.get('logical')) for c in batch.columns[5:]] for batch in read_columnar(filename)]
+        decimal = ('utf8', 'decimal')
+        # float64 from the first batch with a score on, BIGINT UNSIGNED as decimal text, until the ALTER
+        self.assertEqual(types, [[('null', None), decimal], [('float64', None), decimal],
+                                 [('float64', None), decimal], [('null', None), decimal],
+                                 [('int64', None), decimal]])
+
+
+class TestBinlog2sqlOutputFormat(BinlogDirTestCase):
+
+    def test_binlog2sql_output_format(self):
+        self.write_binlogs(2)
+        changes = [json.loads(line) for line in self.run_binlog2sql(end_file='mysql-bin.000002', output_format='json')]
+        self.assertEqual(len(changes), 4)
+        self.assertEqual(changes[0], {'log_file': 'mysql-bin.000001', 'start_pos': 4, 'end_pos': changes[0]['end_pos'],
+                                      'timestamp': TIMESTAMP + 3600, 'schema': 'test', 'table': 'tbl',
+                                      'type': 'INSERT', 'key': ['id'], 'before': None,
+                                      'after': {'id': 11, 'data': 'a1'}})
+        # flashback changes are undone last first, without SLEEP between them
+        for kwargs in ({}, {'jobs': 2}):
+            lines = self.run_binlog2sql(end_file='mysql-bin.000002', output_format='json', flashback=True,
+                                        back_interval=1.0, **kwargs)
+            self.assertEqual([(c['type'], c['before']) for c in map(json.loads, lines)],
+                             [('DELETE', {'id': i, 'data': d}) for (i, d) in
+                              ((22, 'b2'), (21, 'a2'), (12, 'b1'), (11, 'a1'))])
+
+        output_file = os.path.join(self.dir, 'changes.col')
+        self.assertEqual(self.run_binlog2sql(end_file='mysql-bin.000002', output_format='columnar',
+                                             output_file=output_file), [])
+        batches = list(read_columnar(output_file))
+        self.assertEqual([(b.table, b.type, b.rows) for b in batches], [('tbl', 'INSERT', 4)])
+        self.assertEqual(batches[0].column('after.id'), [11, 12, 21, 22])
+        self.assertEqual(batches[0].column('log_file'), ['mysql-bin.000001'] * 2 + ['mysql-bin.000002'] * 2)
+        self.assertRaises(ValueError, self.run_binlog2sql, output_format='columnar')
+
+
+if __name__ == '__main__':
+    unittest.main()
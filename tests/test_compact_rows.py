@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+from collections import OrderedDict
+
+sys.path.append("..")
+from binlog2sql.compact_rows import RowColumns, compact_row
+from binlog2sql.binlog2sql_util import generate_sql_pattern, ColumnProjection
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from binlog_fixtures import BinlogDirTestCase
+
+
+def row_event(event_class, table='tbl_compact'):
+    event = event_class.__new__(event_class)
+    event.schema, event.table, event.primary_key = ('test', table, 'id')
+    return event
+
+
+class TestCompactRows(unittest.TestCase):
+
+    def test_compact_row(self):
+        insert = compact_row(row_event(WriteRowsEvent), {'values': OrderedDict([('id', 1), ('data', 'a')])})
+        self.assertEqual(insert.images(), (None, None, ('id', 'data'), (1, 'a')))
+        self.assertEqual(insert['values'], OrderedDict([('id', 1), ('data', 'a')]))
+        self.assertRaises(KeyError, lambda: insert['before_values'])
+        delete = compact_row(row_event(DeleteRowsEvent), {'values': OrderedDict([('id', 2), ('data', 'b')])})
+        self.assertEqual(delete.images(), (('id', 'data'), (2, 'b'), None, None))
+        # rows of the same shape share their columns
+        self.assertIs(delete.before_columns, insert.after_columns)
+        update = compact_row(row_event(UpdateRowsEvent), {'before_values': OrderedDict([('id', 1)]),
+                                                          'after_values': OrderedDict([('id', 1), ('data', 'c')])})
+        self.assertEqual(update.images(), (('id',), (1,), ('id', 'data'), (1, 'c')))
+        self.assertEqual(update['after_values'], OrderedDict([('id', 1), ('data', 'c')]))
+        self.assertIs(compact_row(row_event(UpdateRowsEvent), update), update)
+
+    def test_row_columns(self):
+        columns = RowColumns.get(('id', 'k', 'data'))
+        self.assertIs(RowColumns.get(('id', 'k', 'data')), columns)
+        self.assertEqual(columns.picker(('data', 'id'))((1, 2, 'a')), ('a', 1))
+        self.assertEqual(columns.picker(('k',))((1, 2, 'a')), (2,))
+        self.assertEqual(columns.values_of((1, 2, 'a'), ('k', 'missing')), [2, None])
+
+    def test_render(self):
+        # compact rows render like the row dicts they come from
+        rows = [(WriteRowsEvent, {'values': OrderedDict([('id', 1), ('data', None)])}),
+                (DeleteRowsEvent, {'values': OrderedDict([('id', 1), ('data', None)])}),
+                (UpdateRowsEvent, {'before_values': OrderedDict([('id', 1), ('data', 'a')]),
+                                   'after_values': OrderedDict([('id', 1), ('data', None)])})]
+        for (event_class, row) in rows:
+            event = row_event(event_class)
+            for flashback in (False, True):
+                for key_columns in (None, ('id',)):
+                    expected = generate_sql_pattern(event, row=row, flashback=flashback, key_columns=key_columns)
+                    pattern = generate_sql_pattern(event, row=compact_row(event, row), flashback=flashback,
+                                                   key_columns=key_columns)
+                    self.assertEqual(pattern, expected)
+        pattern = generate_sql_pattern(row_event(UpdateRowsEvent), row=compact_row(row_event(UpdateRowsEvent),
+                                       rows[2][1]), flashback=True, key_columns=('id',))
+        self.assertEqual(pattern, {'template': 'UPDATE `test`.`tbl_compact` SET `id`=%s, `data`=%s WHERE `id`=%s '
+                                               'LIMIT 1;', 'values': [1, 'a', 1]})
+
+    def test_column_projection(self):
+        projection = ColumnProjection(['data'])
+        event = row_event(UpdateRowsEvent)
+        row = {'before_values': OrderedDict([('id', 1), ('data', 'a'), ('n', 0)]),
+               'after_values': OrderedDict([('id', 1), ('data', 'b'), ('n', 1)])}
+        projected = projection.project(event, row, ('id',))
+        self.assertEqual(projected.images(), (('id', 'data'), (1, 'a'), ('id', 'data'), (1, 'b')))
+        self.assertEqual(projection.project(event, row).images(), (('data',), ('a',), ('data',), ('b',)))
+
+
+class TestBinlog2sqlColumns(BinlogDirTestCase):
+
+    def test_binlog2sql_columns(self):
+        self.assertEqual([line.split(' #')[0] for line in self.run_binlog2sql(columns=['nothing'])],
+                         ['INSERT INTO `test`.`tbl`(`id`) VALUES (1);', 'INSERT INTO `test`.`tbl`(`id`) VALUES (2);'])
+        # a DELETE would be rolled back by an INSERT of the kept columns only
+        self.assertRaises(ValueError, self.run_binlog2sql, columns=['data'], flashback=True)
+        self.assertEqual(self.run_binlog2sql(sql_type=['DELETE']), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
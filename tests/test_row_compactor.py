@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import unittest
+
+sys.path.append("..")
+from binlog2sql.row_compactor import RowCompactor
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from binlog_fixtures import BinlogWriter, BinlogDirTestCase
+
+
+class Packet(object):
+    def __init__(self, log_pos):
+        self.log_pos = log_pos
+
+
+def row_event(event_class, log_pos, table='tbl'):
+    event = event_class.__new__(event_class)
+    event.schema, event.table, event.primary_key = ('test', table, 'id')
+    event.timestamp = 1481299200
+    event.packet = Packet(log_pos)
+    return event
+
+
+class TestRowCompactor(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def net_rows(self, compactor, reverse=False):
+        return [(event.__class__.__name__, event.table, row.images(), e_start_pos, event.packet.log_pos)
+                for (event, row, e_start_pos) in compactor.net_rows(reverse=reverse)]
+
+    def compact(self, memory_bytes):
+        compactor = RowCompactor(os.path.join(self.dir, 'spill'), memory_bytes=memory_bytes)
+        key = ('id',)
+        # a hot row
+        for i in range(100):
+            compactor.add(row_event(UpdateRowsEvent, 200 + i), {'before_values': {'id': 1, 'n': i},
+                                                                'after_values': {'id': 1, 'n': i + 1}}, key, 100 + i)
+        # inserted then deleted
+        compactor.add(row_event(WriteRowsEvent, 400), {'values': {'id': 2, 'n': 0}}, key, 399)
+        compactor.add(row_event(DeleteRowsEvent, 410), {'values': {'id': 2, 'n': 0}}, key, 409)
+        # updated back to where it started
+        compactor.add(row_event(UpdateRowsEvent, 500), {'before_values': {'id': 3, 'n': 0},
+                                                        'after_values': {'id': 3, 'n': 1}}, key, 499)
+        compactor.add(row_event(UpdateRowsEvent, 510), {'before_values': {'id': 3, 'n': 1},
+                                                        'after_values': {'id': 3, 'n': 0}}, key, 509)
+        # another table, same key
+        compactor.add(row_event(DeleteRowsEvent, 600, table='tbl2'), {'values': {'id': 1, 'n': 5}}, key, 599)
+        # no key to track it by
+        self.assertFalse(compactor.add(row_event(WriteRowsEvent, 700), {'values': {'n': 0}}, key, 699))
+        self.assertFalse(compactor.add(row_event(WriteRowsEvent, 700), {'values': {'id': 9}}, (), 699))
+        return compactor
+
+    def test_net_rows(self):
+        # (before columns, before, after columns, after) of the CompactRows
+        expected = [('UpdateRowsEvent', 'tbl', (('id', 'n'), (1, 0), ('id', 'n'), (1, 100)), 100, 299),
+                    ('DeleteRowsEvent', 'tbl2', (('id', 'n'), (1, 5), None, None), 599, 600)]
+        for memory_bytes in (1024 * 1024, 1, 300):
+            compactor = self.compact(memory_bytes)
+            self.assertEqual(self.net_rows(compactor), expected)
+            self.assertEqual(self.net_rows(compactor, reverse=True), expected[::-1])
+            self.assertEqual(compactor.db is not None, memory_bytes < 1024 * 1024)
+            compactor.clear()
+            self.assertEqual(self.net_rows(compactor), [])
+            compactor.close()
+            self.assertEqual(os.listdir(self.dir), [])
+
+
+class TestBinlog2sqlCompact(BinlogDirTestCase):
+
+    def test_binlog2sql_compact(self):
+        writer = BinlogWriter()
+        writer.format_description()
+        writer.query(b'BEGIN')
+        writer.write_rows([(1, b'hello'), (2, b'binlog2sql'), (3, b'a')])
+        writer.xid(10)
+        updates_pos = len(writer.data)
+        for n in range(5):
+            writer.query(b'BEGIN')
+            writer.update_rows([((1, b'hello%d' % n if n else b'hello'), (1, b'hello%d' % (n + 1)))])
+            writer.xid(11 + n)
+        writer.query(b'BEGIN')
+        writer.delete_rows([(2, b'binlog2sql')])
+        # moves row 3 to 4
+        writer.update_rows([((3, b'a'), (4, b'b'))])
+        writer.xid(20)
+        self.write_binlog('mysql-bin.000001', writer.data)
+
+        self.assertEqual(len(self.run_binlog2sql()), 10)
+        lines = [line.split(' #')[0] for line in self.run_binlog2sql(compact=True)]
+        self.assertEqual(lines, ["INSERT INTO `test`.`tbl`(`id`, `data`) VALUES (1, 'hello5');",
+                                 "INSERT INTO `test`.`tbl`(`id`, `data`) VALUES (4, 'b');"])
+        lines = [line.split(' #')[0]
+                 for line in self.run_binlog2sql(compact=True, flashback=True, where_key_only=True)]
+        self.assertEqual(lines, ['DELETE FROM `test`.`tbl` WHERE `id`=4 LIMIT 1;',
+                                 'DELETE FROM `test`.`tbl` WHERE `id`=1 LIMIT 1;'])
+        # after the INSERT, first before-images are restored. Every state goes through the spill file
+        lines = [line.split(' #')[0]
+                 for line in self.run_binlog2sql(start_pos=updates_pos, flashback=True, compact=True, compact_memory=1)]
+        self.assertEqual(lines, ["DELETE FROM `test`.`tbl` WHERE `id`=4 AND `data`='b' LIMIT 1;",
+                                 "INSERT INTO `test`.`tbl`(`id`, `data`) VALUES (3, 'a');",
+                                 "INSERT INTO `test`.`tbl`(`id`, `data`) VALUES (2, 'binlog2sql');",
+                                 "UPDATE `test`.`tbl` SET `id`=1, `data`='hello' WHERE `id`=1 AND `data`='hello5' "
+                                 "LIMIT 1;"])
+        self.assertEqual(glob.glob(os.path.join(os.getcwd(), 'localhost.3306.compact*')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+import mock
+
+sys.path.append("..")
+from binlog2sql.sql_applier import SqlApplier, split_position_comment, query_record, unescape_query
+from binlog_fixtures import BinlogDirTestCase
+
+
+class FakeConnection(object):
+    """stand-in for a pymysql connection, logging statements and commits of all connections in order"""
+
+    def __init__(self, log, fail_on=None):
+        self.log = log
+        self.fail_on = fail_on
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        if sql == self.fail_on:
+            raise ValueError('failed: %s' % sql)
+        self.log.append((self, sql))
+
+    def commit(self):
+        self.log.append((self, 'COMMIT'))
+
+    def rollback(self):
+        self.log.append((self, 'ROLLBACK'))
+
+    def close(self):
+        pass
+
+
+class TestSqlApplier(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+
+    def applier(self, workers=2, fail_on=None, **kwargs):
+        return SqlApplier({'host': 'localhost'}, workers=workers,
+                          connect=lambda **settings: FakeConnection(self.log, fail_on), **kwargs)
+
+    def statements(self, connection=None):
+        return [sql for (c, sql) in self.log if connection is None or c is connection]
+
+    def test_split_position_comment(self):
+        self.assertEqual(split_position_comment("INSERT INTO t VALUES (1); #start 4 end 120 time 2016-12-10 13:03:38"),
+                         ('INSERT INTO t VALUES (1);', '4'))
+        self.assertEqual(split_position_comment('ALTER TABLE t ADD c INT;'), ('ALTER TABLE t ADD c INT;', None))
+
+    def test_same_key_same_worker(self):
+        applier = self.applier(workers=3)
+        for i in range(30):
+            applier.write('%x\tUPDATE t SET c=%d WHERE id=%d; #start 4 end 9 time t\n' % (i % 5, i, i % 5))
+        applier.close()
+        executed = [sql for sql in self.statements() if sql != 'COMMIT']
+        self.assertEqual(sorted(executed), sorted('UPDATE t SET c=%d WHERE id=%d;' % (i, i % 5) for i in range(30)))
+        for key in range(5):
+            connections = set(c for (c, sql) in self.log if sql.endswith('WHERE id=%d;' % key))
+            self.assertEqual(len(connections), 1)
+            rows = [sql for sql in executed if sql.endswith('WHERE id=%d;' % key)]
+            self.assertEqual(rows, ['UPDATE t SET c=%d WHERE id=%d;' % (i, key) for i in range(key, 30, 5)])
+
+    def test_commit_every(self):
+        applier = self.applier(workers=1, commit_every=2)
+        # three source transactions: 3 rows, 1 row, 1 row. commits never split a transaction
+        for (i, start) in enumerate([4, 4, 4, 80, 120]):
+            applier.write('1\tINSERT INTO t VALUES (%d); #start %d end 9 time t\n' % (i, start))
+        applier.close()
+        self.assertEqual(self.statements(), ['INSERT INTO t VALUES (0);', 'INSERT INTO t VALUES (1);',
+                                             'INSERT INTO t VALUES (2);', 'COMMIT', 'INSERT INTO t VALUES (3);',
+                                             'INSERT INTO t VALUES (4);', 'COMMIT'])
+
+    def test_barrier(self):
+        applier = self.applier(workers=2)
+        applier.write('1\tINSERT INTO t VALUES (1); #start 4 end 9 time t\n'
+                      '2\tINSERT INTO t VALUES (2); #start 4 end 9 time t\n')
+        applier.write(query_record('USE test;\nALTER TABLE t\n  ADD c INT;') + '\n')
+        applier.write('1\tINSERT INTO t VALUES (3); #start 90 end 99 time t\n')
+        applier.close()
+        executed = self.statements()
+        ddl = executed.index('ALTER TABLE t\n  ADD c INT;')
+        self.assertEqual(executed[ddl - 1], 'USE test;')
+        self.assertEqual(sorted(executed[:ddl - 1]), ['COMMIT', 'COMMIT', 'INSERT INTO t VALUES (1);',
+                                                      'INSERT INTO t VALUES (2);'])
+        self.assertEqual(executed[ddl + 1:], ['COMMIT', 'INSERT INTO t VALUES (3);', 'COMMIT'])
+
+    def test_query_record(self):
+        sql = "USE test;\nALTER TABLE t\n\tADD COLUMN c INT,\n\tADD COLUMN d INT DEFAULT 'a\\\\nb\\r';"
+        self.assertEqual(query_record(sql).count('\n'), 0)
+        self.assertEqual(unescape_query(query_record(sql)[2:]), sql)
+
+    def test_multi_line_ddl(self):
+        # continuation lines starting with a tab, or with hex letters and a tab, look like row records
+        ddl = 'ALTER TABLE t\n\tADD COLUMN c INT,\n\tADD COLUMN d INT;'
+        add = 'ALTER TABLE t\nadd\tINDEX (c);'
+        applier = self.applier(workers=2)
+        for sql in (ddl, add):
+            applier.write(query_record(sql) + '\n')
+        applier.close()
+        self.assertEqual([sql for sql in self.statements() if sql != 'COMMIT'], [ddl, add])
+
+    def test_not_a_record(self):
+        applier = self.applier(workers=1)
+        self.assertRaises(ValueError, applier.write, 'ALTER TABLE t ADD c INT;\n')
+        applier.close()
+
+    def test_error(self):
+        applier = self.applier(workers=1, fail_on='INSERT INTO t VALUES (2);')
+        for i in range(1, 4):
+            applier.write('1\tINSERT INTO t VALUES (%d); #start 4 end 9 time t\n' % i)
+        self.assertRaises(ValueError, applier.close)
+        self.assertEqual(self.statements(), ['INSERT INTO t VALUES (1);', 'ROLLBACK'])
+
+
+class TestBinlog2sqlApply(BinlogDirTestCase):
+
+    def test_binlog2sql_apply(self):
+        self.write_binlogs(2)
+        executed = []
+        connection = mock.Mock()
+        connection.cursor.return_value.execute.side_effect = executed.append
+        with mock.patch('pymysql.connect', return_value=connection):
+            lines = self.run_binlog2sql(end_file='mysql-bin.000002', flashback=True,
+                                        apply_settings={'host': 'target'}, apply_workers=2)
+        self.assertEqual(lines, [])
+        self.assertEqual(sorted(executed), ['DELETE FROM `test`.`tbl` WHERE `id`=%d AND `data`=%s LIMIT 1;' % (i, v)
+                                            for (i, v) in [(11, "'a1'"), (12, "'b1'"), (21, "'a2'"), (22, "'b2'")]])
+        self.assertTrue(connection.commit.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+import mock
+from io import StringIO
+
+sys.path.append("..")
+from binlog2sql.sql_output import OutputSink, FileSink, open_sink
+from binlog_fixtures import BinlogDirTestCase
+
+
+class TestSqlOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'out.sql')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, filename):
+        with (gzip.open(filename, 'rb') if filename.endswith('.gz') else open(filename, 'rb')) as f:
+            return f.read().decode('utf-8')
+
+    def test_output_sink(self):
+        f = StringIO()
+        sink = OutputSink(f, buffer_size=10)
+        sink.write(u'SELECT 1;\n')
+        self.assertEqual(f.getvalue(), u'SELECT 1;\n')
+        sink.write(u'中文;\n')
+        self.assertEqual(f.getvalue(), u'SELECT 1;\n')
+        sink.close()
+        self.assertEqual(f.getvalue(), u'SELECT 1;\n中文;\n')
+        with mock.patch('sys.stdout', new_callable=StringIO):
+            self.assertIs(open_sink().f, sys.stdout)
+
+    def test_file_sink(self):
+        with FileSink(self.filename, buffer_size=4) as sink:
+            sink.write(u'INSERT 中文;\n')
+        self.assertEqual(sink.files, [self.filename])
+        self.assertEqual(self.read(self.filename), u'INSERT 中文;\n')
+
+    def test_file_sink_rotate(self):
+        sink = FileSink(self.filename, rotate_bytes=20, compress='gzip')
+        for i in range(5):
+            sink.write(u'INSERT %d;\n' % i)
+        # a chunk ending in the middle of a line
+        sink.write(u'INSERT 5;\nINS')
+        sink.write(u'ERT 6;\nINSERT 7;\n')
+        sink.close()
+        self.assertEqual(sink.files, ['%s.%04d.gz' % (self.filename, i) for i in range(4)])
+        contents = [self.read(filename) for filename in sink.files]
+        self.assertEqual(contents, [u'INSERT 0;\nINSERT 1;\n', u'INSERT 2;\nINSERT 3;\n',
+                                    u'INSERT 4;\nINSERT 5;\nINSERT 6;\n', u'INSERT 7;\n'])
+
+    def test_rotate_seconds(self):
+        sink = FileSink(self.filename, rotate_seconds=60)
+        sink.write(u'INSERT 0;\n')
+        with mock.patch('time.time', return_value=sink._opened + 61):
+            sink.write(u'INSERT 1;\n')
+        sink.close()
+        self.assertEqual([self.read(filename) for filename in sink.files], [u'INSERT 0;\n', u'INSERT 1;\n'])
+
+    def test_sync_resume(self):
+        sink = FileSink(self.filename, rotate_bytes=20)
+        for i in range(3):
+            sink.write(u'INSERT %d;\n' % i)
+        state = sink.sync()
+        self.assertEqual(state, {'files': [self.filename + '.0000', self.filename + '.0001'], 'offset': 10})
+        for i in range(3, 6):
+            sink.write(u'INSERT %d;\n' % i)
+        # killed before the next checkpoint
+        sink.drain()
+        sink = FileSink(self.filename, rotate_bytes=20, resume=state)
+        sink.write(u'INSERT 3;\n')
+        sink.close()
+        self.assertEqual([self.read(filename) for filename in sink.files],
+                         [u'INSERT 0;\nINSERT 1;\n', u'INSERT 2;\nINSERT 3;\n'])
+        self.assertFalse(os.path.exists(self.filename + '.0002'))
+
+    def test_resume_lost_output(self):
+        sink = FileSink(self.filename)
+        sink.write(u'INSERT 0;\nINSERT 1;\n')
+        state = sink.sync()
+        sink.close()
+        with open(self.filename, 'r+b') as f:
+            f.truncate(5)
+        self.assertRaises(ValueError, FileSink, self.filename, resume=state)
+        os.remove(self.filename)
+        self.assertRaises(ValueError, FileSink, self.filename, resume=state)
+
+    def test_unknown_compress(self):
+        self.assertRaises(ValueError, FileSink, self.filename, compress='lzma')
+
+
+class TestBinlog2sqlOutputFile(BinlogDirTestCase):
+
+    def test_binlog2sql_output_file(self):
+        self.write_binlogs(2)
+        expected = self.run_binlog2sql(end_file='mysql-bin.000002', flashback=True)
+        output_file = os.path.join(self.dir, 'rollback.sql')
+        self.assertEqual(self.run_binlog2sql(end_file='mysql-bin.000002', flashback=True, output_file=output_file,
+                                             output_compress='gzip'), [])
+        with gzip.open(output_file + '.gz', 'rb') as f:
+            self.assertEqual(f.read().decode('utf-8').splitlines(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
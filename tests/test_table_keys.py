@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.append("..")
+from binlog2sql.table_keys import TableKeyCache, server_table_keys, snapshot_table_keys, table_fingerprint
+from binlog2sql.binlog_file_reader import SchemaSnapshot
+from binlog_fixtures import BinlogDirTestCase
+
+
+class FakeCursor(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, sql, args=None):
+        self.executed.append(args)
+
+    def fetchall(self):
+        return self.rows
+
+
+class Column(object):
+    def __init__(self, name, type):
+        self.name, self.type = (name, type)
+
+
+class RowsEvent(object):
+    def __init__(self, columns, primary_key):
+        self.columns = [Column(name, 3) for name in columns]
+        self.primary_key = primary_key
+
+
+class TestTableKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_server_table_keys(self):
+        cursor = FakeCursor([('PRIMARY', 'a', 'NO'), ('PRIMARY', 'b', 'NO'), ('uk', 'c', 'NO')])
+        self.assertEqual(server_table_keys(cursor, 'test', 'tbl'), ['a', 'b'])
+        self.assertEqual(cursor.executed, [('test', 'tbl')])
+        # the shortest unique key of NOT NULL columns
+        cursor = FakeCursor([('uk1', 'a', 'NO'), ('uk1', 'b', 'NO'), ('uk2', 'c', 'YES'), ('uk3', 'd', 'NO')])
+        self.assertEqual(server_table_keys(cursor, 'test', 'tbl'), ['d'])
+        self.assertEqual(server_table_keys(FakeCursor([('uk', 'c', 'YES')]), 'test', 'tbl'), [])
+
+    def test_snapshot_table_keys(self):
+        snapshot = SchemaSnapshot({'test': {'tbl': [{'COLUMN_NAME': 'id', 'COLUMN_KEY': 'PRI'},
+                                                    {'COLUMN_NAME': 'data', 'COLUMN_KEY': 'UNI'}]}})
+        self.assertEqual(snapshot_table_keys(snapshot, 'test', 'tbl'), ['id'])
+        self.assertEqual(snapshot_table_keys(snapshot, 'test', 'missing'), [])
+
+    def test_cache(self):
+        loaded = []
+
+        def load(schema, table):
+            loaded.append((schema, table))
+            return ['id']
+
+        filename = os.path.join(self.dir, 'keys.json')
+        cache = TableKeyCache(load, filename=filename)
+        self.assertEqual(cache.get('test', 'tbl'), ('id',))
+        self.assertEqual(cache.get('test', 'tbl'), ('id',))
+        cache.get('test', 'tbl2')
+        cache.get('other', 'tbl')
+        self.assertEqual(len(loaded), 3)
+        cache.invalidate('test', 'tbl')
+        self.assertEqual(cache.get('test', 'tbl'), ('id',))
+        self.assertEqual(len(loaded), 4)
+        cache.invalidate('test')
+        self.assertEqual(sorted(cache.tables), [('other', 'tbl')])
+
+        cache.save()
+        with open(filename) as f:
+            self.assertEqual(json.load(f), {'other': {'tbl': {'key': ['id'], 'fingerprint': None}}})
+
+    def test_fingerprint(self):
+        loaded = []
+
+        def load(schema, table):
+            loaded.append((schema, table))
+            return ['id']
+
+        event = RowsEvent(['id', 'data'], 'id')
+        self.assertEqual(table_fingerprint(event), table_fingerprint(RowsEvent(['id', 'data'], ('id',))))
+        self.assertNotEqual(table_fingerprint(event), table_fingerprint(RowsEvent(['id', 'data', 'c'], 'id')))
+        self.assertNotEqual(table_fingerprint(event), table_fingerprint(RowsEvent(['id', 'data'], None)))
+
+        filename = os.path.join(self.dir, 'keys.json')
+        cache = TableKeyCache(load, filename=filename)
+        for table in ('tbl', 'tbl2'):
+            cache.get('test', table, fingerprint=lambda: table_fingerprint(event))
+        cache.save()
+        self.assertEqual(len(loaded), 2)
+
+        # same tables: keys come from the file
+        cache = TableKeyCache(load, filename=filename)
+        self.assertEqual(cache.get('test', 'tbl', fingerprint=lambda: table_fingerprint(event)), ('id',))
+        self.assertEqual(len(loaded), 2)
+        self.assertFalse(cache.dirty)
+        # a table changed since the file was written is looked up again, the others are kept
+        changed = RowsEvent(['id', 'data', 'c'], 'id')
+        cache.get('test', 'tbl2', fingerprint=lambda: table_fingerprint(changed))
+        self.assertEqual(loaded[2:], [('test', 'tbl2')])
+        cache.save()
+        with open(filename) as f:
+            saved = json.load(f)['test']
+        self.assertEqual((saved['tbl']['fingerprint'], saved['tbl2']['fingerprint']),
+                         (table_fingerprint(event), table_fingerprint(changed)))
+
+        # keys of a file without fingerprints are never trusted
+        with open(filename, 'w') as f:
+            json.dump({'test': {'tbl': ['data']}}, f)
+        cache = TableKeyCache(load, filename=filename)
+        self.assertEqual(cache.get('test', 'tbl', fingerprint=lambda: table_fingerprint(event)), ('id',))
+
+    def test_update(self):
+        cache = TableKeyCache(lambda schema, table: ['id'])
+        cache.get('test', 'tbl')
+        self.assertTrue(cache.dirty)
+        worker = TableKeyCache(lambda schema, table: ['uid'])
+        worker.get('test', 'tbl2', fingerprint=lambda: 'f')
+        cache.dirty = False
+        cache.update(worker.entries())
+        self.assertTrue(cache.dirty)
+        self.assertEqual(cache.entries(), {('test', 'tbl'): (('id',), None), ('test', 'tbl2'): (('uid',), 'f')})
+
+
+class TestBinlog2sqlWhereKeyOnly(BinlogDirTestCase):
+
+    def test_binlog2sql_where_key_only(self):
+        keys_file = os.path.join(self.dir, 'keys.json')
+        lines = self.run_binlog2sql(flashback=True, where_key_only=True, table_keys_file=keys_file)
+        self.assertEqual([line.split(' #')[0] for line in lines], ['DELETE FROM `test`.`tbl` WHERE `id`=2 LIMIT 1;',
+                                                                   'DELETE FROM `test`.`tbl` WHERE `id`=1 LIMIT 1;'])
+        with open(keys_file) as f:
+            self.assertEqual(json.load(f)['test']['tbl']['key'], ['id'])
+
+    def test_binlog2sql_where_key_only_jobs(self):
+        # keys looked up in worker processes are saved too
+        self.write_binlogs(3)
+        keys_file = os.path.join(self.dir, 'keys.json')
+        expected = self.run_binlog2sql(end_file='mysql-bin.000003', where_key_only=True)
+        self.assertEqual(self.run_binlog2sql(end_file='mysql-bin.000003', where_key_only=True, jobs=2,
+                                             table_keys_file=keys_file), expected)
+        with open(keys_file) as f:
+            self.assertEqual(json.load(f)['test']['tbl']['key'], ['id'])
+
+
+if __name__ == '__main__':
+    unittest.main()